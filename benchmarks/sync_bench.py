@@ -0,0 +1,254 @@
+"""End-to-end sync benchmark.
+
+Starts a real ClipboardServer on localhost and N ClipboardClients in one
+process, all backed by in-memory clipboards, then copies a mix of payloads on
+them in turn and measures how long each takes to reach every other clipboard.
+
+    python benchmarks/sync_bench.py --clients 4 --mix text:1k:50,image:2m:10,file:100m:2
+    python benchmarks/sync_bench.py --output new.json --compare baseline.json
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import platform
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bounceboard import __version__  # noqa: E402
+from bounceboard.clipboard.manager import ClipboardManager  # noqa: E402
+from bounceboard.clipboard.notify import ChangeNotifier  # noqa: E402
+from bounceboard.service import ClipboardClient, ClipboardServer  # noqa: E402
+
+DEFAULT_MIX = "text:1k:50,text:256k:10,image:2m:10,file:32m:2"
+KINDS = {"text": "text/plain", "image": "image/png", "file": "application/x-file"}
+UNITS = {"": 1, "k": 1024, "m": 1024 * 1024, "g": 1024 * 1024 * 1024}
+# Relative slowdown in a compared metric that fails the run
+DEFAULT_TOLERANCE = 0.25
+
+
+class MemoryClipboard:
+    """In-memory clipboard backend that reports when payloads arrive."""
+
+    def __init__(self, name, loop):
+        self.name = name
+        self.content = None
+        self.notifier = None
+        self.arrivals = {}
+        self._loop = loop
+
+    def get_content(self):
+        return self.content
+
+    def set_content(self, clipboard, temp_dir=None):
+        # Runs in an executor thread, like a real backend
+        arrived = time.perf_counter()
+        self.content = clipboard
+        future = self.arrivals.get(clipboard[0]["hash"])
+        if future:
+            self._loop.call_soon_threadsafe(lambda: future.done() or future.set_result(arrived))
+        return True
+
+    def create_notifier(self):
+        self.notifier = ChangeNotifier()
+        return self.notifier
+
+    def copy(self, clipboard):
+        """Simulate the user copying something on this machine."""
+        self.content = clipboard
+        if self.notifier:
+            self.notifier.notify()
+
+    def manager(self):
+        return ClipboardManager(self.get_content, self.set_content, self.create_notifier, fingerprint=None)
+
+
+def parse_size(text):
+    text = text.strip().lower().rstrip("b")
+    unit = text[-1] if text[-1:] in UNITS else ""
+    return int(float(text[: len(text) - len(unit)]) * UNITS[unit])
+
+
+def parse_mix(text):
+    """kind:size:count,... into a list of (kind, size, count)."""
+    mix = []
+    for item in text.split(","):
+        kind, size, count = item.split(":")
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError(f"Unknown payload kind {kind!r}, expected one of {sorted(KINDS)}")
+        mix.append((kind, parse_size(size), int(count)))
+    return mix
+
+
+def make_payload(kind, size, seq):
+    """Unique payload per update, so caches and deltas can't skip the transfer."""
+    if kind == "text":
+        line = f"update {seq} the quick brown fox jumps over the lazy dog {os.urandom(8).hex()}\n".encode()
+        data = (line * (size // len(line) + 1))[:size]
+    else:
+        data = os.urandom(size)
+    header = {"type": KINDS[kind], "size": len(data), "hash": hashlib.sha256(data).hexdigest()}
+    if kind == "file":
+        header["text"] = f"bench-{seq}.bin"
+    return header, data
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(latencies, payload_bytes, elapsed):
+    return {
+        "updates": len(latencies),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 3),
+            "p90": round(percentile(latencies, 90) * 1000, 3),
+            "p99": round(percentile(latencies, 99) * 1000, 3),
+            "max": round(max(latencies) * 1000, 3),
+        },
+        "bytes": payload_bytes,
+        "throughput_mb_s": round(payload_bytes / elapsed / (1024 * 1024), 2) if elapsed else 0.0,
+    }
+
+
+async def wait_connected(server, count, timeout):
+    deadline = time.monotonic() + timeout
+    while server.clients < count:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Only {server.clients} of {count} clients connected")
+        await asyncio.sleep(0.05)
+
+
+async def run(args):
+    loop = asyncio.get_running_loop()
+    server_board = MemoryClipboard("server", loop)
+    server = ClipboardServer(port=0, key="bench", manager=server_board.manager())
+    await server.listen(host="127.0.0.1")
+
+    boards = [MemoryClipboard(f"client-{i}", loop) for i in range(args.clients)]
+    url = f"ws://127.0.0.1:{server.port}/ws/?key=bench"
+    clients = [asyncio.create_task(ClipboardClient(url, manager=board.manager()).start()) for board in boards]
+    results = {}
+    try:
+        await wait_connected(server, args.clients, args.timeout)
+        everyone = [server_board] + boards
+        seq = 0
+        started = time.perf_counter()
+        delivered_total = 0
+        for kind, size, count in args.mix:
+            latencies = []
+            delivered = 0
+            mix_started = time.perf_counter()
+            for _ in range(count):
+                seq += 1
+                clipboard = make_payload(kind, size, seq)
+                # Rotate the copying machine so client and server send paths are both covered
+                source = everyone[seq % len(everyone)]
+                targets = [board for board in everyone if board is not source]
+                futures = [loop.create_future() for _ in targets]
+                for board, future in zip(targets, futures):
+                    board.arrivals[clipboard[0]["hash"]] = future
+                copied = time.perf_counter()
+                source.copy(clipboard)
+                arrived = await asyncio.wait_for(asyncio.gather(*futures), args.timeout)
+                latencies.extend(t - copied for t in arrived)
+                delivered += size * len(targets)
+                for board in targets:
+                    del board.arrivals[clipboard[0]["hash"]]
+            delivered_total += delivered
+            key = f"{kind}:{size}"
+            results[key] = summarize(latencies, delivered, time.perf_counter() - mix_started)
+            print(f"{key}: {json.dumps(results[key]['latency_ms'])}", file=sys.stderr)
+        elapsed = time.perf_counter() - started
+    finally:
+        for task in clients:
+            task.cancel()
+        await asyncio.gather(*clients, return_exceptions=True)
+        await server.close()
+
+    return {
+        "version": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "clients": args.clients,
+        "mix": [f"{kind}:{size}:{count}" for kind, size, count in args.mix],
+        "elapsed_s": round(elapsed, 3),
+        "throughput_mb_s": round(delivered_total / elapsed / (1024 * 1024), 2),
+        "peak_rss_bytes": peak_rss(),
+        "results": results,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Regressions against a baseline report, as human-readable strings."""
+    regressions = []
+    for key, result in report["results"].items():
+        base = baseline.get("results", {}).get(key)
+        if not base:
+            continue
+        for pct in ("p50", "p90"):
+            new, old = result["latency_ms"][pct], base["latency_ms"][pct]
+            if new > old * (1 + tolerance):
+                regressions.append(f"{key} {pct} latency {old:.1f}ms -> {new:.1f}ms")
+        new, old = result["throughput_mb_s"], base["throughput_mb_s"]
+        if new < old * (1 - tolerance):
+            regressions.append(f"{key} throughput {old:.1f}MB/s -> {new:.1f}MB/s")
+    if report["peak_rss_bytes"] > baseline.get("peak_rss_bytes", float("inf")) * (1 + tolerance):
+        regressions.append(f"peak RSS {baseline['peak_rss_bytes']} -> {report['peak_rss_bytes']} bytes")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="bounceboard end-to-end sync benchmark")
+    parser.add_argument("-n", "--clients", type=int, default=4, help="simulated clients (default: 4)")
+    parser.add_argument(
+        "--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+        help=f"payloads as kind:size:count,... with kinds {sorted(KINDS)} (default: {DEFAULT_MIX})",
+    )
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for one update (default: 120)")
+    parser.add_argument("-o", "--output", metavar="FILE", help="write the JSON report to FILE")
+    parser.add_argument("--compare", metavar="FILE", help="fail if slower than this earlier JSON report")
+    parser.add_argument(
+        "--tolerance", type=float, default=DEFAULT_TOLERANCE,
+        help=f"allowed relative regression for --compare (default: {DEFAULT_TOLERANCE})",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="show bounceboard logging")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format="%(message)s")
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,9 +7,6 @@ import atexit
 import shutil
 import tempfile
 import os
-import time
-
-from .service import ClipboardServer, ClipboardClient
 
 
 def generate_key():
@@ -53,25 +50,15 @@ def get_ip_addresses():
     return sorted(ips)
 
 
-save_dir = None
-
-def save_clipboard_update(header, data):
-    if not save_dir:
-        return
-
-    header = header.copy()
-    header["time"] = time.time()
+history = None
 
-    day_dir = os.path.join(save_dir, time.strftime("%Y-%m-%d"))
-    os.makedirs(day_dir, exist_ok=True)
+def get_history():
+    return history
 
-    base_name = header["hash"]
-    with open(os.path.join(day_dir, f"{base_name}.json"), "w") as f:
-        import json
 
-        json.dump(header, f)
-    with open(os.path.join(day_dir, f"{base_name}.bin"), "wb") as f:
-        f.write(data)
+def save_clipboard_update(header, data):
+    if history:
+        history.append(header, data)
 
 
 temp_dir = None
@@ -83,6 +70,11 @@ def init_temp_dir():
 
 def cleanup():
     global temp_dir
+    from . import tracing
+
+    tracing.close_trace()
+    if history:
+        history.close()
     if temp_dir and os.path.exists(temp_dir):
         shutil.rmtree(temp_dir)
 
@@ -94,6 +86,8 @@ def signal_handler(signum, frame):
 
 
 def parse_args():
+    from .rooms import MAX_ROOMS
+
     parser = argparse.ArgumentParser(description="Clipboard synchronization server/client")
     parser.add_argument("-v", "--verbose", action="store_true", help="enable debug logging")
     parser.add_argument("--version", action="store_true", help="show version and exit")
@@ -104,14 +98,44 @@ def parse_args():
         help="enable xclip -alt-text support (Linux only, see README)",
     )
     parser.add_argument("--save", metavar="DIR", help="save clipboard history to specified directory")
+    parser.add_argument(
+        "--save-max-age", type=float, metavar="DAYS", help="drop saved history older than this many days"
+    )
+    parser.add_argument(
+        "--save-max-size", type=int, metavar="MB", help="keep saved history payloads under this total size"
+    )
+    parser.add_argument("--trace", metavar="FILE", help="write a Chrome trace of every applied update to FILE")
     subparsers = parser.add_subparsers(dest="mode", help="operating mode")
 
     server_parser = subparsers.add_parser("server", help="run in server mode")
     server_parser.add_argument("-p", "--port", type=int, default=4444, help="port to listen on (default: 4444)")
     server_parser.add_argument("-k", "--key", help="custom access key (default: auto-generated)")
+    server_parser.add_argument(
+        "--cache", type=int, default=128, metavar="MB", help="payload cache size in MB (default: 128)"
+    )
+    server_parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="relay only: keep the clipboard in memory and never touch the local clipboard",
+    )
+    server_parser.add_argument(
+        "--rooms",
+        action="store_true",
+        help="host a separate headless room for every key (the server key only reads /metrics)",
+    )
+    server_parser.add_argument(
+        "--max-rooms",
+        type=int,
+        default=MAX_ROOMS,
+        metavar="N",
+        help=f"with --rooms, rooms open at once; past this the longest-idle one is closed (default: {MAX_ROOMS})",
+    )
 
     client_parser = subparsers.add_parser("client", help="run in client mode")
     client_parser.add_argument("url", help="server URL with key (https://host:port/?key=access_key)")
+    client_parser.add_argument(
+        "--metrics", type=float, metavar="SECONDS", help="log sync metrics every SECONDS"
+    )
 
     args = parser.parse_args()
     if args.version:
@@ -127,15 +151,29 @@ def parse_args():
 
 
 def main():
+    from .service import ClipboardServer, ClipboardClient
+
     args = parse_args()
     setup_logging(args.verbose)
 
-    global save_dir
+    global history
     if args.save:
+        from .history import HistoryLog
+
         save_dir = os.path.abspath(args.save)
-        os.makedirs(save_dir, exist_ok=True)
+        history = HistoryLog(
+            save_dir,
+            max_age=args.save_max_age * 86400 if args.save_max_age else None,
+            max_bytes=args.save_max_size * 1024 * 1024 if args.save_max_size else None,
+        )
         logging.info(f"Saving clipboard history to {save_dir}")
 
+    if args.trace:
+        from . import tracing
+
+        tracing.open_trace(args.trace)
+        logging.info(f"Writing update traces to {args.trace}")
+
     if args.xclip_alt:
         os.environ["BB_XCLIP_ALT"] = "1"
 
@@ -147,13 +185,20 @@ def main():
         if "?key=" not in args.url:
             print("Error: URL must include the key parameter (e.g., ws://host:port/?key=abcd1234)")
             sys.exit(1)
-        client = ClipboardClient(args.url)
+        client = ClipboardClient(args.url, metrics_interval=args.metrics)
         try:
             asyncio.run(client.start())
         except SystemExit:
             pass
     else:
-        server = ClipboardServer(port=args.port, key=args.key)
+        server = ClipboardServer(
+            port=args.port,
+            key=args.key,
+            cache_size=args.cache * 1024 * 1024,
+            rooms=args.rooms,
+            headless=args.headless,
+            max_rooms=args.max_rooms,
+        )
         asyncio.run(server.start())
 
 
@@ -0,0 +1,85 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from aiohttp import web
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
+# Preferred first when a client accepts several encodings
+ENCODINGS = ("br", "gzip")
+
+
+def _compressors():
+    compressors = {"gzip": lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli:
+        compressors["br"] = lambda data: brotli.compress(data, quality=11)
+    return compressors
+
+
+def accepted_encodings(header):
+    """Content codings a client accepts, from its Accept-Encoding header."""
+    accepted = set()
+    for item in header.split(","):
+        coding, _, params = item.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding.strip() and quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class Asset:
+    """A static file with its compressed variants, built once at startup."""
+
+    def __init__(self, data, content_type):
+        self.content_type = content_type
+        self.version = hashlib.sha256(data).hexdigest()[:16]
+        # encoding -> (body, strong etag); each variant needs its own etag
+        self.variants = {None: (data, f'"{self.version}"')}
+        for encoding, compress in _compressors().items():
+            compressed = compress(data)
+            if len(compressed) < len(data):
+                self.variants[encoding] = (compressed, f'"{self.version}-{encoding}"')
+
+    def select(self, accept_encoding):
+        accepted = accepted_encodings(accept_encoding)
+        for encoding in ENCODINGS:
+            if encoding in accepted and encoding in self.variants:
+                return encoding, *self.variants[encoding]
+        return None, *self.variants[None]
+
+    def response(self, request, cache_control):
+        encoding, body, etag = self.select(request.headers.get("Accept-Encoding", ""))
+        headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        matches = [tag.strip() for tag in request.headers.get("If-None-Match", "").split(",")]
+        if etag in matches or "*" in matches:
+            return web.Response(status=304, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return web.Response(body=body, content_type=self.content_type, headers=headers)
+
+
+def load_assets(path=STATIC_DIR):
+    """Read and precompress every file in the static directory."""
+    assets = {}
+    for name in sorted(os.listdir(path)):
+        full = os.path.join(path, name)
+        if not os.path.isfile(full):
+            continue
+        with open(full, "rb") as f:
+            data = f.read()
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        assets[name] = Asset(data, content_type)
+    return assets
@@ -0,0 +1,54 @@
+from collections import OrderedDict
+
+DEFAULT_CACHE_SIZE = 128 * 1024 * 1024
+
+
+class BlobCache:
+    """Content-addressed payload cache with LRU eviction by total size."""
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._blobs = OrderedDict()
+
+    def __contains__(self, digest):
+        return digest in self._blobs
+
+    def __len__(self):
+        return len(self._blobs)
+
+    def get(self, digest):
+        data = self._blobs.get(digest)
+        if data is not None:
+            self._blobs.move_to_end(digest)
+        return data
+
+    def put(self, digest, data):
+        if not digest or len(data) > self.max_bytes:
+            return
+        if digest in self._blobs:
+            self._blobs.move_to_end(digest)
+            return
+        self._blobs[digest] = data
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            _, evicted = self._blobs.popitem(last=False)
+            self.size -= len(evicted)
+
+
+class BlobNamespace:
+    """Prefixed view of a shared BlobCache, so groups sharing it can't read each other's payloads."""
+
+    def __init__(self, cache, prefix):
+        self.cache = cache
+        self.prefix = prefix + ":"
+
+    def __contains__(self, digest):
+        return self.prefix + digest in self.cache
+
+    def get(self, digest):
+        return self.cache.get(self.prefix + digest) if digest else None
+
+    def put(self, digest, data):
+        if digest:
+            self.cache.put(self.prefix + digest, data)
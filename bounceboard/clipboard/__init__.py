@@ -1,30 +1,73 @@
 import logging
+import os
 import platform
 
-from .backends import get_backend, PyperclipBackend
+from . import proc
+from .backends import PyperclipBackend
+from .helper import create_backend
 
-_backend = get_backend(platform.system())
+# A resident helper on Windows and macOS, so clipboard access doesn't start a process per request
+_backend = create_backend(platform.system(), os.environ.get('BB_HELPER'))
 _fallback = PyperclipBackend()
+# pyperclip runs its own xclip/pbpaste without a timeout, so it gets the helpers' deadline too
+_bounded = proc.Bounded()
+
+def _use_fallback(name, *args):
+    try:
+        return _bounded(getattr(_fallback, name), *args)
+    except proc.Timeout as e:
+        logging.warning(f"Fallback clipboard access timed out: {e}")
+        return None
 
 def get_content():
+    if not proc.BREAKER.allow():
+        return _use_fallback('get_content')
     try:
         result = _backend.get_content()
         if result is not None:
             return result
+    except proc.Timeout as e:
+        # The helpers are hanging; the fallback would only hang the same way
+        logging.warning(f"Clipboard read timed out: {e}")
+        return None
     except Exception:
         logging.exception(
             f"Native clipboard access failed for {platform.system()}, defaulting to text-only"
         )
-    return _fallback.get_content()
+    return _use_fallback('get_content')
 
 def set_content(clipboard, temp_dir=None):
+    if not proc.BREAKER.allow():
+        return bool(_use_fallback('set_content', clipboard, temp_dir))
     try:
         if _backend.set_content(clipboard, temp_dir):
             return True
+    except proc.Timeout as e:
+        logging.warning(f"Clipboard write timed out: {e}")
+        return False
     except Exception:
         logging.exception(
             f"Native clipboard access failed for {platform.system()}, defaulting to text-only"
         )
-    return _fallback.set_content(clipboard, temp_dir)
+    return bool(_use_fallback('set_content', clipboard, temp_dir))
+
+def get_fingerprint():
+    if not proc.BREAKER.allow():
+        return None
+    try:
+        return _backend.get_fingerprint()
+    except proc.Timeout as e:
+        logging.warning(f"Clipboard fingerprint timed out: {e}")
+        return None
+    except Exception:
+        logging.exception("Clipboard fingerprint failed")
+        return None
+
+def create_notifier():
+    try:
+        return _backend.create_notifier()
+    except Exception:
+        logging.exception("Clipboard change notifications unavailable, polling instead")
+        return None
 
 from .manager import ClipboardManager
\ No newline at end of file
@@ -1,3 +1,7 @@
+import os
+import threading
+
+
 class ClipboardBackend:
     """Abstract clipboard backend."""
 
@@ -7,6 +11,14 @@ class ClipboardBackend:
     def set_content(self, clipboard, temp_dir=None):
         raise NotImplementedError
 
+    def get_fingerprint(self):
+        """Return cheap bytes that change whenever the clipboard does, or None if unsupported."""
+        return None
+
+    def create_notifier(self):
+        """Return a ChangeNotifier for this platform, or None to poll."""
+        return None
+
 
 class LinuxBackend(ClipboardBackend):
     def get_content(self):
@@ -17,6 +29,50 @@ class LinuxBackend(ClipboardBackend):
         from .linux import set_content as _set
         return _set(clipboard, temp_dir)
 
+    def get_fingerprint(self):
+        from .linux import get_fingerprint as _fingerprint
+        return _fingerprint()
+
+    def create_notifier(self):
+        from .notify import create_notifier
+        return create_notifier()
+
+
+class X11Backend(LinuxBackend):
+    """Linux clipboard over Xlib in-process; this process owns the selection it sets."""
+
+    def __init__(self):
+        self._clipboard = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def available():
+        """True on an X11 session with libX11, unless BB_XCLIP asks for xclip."""
+        if not os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY") or os.environ.get("BB_XCLIP"):
+            return False
+        from .x11 import libs
+        try:
+            libs()
+        except OSError:
+            return False
+        return True
+
+    def _connect(self):
+        with self._lock:
+            if self._clipboard is None:
+                from .x11 import X11Clipboard
+                self._clipboard = X11Clipboard()
+            return self._clipboard
+
+    def get_content(self):
+        return self._connect().get_content()
+
+    def set_content(self, clipboard, temp_dir=None):
+        return self._connect().set_content(clipboard, temp_dir)
+
+    def get_fingerprint(self):
+        return self._connect().get_fingerprint()
+
 
 class MacOSBackend(ClipboardBackend):
     def get_content(self):
@@ -27,6 +83,10 @@ class MacOSBackend(ClipboardBackend):
         from .macos import set_content as _set
         return _set(clipboard, temp_dir)
 
+    def get_fingerprint(self):
+        from .macos import get_fingerprint as _fingerprint
+        return _fingerprint()
+
 
 class WindowsBackend(ClipboardBackend):
     def get_content(self):
@@ -62,7 +122,7 @@ class PyperclipBackend(ClipboardBackend):
             if header["type"] != "text/plain":
                 import logging
                 logging.warning(f"Falling back to text/plain for {header['type']}")
-            pyperclip.copy(data.decode("utf-8"))
+            pyperclip.copy(str(data, "utf-8"))
             return True
         except Exception:
             return False
@@ -76,4 +136,6 @@ BACKENDS = {
 
 
 def get_backend(system):
+    if system == "Linux" and X11Backend.available():
+        return X11Backend()
     return BACKENDS.get(system, PyperclipBackend)()
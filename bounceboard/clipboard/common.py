@@ -2,14 +2,69 @@ import hashlib
 import os
 import logging
 
+from .. import tracing
+from ..metrics import HASH
+from ..payload import Spool
+
 # MIME types in order of preference
 MIME_ORDER = ['image/png', 'text/html', 'text/rtf', 'text/plain']
 
 # Track last temp file for cleanup
 last_temp_file = None
 
+# Hashes of recently copied files: path -> ((inode, size, mtime), hash)
+_file_hashes = {}
+FILE_HASH_CACHE = 16
+READ_SIZE = 1024 * 1024
+
+class ClipboardFile:
+    """A copied file whose contents are only read when they need to be sent."""
+
+    def __init__(self, path, size, digest=None):
+        self.path = path
+        self.size = size
+        self.digest = digest
+
+    def __len__(self):
+        return self.size
+
+    def read(self):
+        # Copied to a private spool, never mapped in place: another program rewriting
+        # the user's file must not change (or truncate) bytes we have already hashed
+        spool = Spool(self.size)
+        hasher = hashlib.sha256()
+        try:
+            with HASH.time(source='file'), tracing.timed('hash'), open(self.path, 'rb') as f:
+                for block in iter(lambda: f.read(READ_SIZE), b''):
+                    hasher.update(block)
+                    spool.write(block)
+            if spool.size != self.size or (self.digest and hasher.hexdigest() != self.digest):
+                raise OSError(f"File changed while reading: {self.path}")
+            return spool.finish()
+        finally:
+            spool.close()
+
 def calculate_hash(data):
-    return hashlib.sha256(data).hexdigest()
+    with HASH.time(source='memory'), tracing.timed('hash'):
+        return hashlib.sha256(data).hexdigest()
+
+def hash_file(filepath):
+    """Streamed SHA-256 of a file, cached until its inode, size or mtime change."""
+    st = os.stat(filepath)
+    key = (st.st_ino, st.st_size, st.st_mtime_ns)
+    cached = _file_hashes.get(filepath)
+    if cached and cached[0] == key:
+        return cached[1], st.st_size
+    hasher = hashlib.sha256()
+    with HASH.time(source='file'), tracing.timed('hash'), open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(READ_SIZE), b''):
+            hasher.update(block)
+    digest = hasher.hexdigest()
+    _file_hashes.pop(filepath, None)
+    if len(_file_hashes) >= FILE_HASH_CACHE:
+        _file_hashes.pop(next(iter(_file_hashes)))
+    _file_hashes[filepath] = (key, digest)
+    return digest, st.st_size
 
 def write_temp_file(data, filename, temp_dir):
     global last_temp_file
@@ -22,14 +77,13 @@ def write_temp_file(data, filename, temp_dir):
 
 def handle_clipboard_file(filepath, filename=None):
     try:
-        with open(filepath, 'rb') as f:
-            data = f.read()
-            return ({
-                'type': 'application/x-file',
-                'size': len(data),
-                'text': filename or os.path.basename(filepath),
-                'hash': calculate_hash(data)
-            }, data)
+        digest, size = hash_file(filepath)
+        return ({
+            'type': 'application/x-file',
+            'size': size,
+            'text': filename or os.path.basename(filepath),
+            'hash': digest
+        }, ClipboardFile(filepath, size, digest))
     except Exception:
         logging.exception(f"Error handling clipboard file: {filepath}")
         return None
\ No newline at end of file
@@ -0,0 +1,174 @@
+// Resident macOS clipboard helper for bounceboard.
+//
+// Serves the protocol described in bounceboard/clipboard/helper.py on stdin and
+// stdout, so one osascript process answers every clipboard read and write
+// instead of one starting per request. Run with osascript -l JavaScript; it is
+// picked automatically on macOS, or with BB_HELPER=osascript.
+//
+// Replies to get leave out "size" and "hash"; bounceboard fills them in, as
+// JXA has no SHA-256 of its own.
+
+ObjC.import('AppKit');
+ObjC.import('Foundation');
+
+const Stdin = $.NSFileHandle.fileHandleWithStandardInput;
+const Stdout = $.NSFileHandle.fileHandleWithStandardOutput;
+const Empty = $.NSData.data;
+
+// MIME types in order of preference, as in common.py, and their pasteboard types
+const MimeOrder = ['image/png', 'text/html', 'text/rtf', 'text/plain'];
+const MimeToUti = {
+    'image/png': 'public.png',
+    'text/html': 'public.html',
+    'text/rtf': 'public.rtf',
+    'text/plain': 'public.utf8-plain-text',
+};
+
+let lastTempFile = null;
+
+function readExact(size) {
+    // Blocks until size bytes arrive; short only at the end of input
+    const data = $.NSMutableData.dataWithCapacity(size);
+    while (data.length < size) {
+        const block = Stdin.readDataOfLength(size - data.length);
+        if (block.length === 0) {
+            return null;
+        }
+        data.appendData(block);
+    }
+    return data;
+}
+
+// Latin-1 maps bytes 0-255 to the same code points, so it carries raw bytes through strings
+function bytesOf(data) {
+    const text = $.NSString.alloc.initWithDataEncoding(data, $.NSISOLatin1StringEncoding).js;
+    return Array.from(text, (c) => c.charCodeAt(0));
+}
+
+function dataOf(bytes) {
+    return $(String.fromCharCode(...bytes)).dataUsingEncoding($.NSISOLatin1StringEncoding);
+}
+
+function fromBigEndian(bytes, offset) {
+    return ((bytes[offset] << 24) >>> 0) + (bytes[offset + 1] << 16) + (bytes[offset + 2] << 8) + bytes[offset + 3];
+}
+
+function toBigEndian(value) {
+    return [(value >>> 24) & 0xff, (value >>> 16) & 0xff, (value >>> 8) & 0xff, value & 0xff];
+}
+
+function writeMessage(message, data) {
+    const encoded = $(JSON.stringify(message)).dataUsingEncoding($.NSUTF8StringEncoding);
+    Stdout.writeData(dataOf(toBigEndian(encoded.length).concat(toBigEndian(data.length))));
+    Stdout.writeData(encoded);
+    Stdout.writeData(data);
+}
+
+function getContent() {
+    const pb = $.NSPasteboard.generalPasteboard;
+    const items = pb.pasteboardItems;
+    if (items.count === 0) {
+        return [{ok: true, header: null}, Empty];
+    }
+    const item = items.objectAtIndex(0);
+    const types = ObjC.deepUnwrap(item.types);
+
+    if (types.includes('public.file-url')) {
+        const url = $.NSURL.URLWithString(item.stringForType('public.file-url'));
+        if (url.isFileURL) {
+            // Read and hashed by bounceboard itself, only when the file is sent
+            const path = url.path.js;
+            const header = {type: 'application/x-file', text: path.split('/').pop()};
+            return [{ok: true, header: header, file: path}, Empty];
+        }
+    }
+
+    for (const mime of MimeOrder) {
+        if (!types.includes(MimeToUti[mime])) {
+            continue;
+        }
+        const data = item.dataForType(MimeToUti[mime]);
+        if (data.isNil()) {
+            continue;
+        }
+        const header = {type: mime};
+        if (mime !== 'text/plain' && types.includes('public.utf8-plain-text')) {
+            header.text = item.stringForType('public.utf8-plain-text').js;
+        }
+        return [{ok: true, header: header}, data];
+    }
+    return [{ok: true, header: null}, Empty];
+}
+
+function setContent(message, data) {
+    const header = message.header;
+    const pb = $.NSPasteboard.generalPasteboard;
+    if (header.type === 'application/x-file') {
+        const fm = $.NSFileManager.defaultManager;
+        const directory = message.temp_dir || $.NSTemporaryDirectory().js;
+        if (lastTempFile && fm.fileExistsAtPath(lastTempFile)) {
+            fm.removeItemAtPathError(lastTempFile, null);
+        }
+        const path = $(directory).stringByAppendingPathComponent($(header.text).lastPathComponent).js;
+        if (!data.writeToFileAtomically(path, true)) {
+            return false;
+        }
+        lastTempFile = path;
+        pb.clearContents;
+        return pb.writeObjects($([$.NSURL.fileURLWithPath(path)]));
+    }
+
+    const uti = MimeToUti[header.type];
+    if (!uti) {
+        return false;
+    }
+    pb.clearContents;
+    if (!pb.setDataForType(data, uti)) {
+        return false;
+    }
+    if (header.text && header.type !== 'text/plain') {
+        pb.setStringForType($(header.text), 'public.utf8-plain-text');
+    }
+    return true;
+}
+
+function handle(message, data) {
+    switch (message.op) {
+        case 'get':
+            return getContent();
+        case 'set':
+            return [{ok: true, result: Boolean(setContent(message, data))}, Empty];
+        case 'fingerprint': {
+            // Bumped by macOS on every pasteboard change, and free to read
+            let count = Number($.NSPasteboard.generalPasteboard.changeCount).toString(16);
+            if (count.length % 2) {
+                count = '0' + count;
+            }
+            return [{ok: true, fingerprint: count}, Empty];
+        }
+    }
+    return [{ok: false, error: `Unknown op '${message.op}'`}, Empty];
+}
+
+function run() {
+    while (true) {
+        const lengths = readExact(8);
+        if (lengths === null) {
+            return;
+        }
+        const sizes = bytesOf(lengths);
+        const encoded = readExact(fromBigEndian(sizes, 0));
+        const data = readExact(fromBigEndian(sizes, 4));
+        if (encoded === null || data === null) {
+            return;
+        }
+        let reply;
+        try {
+            const message = JSON.parse($.NSString.alloc.initWithDataEncoding(encoded, $.NSUTF8StringEncoding).js);
+            reply = handle(message, data);
+        } catch (e) {
+            reply = [{ok: false, error: String(e)}, Empty];
+        }
+        writeMessage(reply[0], reply[1]);
+    }
+}
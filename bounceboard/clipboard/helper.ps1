@@ -0,0 +1,176 @@
+# Resident Windows clipboard helper for bounceboard.
+#
+# Serves the protocol described in bounceboard/clipboard/helper.py on stdin and
+# stdout, so one PowerShell process answers every clipboard read and write
+# instead of one starting per request. It is picked automatically on Windows,
+# or with BB_HELPER=powershell.
+
+$ErrorActionPreference = 'Stop'
+$ProgressPreference = 'SilentlyContinue'
+
+Add-Type -AssemblyName System.Windows.Forms, System.Drawing
+Add-Type -Namespace Bounceboard -Name User32 -MemberDefinition @'
+[DllImport("user32.dll")]
+public static extern uint GetClipboardSequenceNumber();
+'@
+
+$Stdin = [Console]::OpenStandardInput()
+$Stdout = [Console]::OpenStandardOutput()
+$Utf8 = New-Object System.Text.UTF8Encoding $false
+$Sha256 = [System.Security.Cryptography.SHA256]::Create()
+$Empty = [byte[]]@()
+$LastTempFile = $null
+
+# MIME types in order of preference, as in common.py, and their clipboard formats
+$MimeOrder = @('image/png', 'text/html', 'text/rtf', 'text/plain')
+$MimeToFormat = @{
+    'image/png' = 'PNG'
+    'text/html' = 'HTML Format'
+    'text/rtf' = 'Rich Text Format'
+    'text/plain' = 'UnicodeText'
+}
+
+function Read-Exact([int]$Size) {
+    $buffer = New-Object byte[] $Size
+    $read = 0
+    while ($read -lt $Size) {
+        $count = $Stdin.Read($buffer, $read, $Size - $read)
+        if ($count -eq 0) { return $null }
+        $read += $count
+    }
+    # The comma stops PowerShell unrolling the array into the pipeline
+    return ,$buffer
+}
+
+function ConvertFrom-BigEndian([byte[]]$Bytes, [int]$Offset) {
+    $word = [byte[]]$Bytes[$Offset..($Offset + 3)]
+    [Array]::Reverse($word)
+    return [BitConverter]::ToUInt32($word, 0)
+}
+
+function ConvertTo-BigEndian([int]$Value) {
+    $word = [BitConverter]::GetBytes([uint32]$Value)
+    [Array]::Reverse($word)
+    return ,$word
+}
+
+function Write-Message($Message, [byte[]]$Data) {
+    $encoded = $Utf8.GetBytes(($Message | ConvertTo-Json -Compress -Depth 4))
+    $Stdout.Write((ConvertTo-BigEndian $encoded.Length), 0, 4)
+    $Stdout.Write((ConvertTo-BigEndian $Data.Length), 0, 4)
+    $Stdout.Write($encoded, 0, $encoded.Length)
+    $Stdout.Write($Data, 0, $Data.Length)
+    $Stdout.Flush()
+}
+
+function Get-Sha256([byte[]]$Data) {
+    return ([BitConverter]::ToString($Sha256.ComputeHash($Data)) -replace '-', '').ToLowerInvariant()
+}
+
+function Get-ClipboardContent {
+    $dataObject = [System.Windows.Forms.Clipboard]::GetDataObject()
+    if (-not $dataObject) {
+        return @{ ok = $true; header = $null }, $Empty
+    }
+    $formats = $dataObject.GetFormats()
+
+    if ($formats -contains 'FileDrop') {
+        $files = [System.Windows.Forms.Clipboard]::GetFileDropList()
+        if ($files.Count -gt 0) {
+            # Read and hashed by bounceboard itself, only when the file is sent
+            $header = @{ type = 'application/x-file'; text = [System.IO.Path]::GetFileName($files[0]) }
+            return @{ ok = $true; header = $header; file = $files[0] }, $Empty
+        }
+    }
+
+    foreach ($mime in $MimeOrder) {
+        $format = $MimeToFormat[$mime]
+        if ($formats -notcontains $format) { continue }
+        $content = $dataObject.GetData($format)
+        if ($content -is [System.IO.MemoryStream]) {
+            $data = $content.ToArray()
+        } elseif ($content -is [string]) {
+            if ($format -eq 'HTML Format') {
+                # Strip the CF_HTML description before <html>, as win.py does
+                $start = $content.IndexOf('<html>')
+                if ($start -ge 0) { $content = $content.Substring($start) }
+            }
+            $data = $Utf8.GetBytes($content)
+        } else {
+            continue
+        }
+        $header = [ordered]@{ type = $mime; size = $data.Length; hash = (Get-Sha256 $data) }
+        if ($mime -ne 'text/plain' -and $formats -contains 'UnicodeText') {
+            $header['text'] = [System.Windows.Forms.Clipboard]::GetText()
+        }
+        return @{ ok = $true; header = $header }, $data
+    }
+    return @{ ok = $true; header = $null }, $Empty
+}
+
+function Set-ClipboardContent($Message, [byte[]]$Data) {
+    $header = $Message.header
+    if ($header.type -eq 'application/x-file') {
+        $directory = if ($Message.temp_dir) { $Message.temp_dir } else { [System.IO.Path]::GetTempPath() }
+        if ($script:LastTempFile -and (Test-Path -LiteralPath $script:LastTempFile)) {
+            Remove-Item -LiteralPath $script:LastTempFile
+        }
+        $path = Join-Path $directory ([System.IO.Path]::GetFileName($header.text))
+        [System.IO.File]::WriteAllBytes($path, $Data)
+        $script:LastTempFile = $path
+        $files = New-Object System.Collections.Specialized.StringCollection
+        [void]$files.Add($path)
+        [System.Windows.Forms.Clipboard]::SetFileDropList($files)
+        return $true
+    }
+
+    $dataObject = New-Object System.Windows.Forms.DataObject
+    $image = $null
+    switch ($header.type) {
+        'image/png' {
+            $image = [System.Drawing.Image]::FromStream((New-Object System.IO.MemoryStream (,$Data)))
+            $dataObject.SetImage($image)
+        }
+        'text/html' { $dataObject.SetData('HTML Format', $Utf8.GetString($Data)) }
+        'text/rtf' { $dataObject.SetData('Rich Text Format', $Utf8.GetString($Data)) }
+        'text/plain' { $dataObject.SetText($Utf8.GetString($Data)) }
+        default { return $false }
+    }
+    if ($header.text -and $header.type -ne 'text/plain') {
+        $dataObject.SetText($header.text)
+    }
+    try {
+        # Copied, so the content stays after this process exits
+        [System.Windows.Forms.Clipboard]::SetDataObject($dataObject, $true)
+    } finally {
+        if ($image) { $image.Dispose() }
+    }
+    return $true
+}
+
+function Invoke-Request($Message, [byte[]]$Data) {
+    switch ($Message.op) {
+        'get' { return Get-ClipboardContent }
+        'set' { return @{ ok = $true; result = [bool](Set-ClipboardContent $Message $Data) }, $Empty }
+        'fingerprint' {
+            # Bumped by Windows on every clipboard change, and free to read
+            $sequence = [Bounceboard.User32]::GetClipboardSequenceNumber()
+            return @{ ok = $true; fingerprint = ('{0:x8}' -f $sequence) }, $Empty
+        }
+    }
+    return @{ ok = $false; error = "Unknown op '$($Message.op)'" }, $Empty
+}
+
+while ($true) {
+    $lengths = Read-Exact 8
+    if ($null -eq $lengths) { break }
+    $encoded = Read-Exact (ConvertFrom-BigEndian $lengths 0)
+    $data = Read-Exact (ConvertFrom-BigEndian $lengths 4)
+    if ($null -eq $encoded -or $null -eq $data) { break }
+    try {
+        $reply, $payload = Invoke-Request ($Utf8.GetString($encoded) | ConvertFrom-Json) $data
+    } catch {
+        $reply, $payload = @{ ok = $false; error = $_.Exception.Message }, $Empty
+    }
+    Write-Message $reply $payload
+}
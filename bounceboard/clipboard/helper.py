@@ -0,0 +1,270 @@
+"""Long-lived clipboard helper process.
+
+Instead of starting osascript or powershell for every read and write,
+HelperBackend keeps one helper running and sends it requests over its stdin,
+reading replies from its stdout. Each message in either direction is
+
+    4 bytes   JSON length, big-endian
+    4 bytes   payload length, big-endian
+    n bytes   JSON object
+    m bytes   payload
+
+Requests are {"op": "get"}, {"op": "fingerprint"} and {"op": "set", "header":
+{...}, "temp_dir": ...} with the clipboard bytes as payload. Replies carry
+"ok"; a get reply has the clipboard "header" (null if empty) and its bytes,
+or "file" with a path for a copied file, and may leave the header's "size"
+and "hash" out for bounceboard to fill in; a fingerprint reply has
+"fingerprint" as hex; a set reply has "result". Failures reply {"ok": false,
+"error": "..."}.
+
+The helpers shipped here are used by default: helper.ps1 on Windows and
+helper.js (run by osascript) on macOS. BB_HELPER picks another helper by its
+command line, or turns them off with BB_HELPER=none. Linux has no resident
+helper: the X11 backend works in-process, and without it xclip still starts
+for every request. `python -m bounceboard.clipboard.helper` serves the
+protocol from this platform's native backend and is the reference for other
+helpers; it does not save any process starts itself.
+"""
+
+import json
+import logging
+import os
+import platform
+import shlex
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+from . import proc
+from .backends import ClipboardBackend, get_backend
+from .common import ClipboardFile, calculate_hash, handle_clipboard_file
+
+LENGTHS = struct.Struct('>II')
+POWERSHELL_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'helper.ps1')
+JXA_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'helper.js')
+# The bundled helper each platform uses unless BB_HELPER says otherwise
+RESIDENT_HELPERS = {'Windows': 'powershell', 'Darwin': 'osascript'}
+# After the helper fails, requests go to the native backend for this long before it is tried again
+RETRY_AFTER = 60
+
+
+def helper_command(value):
+    """The command line for a BB_HELPER value; "powershell" and "osascript" run the bundled helpers."""
+    if value == 'powershell':
+        return ['powershell', '-NoProfile', '-NonInteractive', '-STA', '-ExecutionPolicy', 'Bypass',
+                '-File', POWERSHELL_SCRIPT]
+    if value == 'osascript':
+        return ['osascript', '-l', 'JavaScript', JXA_SCRIPT]
+    return shlex.split(value)
+
+
+def create_backend(system, value=None):
+    """The clipboard backend for system, given BB_HELPER's value.
+
+    Without a value the platform's resident helper is used if it has one, with
+    the native backend behind it; "none" always uses the native backend.
+    """
+    if value == 'none' or (not value and system not in RESIDENT_HELPERS):
+        return get_backend(system)
+    if value:
+        return HelperBackend(helper_command(value))
+    return HelperBackend(helper_command(RESIDENT_HELPERS[system]), fallback=get_backend(system))
+
+
+class HelperError(Exception):
+    """The helper replied with an error or broke the protocol."""
+
+
+def _read_exact(stream, size):
+    data = b''
+    while len(data) < size:
+        block = stream.read(size - len(data))
+        if not block:
+            raise EOFError('Helper closed its output')
+        data += block
+    return data
+
+
+def write_message(stream, message, data=b''):
+    encoded = json.dumps(message, separators=(',', ':')).encode('utf-8')
+    stream.write(LENGTHS.pack(len(encoded), len(data)))
+    stream.write(encoded)
+    stream.write(data)
+    stream.flush()
+
+
+def read_message(stream):
+    """One (message, payload) pair, or None at a clean end of stream."""
+    lengths = stream.read(LENGTHS.size)
+    if not lengths:
+        return None
+    if len(lengths) < LENGTHS.size:
+        lengths += _read_exact(stream, LENGTHS.size - len(lengths))
+    json_length, data_length = LENGTHS.unpack(lengths)
+    message = json.loads(_read_exact(stream, json_length))
+    return message, _read_exact(stream, data_length)
+
+
+class HelperBackend(ClipboardBackend):
+    """Clipboard access as round-trips to one persistent helper, restarted if it dies."""
+
+    def __init__(self, command, timeout=proc.TIMEOUT, fallback=None):
+        self.command = command
+        self.timeout = timeout
+        # Serves requests while the helper is failing; without one its errors are raised
+        self.fallback = fallback
+        self._process = None
+        self._lock = threading.Lock()
+        self._failed_at = None
+
+    def _start(self):
+        if self._process and self._process.poll() is None:
+            return self._process
+        if self._process:
+            logging.warning(f'Clipboard helper exited ({self._process.returncode}), restarting it')
+        self._process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        return self._process
+
+    def _stop(self):
+        if self._process:
+            self._process.kill()
+            self._process.wait()
+            self._process = None
+
+    def _round_trip(self, process, message, data):
+        # The reader blocks, so the deadline is enforced by killing the helper
+        expired = threading.Event()
+
+        def expire():
+            expired.set()
+            process.kill()
+
+        timer = threading.Timer(self.timeout, expire)
+        timer.start()
+        try:
+            write_message(process.stdin, message, data)
+            reply = read_message(process.stdout)
+            if reply is None:
+                raise EOFError('Helper closed its output')
+            return reply
+        finally:
+            timer.cancel()
+            if expired.is_set():
+                proc.BREAKER.failure()
+                raise proc.Timeout(f'Clipboard helper did not reply within {self.timeout}s')
+
+    def request(self, message, data=b''):
+        """Send one request, restarting the helper once if it has died."""
+        with self._lock:
+            for attempt in range(2):
+                process = self._start()
+                try:
+                    reply, payload = self._round_trip(process, message, data)
+                    break
+                except (OSError, EOFError, ValueError) as e:
+                    self._stop()
+                    if attempt:
+                        raise HelperError(f'Clipboard helper failed: {e}') from e
+                    logging.info(f'Clipboard helper failed ({e}), restarting it')
+        proc.BREAKER.success()
+        if not reply.get('ok'):
+            raise HelperError(reply.get('error', 'unknown error'))
+        return reply, payload
+
+    def _falling_back(self):
+        return self._failed_at is not None and time.monotonic() - self._failed_at < RETRY_AFTER
+
+    def _fall_back(self, error, name, *args):
+        """Answer a request the helper failed from the fallback backend, or raise without one."""
+        if self.fallback is None:
+            raise error
+        if not self._falling_back():
+            logging.warning(f'Clipboard helper failed ({error}), using the native backend for {RETRY_AFTER}s')
+            self._failed_at = time.monotonic()
+        return getattr(self.fallback, name)(*args)
+
+    def get_content(self):
+        if self._falling_back():
+            return self.fallback.get_content()
+        try:
+            reply, data = self.request({'op': 'get'})
+        except HelperError as e:
+            return self._fall_back(e, 'get_content')
+        header = reply.get('header')
+        if not header:
+            return None
+        if reply.get('file'):
+            return handle_clipboard_file(reply['file'], header.get('text'))
+        if 'hash' not in header:
+            header.update(size=len(data), hash=calculate_hash(data))
+        return header, data
+
+    def set_content(self, clipboard, temp_dir=None):
+        if self._falling_back():
+            return self.fallback.set_content(clipboard, temp_dir)
+        header, data = clipboard
+        try:
+            reply, _ = self.request({'op': 'set', 'header': header, 'temp_dir': temp_dir}, bytes(data))
+        except HelperError as e:
+            return self._fall_back(e, 'set_content', clipboard, temp_dir)
+        return bool(reply.get('result'))
+
+    def get_fingerprint(self):
+        if self._falling_back():
+            return self.fallback.get_fingerprint()
+        try:
+            reply, _ = self.request({'op': 'fingerprint'})
+        except HelperError as e:
+            return self._fall_back(e, 'get_fingerprint')
+        fingerprint = reply.get('fingerprint')
+        return bytes.fromhex(fingerprint) if fingerprint else None
+
+    def create_notifier(self):
+        # The helper only answers requests; change events come from this platform's own backend
+        return (self.fallback or get_backend(platform.system())).create_notifier()
+
+    def close(self):
+        with self._lock:
+            self._stop()
+
+
+def _handle(backend, message, data):
+    op = message.get('op')
+    if op == 'get':
+        clipboard = backend.get_content()
+        if not clipboard:
+            return {'ok': True, 'header': None}, b''
+        header, content = clipboard
+        if isinstance(content, ClipboardFile):
+            return {'ok': True, 'header': header, 'file': content.path}, b''
+        return {'ok': True, 'header': header}, bytes(content)
+    if op == 'set':
+        result = backend.set_content((message['header'], data), message.get('temp_dir'))
+        return {'ok': True, 'result': bool(result)}, b''
+    if op == 'fingerprint':
+        fingerprint = backend.get_fingerprint()
+        return {'ok': True, 'fingerprint': fingerprint.hex() if fingerprint else None}, b''
+    return {'ok': False, 'error': f'Unknown op {op!r}'}, b''
+
+
+def serve(backend, reader=None, writer=None):
+    """Answer requests from reader with backend until reader is closed."""
+    reader = reader or sys.stdin.buffer
+    writer = writer or sys.stdout.buffer
+    while True:
+        request = read_message(reader)
+        if request is None:
+            return
+        try:
+            reply, data = _handle(backend, *request)
+        except Exception as e:
+            logging.exception('Clipboard helper request failed')
+            reply, data = {'ok': False, 'error': str(e)}, b''
+        write_message(writer, reply, data)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    serve(get_backend(platform.system()))
@@ -1,6 +1,6 @@
-import subprocess
 import os
 import logging
+from . import proc
 from .common import (
     MIME_ORDER,
     calculate_hash,
@@ -10,15 +10,24 @@ from .common import (
 
 def _get_linux_target(target_type):
     try:
-        result = subprocess.run(['xclip', '-selection', 'clipboard', '-t', target_type, '-o'], 
-                              capture_output=True)
+        result = proc.run_sync(['xclip', '-selection', 'clipboard', '-t', target_type, '-o'])
         if result.returncode == 0:
             return result.stdout
         return None
+    except proc.Timeout:
+        raise
     except Exception as e:
         logging.info(f"Error reading clipboard target {target_type}: {e}")
         return None
 
+def get_fingerprint():
+    # The owner's TIMESTAMP changes on every new copy; TARGETS is included for owners that reuse it
+    timestamp = _get_linux_target('TIMESTAMP')
+    if not timestamp:
+        return None
+    targets = _get_linux_target('TARGETS')
+    return timestamp + b'\0' + (targets or b'')
+
 def get_content():
     result = _get_linux_target('TARGETS')
     mime_types = result.decode('utf-8').strip().split('\n') if result else []
@@ -55,13 +64,12 @@ def set_content(clipboard, temp_dir=None):
         data = uri.encode('utf-8')
 
     if bool(os.environ.get('BB_XCLIP_ALT')) and text:
-        process = subprocess.Popen(['xclip', '-selection', 'clipboard', '-t', content_type, '-alt-text', text, '-i'], stdin=subprocess.PIPE)
+        args = ['xclip', '-selection', 'clipboard', '-t', content_type, '-alt-text', text, '-i']
     else:
         # xclip by default doesn't support alternate targets so we have to default all text-based ones to STRING
         if text:
             content_type = 'STRING'
             data = text.encode('utf-8')
-        process = subprocess.Popen(['xclip', '-selection', 'clipboard', '-t', content_type, '-i'], 
-                                stdin=subprocess.PIPE)
-    process.communicate(input=data)
-    return True
+        args = ['xclip', '-selection', 'clipboard', '-t', content_type, '-i']
+    # xclip forks to keep serving the selection, so only wait for the parent
+    return proc.run_sync(args, input=bytes(data), capture=False).returncode == 0
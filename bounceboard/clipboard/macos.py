@@ -1,8 +1,8 @@
-import subprocess
 import json
 import os
 import logging
 import tempfile
+from . import proc
 from .common import (
     MIME_ORDER,
     calculate_hash,
@@ -22,12 +22,14 @@ MIME_TO_UTI = {mime: uti for uti, mime in UTI_TO_MIME.items()}
 
 def _get_macos_types():
     try:
-        result = subprocess.run([
+        result = proc.run_sync([
             'osascript', '-l', 'JavaScript', 
             '-e', 'ObjC.import("AppKit"); JSON.stringify(ObjC.deepUnwrap($.NSPasteboard.generalPasteboard.pasteboardItems.js[0].types))'
-        ], capture_output=True, text=True)
+        ], text=True)
         if result.returncode == 0:
             return json.loads(result.stdout.strip())
+    except proc.Timeout:
+        raise
     except Exception:
         logging.exception("Error getting macOS clipboard types")
         return []
@@ -46,18 +48,33 @@ def _get_macos_target(uti):
         hexString
         '''
         
-        result = subprocess.run(['osascript', '-l', 'JavaScript', '-e', script], 
-                              capture_output=True, text=True)
+        result = proc.run_sync(['osascript', '-l', 'JavaScript', '-e', script], text=True)
         
         if result.returncode == 0:
             hex_data = result.stdout.strip()
             return bytes.fromhex(hex_data)
             
         return None
+    except proc.Timeout:
+        raise
     except Exception:
         logging.exception("Error getting macOS clipboard content")
         return None
 
+def get_fingerprint():
+    try:
+        result = proc.run_sync([
+            'osascript', '-l', 'JavaScript',
+            '-e', 'ObjC.import("AppKit"); $.NSPasteboard.generalPasteboard.changeCount'
+        ])
+        if result.returncode == 0:
+            return result.stdout.strip()
+    except proc.Timeout:
+        raise
+    except Exception:
+        logging.exception("Error getting macOS clipboard change count")
+    return None
+
 def get_content():
     utis = _get_macos_types()
 
@@ -72,11 +89,12 @@ def get_content():
             const url = $.NSURL.URLWithString(str);
             ObjC.unwrap(url.path);
             '''
-            result = subprocess.run(['osascript', '-l', 'JavaScript', '-e', script],
-                                 capture_output=True, text=True)
+            result = proc.run_sync(['osascript', '-l', 'JavaScript', '-e', script], text=True)
             if result.returncode == 0:
                 file_path = result.stdout.strip()
                 return handle_clipboard_file(file_path)
+        except proc.Timeout:
+            raise
         except Exception:
             logging.exception("Error reading file URL from macOS clipboard")
             return None
@@ -105,8 +123,7 @@ def set_content(clipboard, temp_dir=None):
     
     if header['type'] == 'application/x-file':
         temp_path = write_temp_file(data, header['text'], temp_dir)
-        result = subprocess.run(['osascript', '-e', f'set the clipboard to "{temp_path}" as «class furl»'], 
-                              capture_output=True, text=True)
+        result = proc.run_sync(['osascript', '-e', f'set the clipboard to "{temp_path}" as «class furl»'], text=True)
         if result.returncode != 0:
             logging.error(f"Error setting macOS clipboard file: {result.stderr}")
             return False
@@ -142,8 +159,7 @@ def set_content(clipboard, temp_dir=None):
         pb.setDataForType($.NSData.dataWithContentsOfFile("{text_path}"), "public.utf8-plain-text");
         '''
             
-        result = subprocess.run(['osascript', '-l', 'JavaScript', '-e', script], 
-                              capture_output=True, text=True)
+        result = proc.run_sync(['osascript', '-l', 'JavaScript', '-e', script], text=True)
         if result.returncode != 0:
             logging.error(f"Error setting macOS clipboard content: {result.stderr}")
             return False
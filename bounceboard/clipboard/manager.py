@@ -1,22 +1,58 @@
 import asyncio
-from . import get_content, set_content
+import logging
+import time
+from .. import tracing
+from ..metrics import BACKEND_GET, BACKEND_SET, PROPAGATION
+from . import get_content, set_content, get_fingerprint, create_notifier, proc
+from .common import ClipboardFile
 
 class ClipboardManager:
     """Manage polling and caching of clipboard data."""
 
-    def __init__(self, getter=get_content, setter=set_content):
+    def __init__(self, getter=get_content, setter=set_content, notifier=create_notifier,
+                 fingerprint=None):
         self._getter = getter
         self._setter = setter
+        self._notifier = notifier
+        # The OS fingerprint only says something about reads from the OS clipboard
+        if fingerprint is None and getter is get_content:
+            fingerprint = get_fingerprint
+        self._fingerprint = fingerprint
         self._last_hash = None
+        self._last_fingerprint = None
         self._lock = asyncio.Lock()
 
-    async def get_current(self):
+    async def _read(self):
+        """Read the backend, returning the clipboard and its trace spans."""
+        start = time.time()
+        clipboard, spans = await proc.call(tracing.collect, self._getter)
+        end = time.time()
+        BACKEND_GET.observe(end - start, type=clipboard[0]["type"] if clipboard else "none")
+        return clipboard, [("backend.get", start, end)] + spans
+
+    async def _load(self, clipboard):
+        """Read deferred file contents now that they are needed."""
+        if not clipboard or not isinstance(clipboard[1], ClipboardFile):
+            return clipboard
+        header, ref = clipboard
         loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(None, self._getter)
+        try:
+            return (header, await loop.run_in_executor(None, ref.read))
+        except OSError:
+            logging.exception(f"Error reading clipboard file: {ref.path}")
+            return None
+
+    async def get_current(self):
+        clipboard, _ = await self._read()
+        return await self._load(clipboard)
 
     async def set_clipboard(self, clipboard, temp_dir=None):
-        loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(None, self._setter, clipboard, temp_dir)
+        start = time.time()
+        try:
+            return await proc.call(self._setter, clipboard, temp_dir)
+        finally:
+            BACKEND_SET.observe(time.time() - start, type=clipboard[0]["type"])
+            tracing.add_span(clipboard[0], "backend.set", start)
 
     def _is_cached(self, clipboard):
         if not clipboard:
@@ -32,9 +68,35 @@ class ClipboardManager:
             self._last_hash = header.get("hash")
             return True
 
+    async def _is_unchanged(self):
+        """Cheap probe: True only if the backend fingerprint matches the last full read."""
+        if not self._fingerprint:
+            return False
+        fingerprint = await proc.call(self._fingerprint)
+        if fingerprint is not None and fingerprint == self._last_fingerprint:
+            return True
+        self._last_fingerprint = fingerprint
+        return False
+
     async def get_updated_clipboard(self):
-        current = await self.get_current()
+        if await self._is_unchanged():
+            return None
+        current, spans = await self._read()
+        if not current:
+            self._last_fingerprint = None
         if not self._is_cached(current):
+            start = time.time()
+            deferred = bool(current) and isinstance(current[1], ClipboardFile)
+            current = await self._load(current)
+            if current:
+                header = current[0]
+                # Travels with the update so the receiving side can measure propagation
+                header["detected"] = time.time()
+                header.pop("trace", None)
+                for span in spans:
+                    tracing.add_span(header, *span)
+                if deferred:
+                    tracing.add_span(header, "load", start)
             await self._cache(current)
             return current
         return None
@@ -43,12 +105,26 @@ class ClipboardManager:
         if not self._is_cached(clipboard):
             await self.set_clipboard(clipboard, temp_dir)
             await self._cache(clipboard)
+            detected = clipboard[0].get("detected")
+            if isinstance(detected, (int, float)):
+                # Wall clocks on both machines, so skew shows up here too
+                PROPAGATION.observe(max(0.0, time.time() - detected))
+            tracing.record(clipboard[0])
             return True
         return False
 
     async def watch(self, on_change, interval=1):
-        while True:
-            current = await self.get_updated_clipboard()
-            if current:
-                await on_change(current)
-            await asyncio.sleep(interval)
+        """Report clipboard changes, event-driven when the platform allows it."""
+        notifier = self._notifier() if self._notifier else None
+        try:
+            while True:
+                current = await self.get_updated_clipboard()
+                if current:
+                    await on_change(current)
+                if notifier and notifier.alive:
+                    await notifier.wait()
+                else:
+                    await asyncio.sleep(interval)
+        finally:
+            if notifier:
+                notifier.close()
@@ -0,0 +1,124 @@
+import asyncio
+import ctypes
+import logging
+import os
+import shutil
+
+# Re-read the clipboard at least this often even when notifications are quiet
+NOTIFY_TIMEOUT = 30
+
+
+class ChangeNotifier:
+    """Wake the clipboard watcher when the selection changes."""
+
+    def __init__(self):
+        self._changed = asyncio.Event()
+        self.alive = True
+
+    async def wait(self, timeout=NOTIFY_TIMEOUT):
+        """Wait for a change notification, returning False on timeout."""
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self._changed.clear()
+        return True
+
+    def notify(self):
+        """Report a change; must be called on the event loop's thread."""
+        self._changed.set()
+
+    def close(self):
+        self.alive = False
+
+
+class XFixesNotifier(ChangeNotifier):
+    """CLIPBOARD owner-change events from the XFixes extension."""
+
+    def __init__(self):
+        super().__init__()
+        from . import x11
+        self._x11, xfixes = x11.libs()
+        self._dpy = self._x11.XOpenDisplay(None)
+        if not self._dpy:
+            raise OSError("Cannot open X display")
+
+        event_base, error_base = ctypes.c_int(), ctypes.c_int()
+        if not xfixes.XFixesQueryExtension(self._dpy, ctypes.byref(event_base), ctypes.byref(error_base)):
+            self._x11.XCloseDisplay(self._dpy)
+            raise OSError("XFixes extension not available")
+        self._notify_type = event_base.value + x11.XFixesSelectionNotify
+
+        root = self._x11.XDefaultRootWindow(self._dpy)
+        clipboard = self._x11.XInternAtom(self._dpy, b'CLIPBOARD', False)
+        xfixes.XFixesSelectSelectionInput(
+            self._dpy, root, clipboard,
+            x11.XFixesSetSelectionOwnerNotifyMask
+            | x11.XFixesSelectionWindowDestroyNotifyMask
+            | x11.XFixesSelectionClientCloseNotifyMask,
+        )
+        self._x11.XFlush(self._dpy)
+        self._event = x11.XEvent()
+        self._loop = asyncio.get_running_loop()
+        self._fd = self._x11.XConnectionNumber(self._dpy)
+        self._loop.add_reader(self._fd, self._drain)
+        # Xlib may already have queued events while setting up
+        self._drain()
+
+    def _drain(self):
+        while self._x11.XPending(self._dpy):
+            self._x11.XNextEvent(self._dpy, ctypes.byref(self._event))
+            if self._event.type == self._notify_type:
+                self._changed.set()
+
+    def close(self):
+        if self._dpy:
+            self._loop.remove_reader(self._fd)
+            self._x11.XCloseDisplay(self._dpy)
+            self._dpy = None
+        super().close()
+
+
+class WaylandNotifier(ChangeNotifier):
+    """Clipboard change lines from a long-running `wl-paste --watch`."""
+
+    def __init__(self):
+        super().__init__()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                'wl-paste', '--watch', 'echo',
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+            try:
+                while await proc.stdout.readline():
+                    self._changed.set()
+            finally:
+                if proc.returncode is None:
+                    proc.kill()
+                await proc.wait()
+            logging.info(f"wl-paste --watch exited ({proc.returncode}), falling back to polling")
+        except Exception:
+            logging.exception("Error watching Wayland clipboard, falling back to polling")
+        finally:
+            self.alive = False
+            self._changed.set()
+
+    def close(self):
+        self._task.cancel()
+        super().close()
+
+
+def create_notifier():
+    """Pick the best change notifier for this session, or None to poll."""
+    if os.environ.get('WAYLAND_DISPLAY') and shutil.which('wl-paste'):
+        return WaylandNotifier()
+    if os.environ.get('DISPLAY'):
+        try:
+            return XFixesNotifier()
+        except OSError as e:
+            logging.info(f"XFixes notifications unavailable ({e}), polling clipboard")
+    return None
@@ -0,0 +1,222 @@
+"""Clipboard helper processes (xclip, osascript, powershell) run by the event loop.
+
+Backend functions are blocking and run in executor threads, but their
+children are spawned and reaped by the loop: each call has a deadline after
+which the child is killed, a cancelled ClipboardManager call kills the
+children of its thread, and a semaphore bounds how many run at once. A hung
+helper therefore costs one deadline instead of an executor thread for good.
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import subprocess
+import threading
+import time
+import weakref
+
+# Seconds before a helper is killed; powershell alone can take a second to start
+TIMEOUT = 10
+# Helpers running at once across all backend calls
+CONCURRENCY = 4
+# Consecutive timeouts that switch to the fallback backend, and for how long
+BREAKER_THRESHOLD = 3
+BREAKER_COOLDOWN = 60
+
+_local = threading.local()
+_semaphores = weakref.WeakKeyDictionary()
+
+
+class Timeout(Exception):
+    """A helper process missed its deadline and was killed."""
+
+
+class CircuitBreaker:
+    """Counts consecutive helper timeouts and trips after too many.
+
+    While tripped, callers should use a fallback. After the cooldown one call
+    is let through again; a success closes the breaker, another timeout
+    re-trips it.
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened is None:
+                return True
+            if time.monotonic() - self.opened >= self.cooldown:
+                # Half-open: let one call probe the backend
+                self.opened = time.monotonic()
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            if self.opened is not None:
+                logging.info('Native clipboard helpers are responding again')
+            self.failures = 0
+            self.opened = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold and self.opened is None:
+                logging.warning(f'{self.failures} clipboard helpers timed out in a row, '
+                                f'using the fallback backend for {self.cooldown}s')
+            if self.failures >= self.threshold:
+                self.opened = time.monotonic()
+
+
+BREAKER = CircuitBreaker()
+
+
+def _semaphore():
+    loop = asyncio.get_running_loop()
+    if loop not in _semaphores:
+        _semaphores[loop] = asyncio.Semaphore(CONCURRENCY)
+    return _semaphores[loop]
+
+
+async def run(args, input=None, timeout=TIMEOUT, capture=True):
+    """Run a helper to completion, returning a subprocess.CompletedProcess with bytes output.
+
+    Without capture, output goes to /dev/null and only the exit is waited
+    for; xclip -i forks a child that keeps the selection and would hold a
+    pipe open forever.
+    """
+    output = asyncio.subprocess.PIPE if capture else asyncio.subprocess.DEVNULL
+    async with _semaphore():
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.PIPE if input is not None else asyncio.subprocess.DEVNULL,
+            stdout=output,
+            stderr=output,
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(input), timeout)
+        except asyncio.TimeoutError:
+            BREAKER.failure()
+            raise Timeout(f'{args[0]} did not finish within {timeout}s') from None
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+    BREAKER.success()
+    return subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+
+
+def run_sync(args, input=None, timeout=TIMEOUT, capture=True, text=False):
+    """run() for blocking backend code, like subprocess.run(args, capture_output=capture, text=text).
+
+    Inside call() the helper runs on the caller's event loop; anywhere else it
+    falls back to subprocess.run with the same deadline.
+    """
+    if text and input is not None:
+        input = input.encode('utf-8')
+    loop = getattr(_local, 'loop', None)
+    if loop is None:
+        result = _run_blocking(args, input, timeout, capture)
+    else:
+        children = _local.children
+        if children.cancelled:
+            raise asyncio.CancelledError()
+        future = asyncio.run_coroutine_threadsafe(run(args, input, timeout, capture), loop)
+        children.add(future)
+        try:
+            result = future.result()
+        except concurrent.futures.CancelledError:
+            # A BaseException, so backends' "except Exception" blocks can't swallow it
+            raise asyncio.CancelledError() from None
+        finally:
+            children.discard(future)
+    if text and capture:
+        result.stdout = result.stdout.decode('utf-8', 'replace')
+        result.stderr = result.stderr.decode('utf-8', 'replace')
+    return result
+
+
+def _run_blocking(args, input, timeout, capture):
+    output = subprocess.PIPE if capture else subprocess.DEVNULL
+    try:
+        result = subprocess.run(args, input=input, stdout=output, stderr=output, timeout=timeout,
+                                stdin=None if input is not None else subprocess.DEVNULL)
+    except subprocess.TimeoutExpired:
+        BREAKER.failure()
+        raise Timeout(f'{args[0]} did not finish within {timeout}s') from None
+    BREAKER.success()
+    return result
+
+
+class Bounded:
+    """Runs blocking code whose children we can't reach (pyperclip) with a deadline.
+
+    The function runs on a daemon thread; if it misses the deadline the
+    caller gets Timeout and the thread is abandoned. Calls made while an
+    abandoned one is still stuck fail at once, so at most one thread leaks.
+    """
+
+    def __init__(self, timeout=TIMEOUT):
+        self.timeout = timeout
+        self._busy = threading.Lock()
+
+    def __call__(self, function, *args):
+        if not self._busy.acquire(blocking=False):
+            raise Timeout(f'{function.__qualname__} is still stuck in an earlier call')
+        done = threading.Event()
+        outcome = {}
+
+        def target():
+            try:
+                outcome['result'] = function(*args)
+            except Exception as e:
+                outcome['error'] = e
+            finally:
+                self._busy.release()
+                done.set()
+
+        threading.Thread(target=target, daemon=True).start()
+        if not done.wait(self.timeout):
+            raise Timeout(f'{function.__qualname__} did not finish within {self.timeout}s')
+        if 'error' in outcome:
+            raise outcome['error']
+        return outcome['result']
+
+
+class _Children(set):
+    """Helpers started by one call(), so they can be killed if it is cancelled."""
+
+    cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+        for future in list(self):
+            future.cancel()
+
+
+async def call(function, *args):
+    """Run a blocking backend function in the default executor.
+
+    Helpers it starts through run_sync() run on this loop, and are killed if
+    the awaiting task is cancelled.
+    """
+    loop = asyncio.get_running_loop()
+    children = _Children()
+
+    def target():
+        _local.loop, _local.children = loop, children
+        try:
+            return function(*args)
+        finally:
+            _local.loop = _local.children = None
+
+    try:
+        return await loop.run_in_executor(None, target)
+    except asyncio.CancelledError:
+        children.cancel()
+        raise
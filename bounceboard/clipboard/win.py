@@ -1,8 +1,8 @@
-import subprocess
 import json
 import logging
 import tempfile
 import os
+from . import proc
 from .common import (
     MIME_ORDER,
     calculate_hash,
@@ -28,10 +28,11 @@ def _get_windows_formats():
         $formats = [System.Windows.Forms.Clipboard]::GetDataObject().GetFormats()
         ConvertTo-Json @($formats)
         '''
-        result = subprocess.run(['powershell', '-Command', script],
-                              capture_output=True, text=True)
+        result = proc.run_sync(['powershell', '-Command', script], text=True)
         if result.returncode == 0:
             return json.loads(result.stdout)
+    except proc.Timeout:
+        raise
     except Exception:
         logging.exception("Error getting Windows clipboard formats")
     return []
@@ -45,8 +46,7 @@ def _get_windows_target(format_name):
             $files = $data.GetFileDropList()
             ConvertTo-Json @($files)
             '''
-            result = subprocess.run(['powershell', '-Command', script],
-                                capture_output=True, text=True)
+            result = proc.run_sync(['powershell', '-Command', script], text=True)
             if result.returncode == 0:
                 return json.loads(result.stdout)
             return None
@@ -66,8 +66,7 @@ def _get_windows_target(format_name):
         }}
         '''
         
-        result = subprocess.run(['powershell', '-Command', script],
-                              capture_output=True, text=True)
+        result = proc.run_sync(['powershell', '-Command', script], text=True)
         
         if result.returncode == 0:
             data = result.stdout.strip()
@@ -80,6 +79,8 @@ def _get_windows_target(format_name):
                 return bytes.fromhex(data)
             return data
             
+    except proc.Timeout:
+        raise
     except Exception:
         logging.exception(f"Error getting Windows clipboard content for format: {format_name}")
     return None
@@ -133,7 +134,7 @@ def set_content(clipboard, temp_dir=None):
         Add-Type -AssemblyName System.Windows.Forms
         [System.Windows.Forms.Clipboard]::SetFileDropList([System.Collections.Specialized.StringCollection]@('{temp_path}'))
         '''
-        result = subprocess.run(['powershell', '-Command', script])
+        result = proc.run_sync(['powershell', '-Command', script], capture=False)
         return result.returncode == 0
 
     win_format = MIME_TO_FORMAT.get(header['type'])
@@ -194,7 +195,7 @@ def set_content(clipboard, temp_dir=None):
             [System.Windows.Forms.Clipboard]::SetDataObject($dataObj, $true)
             '''
 
-        result = subprocess.run(['powershell', '-Command', script])
+        result = proc.run_sync(['powershell', '-Command', script], capture=False)
         return result.returncode == 0
 
     finally:
@@ -0,0 +1,560 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import threading
+import time
+
+from .common import MIME_ORDER, calculate_hash, handle_clipboard_file, write_temp_file
+
+# XFixes selection event masks
+XFixesSetSelectionOwnerNotifyMask = 1 << 0
+XFixesSelectionWindowDestroyNotifyMask = 1 << 1
+XFixesSelectionClientCloseNotifyMask = 1 << 2
+
+# Offset of XFixesSelectionNotify from the extension's event base
+XFixesSelectionNotify = 0
+
+# Core protocol constants
+PropertyNotify = 28
+SelectionClear = 29
+SelectionRequest = 30
+SelectionNotify = 31
+PropertyNewValue = 0
+PropertyDelete = 1
+PropModeReplace = 0
+PropModeAppend = 2
+PropertyChangeMask = 1 << 22
+CurrentTime = 0
+AnyPropertyType = 0
+XA_ATOM = 4
+XA_INTEGER = 19
+XA_STRING = 31
+
+Display_p = ctypes.c_void_p
+Window = ctypes.c_ulong
+Atom = ctypes.c_ulong
+Time = ctypes.c_ulong
+
+
+class XSelectionRequestEvent(ctypes.Structure):
+    _fields_ = [('type', ctypes.c_int), ('serial', ctypes.c_ulong), ('send_event', ctypes.c_int),
+                ('display', Display_p), ('owner', Window), ('requestor', Window), ('selection', Atom),
+                ('target', Atom), ('property', Atom), ('time', Time)]
+
+
+class XSelectionEvent(ctypes.Structure):
+    _fields_ = [('type', ctypes.c_int), ('serial', ctypes.c_ulong), ('send_event', ctypes.c_int),
+                ('display', Display_p), ('requestor', Window), ('selection', Atom), ('target', Atom),
+                ('property', Atom), ('time', Time)]
+
+
+class XSelectionClearEvent(ctypes.Structure):
+    _fields_ = [('type', ctypes.c_int), ('serial', ctypes.c_ulong), ('send_event', ctypes.c_int),
+                ('display', Display_p), ('window', Window), ('selection', Atom), ('time', Time)]
+
+
+class XPropertyEvent(ctypes.Structure):
+    _fields_ = [('type', ctypes.c_int), ('serial', ctypes.c_ulong), ('send_event', ctypes.c_int),
+                ('display', Display_p), ('window', Window), ('atom', Atom), ('time', Time),
+                ('state', ctypes.c_int)]
+
+
+class XEvent(ctypes.Union):
+    _fields_ = [('type', ctypes.c_int), ('xselectionrequest', XSelectionRequestEvent),
+                ('xselection', XSelectionEvent), ('xselectionclear', XSelectionClearEvent),
+                ('xproperty', XPropertyEvent), ('pad', ctypes.c_long * 24)]
+
+
+class XErrorEvent(ctypes.Structure):
+    _fields_ = [('type', ctypes.c_int), ('display', Display_p), ('resourceid', ctypes.c_ulong),
+                ('serial', ctypes.c_ulong), ('error_code', ctypes.c_ubyte), ('request_code', ctypes.c_ubyte),
+                ('minor_code', ctypes.c_ubyte)]
+
+
+XErrorHandler = ctypes.CFUNCTYPE(ctypes.c_int, Display_p, ctypes.POINTER(XErrorEvent))
+
+
+@XErrorHandler
+def _error_handler(display, error):
+    # Xlib's default handler exits the process; a requestor closing its window mid-transfer is routine
+    logging.debug(f"X error {error.contents.error_code} in request {error.contents.request_code} "
+                  f"on resource {error.contents.resourceid:#x}")
+    return 0
+
+
+_libs = None
+
+def _load(name):
+    path = ctypes.util.find_library(name)
+    if not path:
+        raise OSError(f"lib{name} not found")
+    return ctypes.CDLL(path)
+
+def libs():
+    """Load libX11 and libXfixes once, raising OSError when unavailable."""
+    global _libs
+    if _libs is None:
+        x11 = _load('X11')
+        xfixes = _load('Xfixes')
+
+        x11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        x11.XOpenDisplay.restype = Display_p
+        x11.XCloseDisplay.argtypes = [Display_p]
+        x11.XDefaultRootWindow.argtypes = [Display_p]
+        x11.XDefaultRootWindow.restype = Window
+        x11.XInternAtom.argtypes = [Display_p, ctypes.c_char_p, ctypes.c_int]
+        x11.XInternAtom.restype = Atom
+        x11.XConnectionNumber.argtypes = [Display_p]
+        x11.XPending.argtypes = [Display_p]
+        x11.XNextEvent.argtypes = [Display_p, ctypes.POINTER(XEvent)]
+        x11.XFlush.argtypes = [Display_p]
+
+        xfixes.XFixesQueryExtension.argtypes = [
+            Display_p, ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int)
+        ]
+        xfixes.XFixesSelectSelectionInput.argtypes = [Display_p, Window, Atom, ctypes.c_ulong]
+
+        # Selection ownership and transfers
+        x11.XCreateSimpleWindow.argtypes = [
+            Display_p, Window, ctypes.c_int, ctypes.c_int, ctypes.c_uint, ctypes.c_uint, ctypes.c_uint,
+            ctypes.c_ulong, ctypes.c_ulong,
+        ]
+        x11.XCreateSimpleWindow.restype = Window
+        x11.XDestroyWindow.argtypes = [Display_p, Window]
+        x11.XSelectInput.argtypes = [Display_p, Window, ctypes.c_long]
+        x11.XSetSelectionOwner.argtypes = [Display_p, Atom, Window, Time]
+        x11.XGetSelectionOwner.argtypes = [Display_p, Atom]
+        x11.XGetSelectionOwner.restype = Window
+        x11.XConvertSelection.argtypes = [Display_p, Atom, Atom, Atom, Window, Time]
+        x11.XGetWindowProperty.argtypes = [
+            Display_p, Window, Atom, ctypes.c_long, ctypes.c_long, ctypes.c_int, Atom,
+            ctypes.POINTER(Atom), ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_ulong),
+            ctypes.POINTER(ctypes.c_ulong), ctypes.POINTER(ctypes.c_void_p),
+        ]
+        x11.XChangeProperty.argtypes = [
+            Display_p, Window, Atom, Atom, ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_int
+        ]
+        x11.XDeleteProperty.argtypes = [Display_p, Window, Atom]
+        x11.XSendEvent.argtypes = [Display_p, Window, ctypes.c_int, ctypes.c_long, ctypes.POINTER(XEvent)]
+        x11.XGetAtomName.argtypes = [Display_p, Atom]
+        x11.XGetAtomName.restype = ctypes.c_void_p
+        x11.XFree.argtypes = [ctypes.c_void_p]
+        x11.XMaxRequestSize.argtypes = [Display_p]
+        x11.XMaxRequestSize.restype = ctypes.c_long
+        x11.XSync.argtypes = [Display_p, ctypes.c_int]
+        x11.XSetErrorHandler.argtypes = [XErrorHandler]
+        x11.XSetErrorHandler.restype = ctypes.c_void_p
+
+        # Displays are used from the owner thread and executor threads
+        x11.XInitThreads()
+        x11.XSetErrorHandler(_error_handler)
+
+        _libs = (x11, xfixes)
+    return _libs
+
+
+# Seconds to wait for another client to answer a selection request or send the next INCR chunk
+SELECTION_TIMEOUT = 5
+# Payloads above this are served incrementally (INCR) rather than in one property
+INCR_CHUNK = 256 * 1024
+# Longest property read in one request, in 32-bit units
+MAX_PROPERTY = 0x1FFFFFFF
+# Targets every text payload is offered as, so old and new clients can paste it
+TEXT_TARGETS = ('UTF8_STRING', 'text/plain;charset=utf-8', 'text/plain', 'STRING', 'TEXT')
+
+
+def _as_bytes(data):
+    return data if isinstance(data, bytes) else bytes(data)
+
+
+def selection_targets(header, data, temp_dir=None):
+    """Map each target to offer for a clipboard update to its bytes."""
+    targets = {}
+    text = header.get('text')
+    if header['type'] == 'application/x-file':
+        path = write_temp_file(data, text, temp_dir)
+        targets['text/uri-list'] = f'file://{path}\r\n'.encode('utf-8')
+        targets['x-special/gnome-copied-files'] = f'copy\nfile://{path}'.encode('utf-8')
+        text = path
+    elif header['type'] == 'text/plain':
+        text = _as_bytes(data).decode('utf-8', 'replace')
+    else:
+        targets[header['type']] = _as_bytes(data)
+    if text:
+        for target in TEXT_TARGETS:
+            targets[target] = text.encode('latin-1' if target == 'STRING' else 'utf-8', 'replace')
+    return targets
+
+
+class _Display:
+    """One X connection with a private window, used by a single thread at a time."""
+
+    def __init__(self):
+        self.x11, _ = libs()
+        self.dpy = self.x11.XOpenDisplay(None)
+        if not self.dpy:
+            raise OSError("Cannot open X display")
+        root = self.x11.XDefaultRootWindow(self.dpy)
+        self.window = self.x11.XCreateSimpleWindow(self.dpy, root, 0, 0, 1, 1, 0, 0, 0)
+        self.x11.XSelectInput(self.dpy, self.window, PropertyChangeMask)
+        self.fd = self.x11.XConnectionNumber(self.dpy)
+        self._atoms = {}
+        self._names = {}
+        self.clipboard = self.atom('CLIPBOARD')
+
+    def atom(self, name):
+        if name not in self._atoms:
+            self._atoms[name] = self.x11.XInternAtom(self.dpy, name.encode('utf-8'), False)
+            self._names[self._atoms[name]] = name
+        return self._atoms[name]
+
+    def atom_name(self, atom):
+        if atom not in self._names:
+            pointer = self.x11.XGetAtomName(self.dpy, atom)
+            if not pointer:
+                return None
+            try:
+                self._names[atom] = ctypes.string_at(pointer).decode('utf-8', 'replace')
+            finally:
+                self.x11.XFree(pointer)
+        return self._names[atom]
+
+    def events(self, timeout):
+        """Yield queued events, waiting up to timeout seconds for more; the event is reused."""
+        event = XEvent()
+        deadline = time.monotonic() + timeout
+        while True:
+            while self.x11.XPending(self.dpy):
+                self.x11.XNextEvent(self.dpy, ctypes.byref(event))
+                yield event
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            select.select([self.fd], [], [], remaining)
+
+    def wait(self, predicate, timeout=SELECTION_TIMEOUT, skipped=None):
+        """The first event matching predicate; others are dropped, or copied to skipped."""
+        for event in self.events(timeout):
+            if predicate(event):
+                return event
+            if skipped is not None:
+                skipped.append(XEvent.from_buffer_copy(event))
+        raise TimeoutError("No reply from the X selection owner")
+
+    def get_property(self, window, prop):
+        """Read and delete a window property as (type, format, bytes)."""
+        actual_type, actual_format = Atom(), ctypes.c_int()
+        nitems, after, pointer = ctypes.c_ulong(), ctypes.c_ulong(), ctypes.c_void_p()
+        status = self.x11.XGetWindowProperty(
+            self.dpy, window, prop, 0, MAX_PROPERTY, True, AnyPropertyType, ctypes.byref(actual_type),
+            ctypes.byref(actual_format), ctypes.byref(nitems), ctypes.byref(after), ctypes.byref(pointer),
+        )
+        if status != 0:
+            return None, 0, b''
+        try:
+            # Format 32 items are C longs in memory, whatever their size on the wire
+            width = {8: 1, 16: ctypes.sizeof(ctypes.c_short), 32: ctypes.sizeof(ctypes.c_long)}
+            size = nitems.value * width.get(actual_format.value, 0)
+            data = ctypes.string_at(pointer, size) if pointer and size else b''
+        finally:
+            if pointer:
+                self.x11.XFree(pointer)
+        return actual_type.value, actual_format.value, data
+
+    def set_property(self, window, prop, type_, data, format=8):
+        """Replace a property; format 32 data is a list of integers."""
+        if format == 32:
+            items = (ctypes.c_long * len(data))(*data)
+            count = len(data)
+        else:
+            items = ctypes.create_string_buffer(data, len(data))
+            count = len(data)
+        self.x11.XChangeProperty(self.dpy, window, prop, type_, format, PropModeReplace, items, count)
+
+    def close(self):
+        if self.dpy:
+            self.x11.XDestroyWindow(self.dpy, self.window)
+            self.x11.XCloseDisplay(self.dpy)
+            self.dpy = None
+
+
+class _Transfer:
+    """An INCR transfer to one requestor, advanced each time it deletes the property."""
+
+    def __init__(self, type_, data):
+        self.type = type_
+        self.data = data
+        self.offset = 0
+        self.finished = False
+        self.touched = time.monotonic()
+
+
+class X11Clipboard:
+    """CLIPBOARD access over Xlib, without helper processes.
+
+    Reads convert the selection into a property of a private window,
+    following INCR for large payloads. Writes make this process the selection
+    owner: a thread answers other clients' requests from memory for every
+    offered target, including TARGETS and TIMESTAMP, until another client
+    takes the selection.
+    """
+
+    def __init__(self):
+        self._reader = _Display()
+        self._reader_lock = threading.Lock()
+        self._owner = _Display()
+        self._chunk = min(INCR_CHUNK, self._owner.x11.XMaxRequestSize(self._owner.dpy) * 4 - 1024)
+        # Written by set_content, applied on the owner thread
+        self._lock = threading.Lock()
+        self._pending = None
+        self._owned = None
+        self._owned_count = 0
+        self._took_ownership = False
+        self._targets = {}
+        self._timestamp = CurrentTime
+        self._transfers = {}
+        self._wake_read, self._wake_write = os.pipe()
+        self._closed = False
+        self._thread = threading.Thread(target=self._serve, name='x11-selection', daemon=True)
+        self._thread.start()
+
+    # Reading
+
+    def _convert(self, target):
+        """The selection converted to target as (type name, bytes), or None if the owner refused."""
+        d = self._reader
+        prop = d.atom('BB_SELECTION')
+        target_atom = d.atom(target)
+        d.x11.XDeleteProperty(d.dpy, d.window, prop)
+        d.x11.XConvertSelection(d.dpy, d.clipboard, target_atom, prop, d.window, CurrentTime)
+        d.x11.XFlush(d.dpy)
+        event = d.wait(lambda e: e.type == SelectionNotify and e.xselection.requestor == d.window
+                       and e.xselection.target == target_atom)
+        if not event.xselection.property:
+            return None
+        type_, _, data = d.get_property(d.window, prop)
+        if type_ == d.atom('INCR'):
+            chunks = []
+            while True:
+                d.wait(lambda e: e.type == PropertyNotify and e.xproperty.window == d.window
+                       and e.xproperty.atom == prop and e.xproperty.state == PropertyNewValue)
+                type_, _, chunk = d.get_property(d.window, prop)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            data = b''.join(chunks)
+        return d.atom_name(type_) if type_ else None, data
+
+    def _read(self, target):
+        try:
+            converted = self._convert(target)
+        except TimeoutError as e:
+            logging.info(f"Error reading clipboard target {target}: {e}")
+            return None
+        return converted[1] if converted else None
+
+    def _targets_offered(self):
+        d = self._reader
+        converted = self._convert('TARGETS')
+        if not converted:
+            return []
+        data = converted[1]
+        count = len(data) // ctypes.sizeof(ctypes.c_ulong)
+        atoms = (ctypes.c_ulong * count).from_buffer_copy(data[:count * ctypes.sizeof(ctypes.c_ulong)])
+        return [name for name in (d.atom_name(atom) for atom in atoms) if name]
+
+    def _owns_selection(self):
+        d = self._reader
+        return d.x11.XGetSelectionOwner(d.dpy, d.clipboard) == self._owner.window
+
+    def get_content(self):
+        with self._reader_lock:
+            if self._owns_selection():
+                return self._owned
+            try:
+                targets = self._targets_offered()
+            except TimeoutError as e:
+                logging.info(f"Error reading clipboard targets: {e}")
+                return None
+
+            if 'text/uri-list' in targets:
+                uri_data = self._read('text/uri-list')
+                if uri_data:
+                    uri = uri_data.decode('utf-8').strip().splitlines()[0]
+                    if uri.startswith('file:///'):
+                        return handle_clipboard_file(uri[7:])
+
+            # Many clients only offer text as UTF8_STRING
+            aliases = {'text/plain': ('text/plain', 'text/plain;charset=utf-8', 'UTF8_STRING', 'STRING')}
+            for mime_type in MIME_ORDER:
+                for target in aliases.get(mime_type, (mime_type,)):
+                    if target not in targets:
+                        continue
+                    data = self._read(target)
+                    if data is None:
+                        continue
+                    header = {'type': mime_type, 'size': len(data), 'hash': calculate_hash(data)}
+                    if mime_type != 'text/plain':
+                        for text_target in ('UTF8_STRING', 'STRING'):
+                            if text_target in targets:
+                                text = self._read(text_target)
+                                if text:
+                                    header['text'] = text.decode('utf-8', 'replace')
+                                break
+                    return header, data
+            return None
+
+    def get_fingerprint(self):
+        with self._reader_lock:
+            if self._owns_selection():
+                return f'bounceboard:{self._owned_count}'.encode()
+            try:
+                timestamp = self._convert('TIMESTAMP')
+                if not timestamp:
+                    return None
+                targets = self._convert('TARGETS')
+            except TimeoutError:
+                return None
+            return timestamp[1] + b'\0' + (targets[1] if targets else b'')
+
+    # Owning
+
+    def set_content(self, clipboard, temp_dir=None):
+        header, data = clipboard
+        targets = selection_targets(header, data, temp_dir)
+        done = threading.Event()
+        with self._lock:
+            self._pending = (clipboard, targets, done)
+        os.write(self._wake_write, b'\0')
+        if not done.wait(SELECTION_TIMEOUT):
+            logging.error("Timed out taking ownership of the X clipboard")
+            return False
+        return self._took_ownership
+
+    def _server_time(self, skipped):
+        """Current X server time, from a property change on the owner window."""
+        d = self._owner
+        prop = d.atom('BB_TIMESTAMP')
+        d.x11.XChangeProperty(d.dpy, d.window, prop, XA_STRING, 8, PropModeAppend, None, 0)
+        d.x11.XFlush(d.dpy)
+        event = d.wait(lambda e: e.type == PropertyNotify and e.xproperty.window == d.window
+                       and e.xproperty.atom == prop, skipped=skipped)
+        return event.xproperty.time
+
+    def _take_ownership(self, pending):
+        clipboard, targets, done = pending
+        d = self._owner
+        skipped = []
+        try:
+            timestamp = self._server_time(skipped)
+            d.x11.XSetSelectionOwner(d.dpy, d.clipboard, d.window, timestamp)
+            self._took_ownership = d.x11.XGetSelectionOwner(d.dpy, d.clipboard) == d.window
+            if self._took_ownership:
+                # Each target's data is typed as the target itself, except the legacy text targets
+                types = {'STRING': XA_STRING, 'TEXT': d.atom('UTF8_STRING')}
+                self._targets = {
+                    d.atom(name): (types.get(name) or d.atom(name), data) for name, data in targets.items()
+                }
+                self._timestamp = timestamp
+                self._owned = clipboard
+                self._owned_count += 1
+        except TimeoutError:
+            logging.exception("Could not get the X server time")
+            self._took_ownership = False
+        finally:
+            done.set()
+        for event in skipped:
+            self._dispatch(event)
+
+    def _answer(self, request):
+        d = self._owner
+        prop = request.property or request.target
+        accepted = False
+        if request.selection == d.clipboard and self._targets:
+            if request.target == d.atom('TARGETS'):
+                atoms = [d.atom('TARGETS'), d.atom('TIMESTAMP')] + list(self._targets)
+                d.set_property(request.requestor, prop, XA_ATOM, atoms, format=32)
+                accepted = True
+            elif request.target == d.atom('TIMESTAMP'):
+                d.set_property(request.requestor, prop, XA_INTEGER, [self._timestamp], format=32)
+                accepted = True
+            elif request.target in self._targets:
+                type_, data = self._targets[request.target]
+                if len(data) > self._chunk:
+                    d.x11.XSelectInput(d.dpy, request.requestor, PropertyChangeMask)
+                    d.set_property(request.requestor, prop, d.atom('INCR'), [len(data)], format=32)
+                    self._transfers[(request.requestor, prop)] = _Transfer(type_, data)
+                else:
+                    d.set_property(request.requestor, prop, type_, data)
+                accepted = True
+
+        reply = XEvent()
+        reply.xselection.type = SelectionNotify
+        reply.xselection.requestor = request.requestor
+        reply.xselection.selection = request.selection
+        reply.xselection.target = request.target
+        reply.xselection.property = prop if accepted else 0
+        reply.xselection.time = request.time
+        d.x11.XSendEvent(d.dpy, request.requestor, False, 0, ctypes.byref(reply))
+        d.x11.XFlush(d.dpy)
+
+    def _continue_transfer(self, event):
+        key = (event.window, event.atom)
+        transfer = self._transfers.get(key)
+        if not transfer or event.state != PropertyDelete:
+            return
+        d = self._owner
+        chunk = transfer.data[transfer.offset:transfer.offset + self._chunk]
+        transfer.offset += len(chunk)
+        transfer.touched = time.monotonic()
+        # An empty chunk ends the transfer
+        d.set_property(event.window, event.atom, transfer.type, chunk)
+        if not chunk:
+            self._end_transfer(key)
+        d.x11.XFlush(d.dpy)
+
+    def _end_transfer(self, key):
+        del self._transfers[key]
+        if not any(window == key[0] for window, _ in self._transfers):
+            self._owner.x11.XSelectInput(self._owner.dpy, key[0], 0)
+
+    def _dispatch(self, event):
+        if event.type == SelectionRequest:
+            self._answer(event.xselectionrequest)
+        elif event.type == SelectionClear:
+            if event.xselectionclear.selection == self._owner.clipboard:
+                # Another client copied something; stop serving ours
+                self._targets = {}
+                self._transfers.clear()
+        elif event.type == PropertyNotify:
+            self._continue_transfer(event.xproperty)
+
+    def _serve(self):
+        d = self._owner
+        while not self._closed:
+            readable, _, _ = select.select([d.fd, self._wake_read], [], [], 1.0)
+            if self._wake_read in readable:
+                os.read(self._wake_read, 64)
+                with self._lock:
+                    pending, self._pending = self._pending, None
+                if pending:
+                    self._take_ownership(pending)
+            for event in d.events(0):
+                self._dispatch(event)
+            now = time.monotonic()
+            for key, transfer in list(self._transfers.items()):
+                if now - transfer.touched > SELECTION_TIMEOUT:
+                    logging.info(f"Abandoning clipboard transfer to window {key[0]:#x}")
+                    self._end_transfer(key)
+            d.x11.XFlush(d.dpy)
+
+    def close(self):
+        self._closed = True
+        os.write(self._wake_write, b'\0')
+        self._thread.join(SELECTION_TIMEOUT)
+        self._owner.close()
+        self._reader.close()
+        os.close(self._wake_read)
+        os.close(self._wake_write)
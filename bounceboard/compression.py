@@ -0,0 +1,136 @@
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ZSTD_LEVEL = 3
+ZLIB_LEVEL = 1
+# Smaller payloads are not worth the CPU or the extra header field
+MIN_COMPRESS_SIZE = 1024
+# Files are only compressed when a sample of them shrinks at least this much
+SAMPLE_SIZE = 64 * 1024
+SAMPLE_RATIO = 0.9
+# Most bytes a zstd decoder produces per step, so a size limit is checked before more is inflated
+DECODE_STEP = 1024 * 1024
+
+# Codecs in order of preference
+CODECS = (["zstd"] if zstandard else []) + ["zlib"]
+_ERRORS = (zlib.error, zstandard.ZstdError) if zstandard else (zlib.error,)
+
+
+def choose_codec(features):
+    """Return the preferred codec both peers support, or None."""
+    for codec in CODECS:
+        if codec in features:
+            return codec
+    return None
+
+
+def _compress(codec, data):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return zlib.compress(data, ZLIB_LEVEL)
+
+
+def should_compress(header, data):
+    if len(data) < MIN_COMPRESS_SIZE:
+        return False
+    mime = header.get("type", "")
+    if mime.startswith("text/"):
+        return True
+    if mime == "application/x-file":
+        sample = memoryview(data)[:SAMPLE_SIZE]
+        return len(zlib.compress(sample, 1)) < len(sample) * SAMPLE_RATIO
+    # image/png and anything unknown is assumed to be compressed already
+    return False
+
+
+def encode(codec, header, data):
+    """Compress a payload for the wire, returning None when it isn't worth it."""
+    if not codec or not should_compress(header, data):
+        return None
+    encoded = _compress(codec, data)
+    if len(encoded) >= len(data):
+        return None
+    return encoded
+
+
+class _Sink:
+    """Collects a zstd stream writer's output, refusing more than limit bytes in total."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.length = 0
+        self.parts = []
+
+    def write(self, data):
+        self.length += len(data)
+        if self.limit is not None and self.length > self.limit:
+            raise ValueError(f"Payload decompresses to more than {self.limit} bytes")
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data, self.parts = b"".join(self.parts), []
+        return data
+
+
+class Decoder:
+    """Incremental decompressor for one payload.
+
+    With max_length, ValueError is raised as soon as the output would exceed
+    it; output is produced in bounded steps, so a small hostile payload can't
+    inflate into more than that in memory first.
+    """
+
+    def __init__(self, encoding, max_length=None):
+        self.max_length = max_length
+        self.length = 0
+        if encoding == "zstd":
+            if not zstandard:
+                raise ValueError("zstd payload received but zstandard is not installed")
+            self._sink = _Sink(max_length)
+            self._obj = zstandard.ZstdDecompressor().stream_writer(self._sink, write_size=DECODE_STEP)
+        elif encoding == "zlib":
+            self._sink = None
+            self._obj = zlib.decompressobj()
+        else:
+            raise ValueError(f"Unknown payload encoding: {encoding}")
+        self.encoding = encoding
+
+    def decompress(self, data):
+        try:
+            if self._sink:
+                self._obj.write(data)
+                return self._count(self._sink.take())
+            if self.max_length is None:
+                return self._count(self._obj.decompress(data))
+            # Stops one byte past the room left, which _count rejects; input it
+            # couldn't inflate is left in unconsumed_tail and never decoded
+            decoded = self._obj.decompress(data, self.max_length - self.length + 1)
+            return self._count(decoded)
+        except _ERRORS as e:
+            raise ValueError(f"Corrupt {self.encoding} payload: {e}") from e
+
+    def flush(self):
+        try:
+            if self._sink:
+                self._obj.flush()
+                return self._count(self._sink.take())
+            return self._count(self._obj.flush())
+        except _ERRORS as e:
+            raise ValueError(f"Corrupt {self.encoding} payload: {e}") from e
+
+    def _count(self, data):
+        self.length += len(data)
+        if self.max_length is not None and self.length > self.max_length:
+            raise ValueError(f"Payload decompresses to more than {self.max_length} bytes")
+        return data
+
+
+def decode(encoding, data, max_length=None):
+    """Decompress a whole payload, raising ValueError if it is corrupt or larger than max_length."""
+    decoder = Decoder(encoding, max_length)
+    return decoder.decompress(data) + decoder.flush()
@@ -0,0 +1,101 @@
+import struct
+
+# Lines shorter than this are too common to anchor a copy on
+MIN_ANCHOR = 16
+# Copies shorter than this cost more to describe than to insert
+MIN_COPY = 32
+
+_COPY = b"C"
+_INSERT = b"I"
+_COPY_OP = struct.Struct(">QQ")
+_INSERT_OP = struct.Struct(">Q")
+
+
+def _match_length(base, b, data, t):
+    """Length of the common run base[b:] / data[t:], found with slice compares."""
+    limit = min(len(base) - b, len(data) - t)
+    matched, step = 0, 64
+    while matched < limit:
+        n = min(step, limit - matched)
+        if base[b + matched:b + matched + n] == data[t + matched:t + matched + n]:
+            matched += n
+            step *= 2
+            continue
+        lo, hi = matched, matched + n
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if base[b + matched:b + mid] == data[t + matched:t + mid]:
+                lo = mid
+            else:
+                hi = mid
+        return lo
+    return matched
+
+
+def _lines(view):
+    """Yield (offset, line) for every newline-terminated line in view."""
+    data = bytes(view) if not isinstance(view, bytes) else view
+    start = 0
+    while start < len(data):
+        end = data.find(b"\n", start)
+        end = len(data) if end == -1 else end + 1
+        yield start, data[start:end]
+        start = end
+
+
+def encode(base, data):
+    """Describe data as copies from base plus inserted bytes.
+
+    Lines of base are indexed and used as anchors; each anchored match is
+    extended byte-wise, so edits that move or splice text still reuse the
+    unchanged runs around them.
+    """
+    base, data = memoryview(base), memoryview(data)
+    index = {}
+    for offset, line in _lines(base):
+        if len(line) >= MIN_ANCHOR:
+            index.setdefault(line, offset)
+
+    ops = []
+    literal = t = 0
+    raw = bytes(data)
+    while t < len(raw):
+        end = raw.find(b"\n", t)
+        end = len(raw) if end == -1 else end + 1
+        b = index.get(raw[t:end])
+        if b is not None:
+            n = _match_length(base, b, data, t)
+            if n >= MIN_COPY:
+                if literal < t:
+                    ops.append(_INSERT + _INSERT_OP.pack(t - literal) + raw[literal:t])
+                ops.append(_COPY + _COPY_OP.pack(b, n))
+                t = literal = t + n
+                continue
+        t = end
+    if literal < len(raw):
+        ops.append(_INSERT + _INSERT_OP.pack(len(raw) - literal) + raw[literal:])
+    return b"".join(ops)
+
+
+def apply(base, delta):
+    """Rebuild the payload described by delta against base."""
+    base, delta = memoryview(base), memoryview(delta)
+    parts = []
+    pos = 0
+    while pos < len(delta):
+        op = delta[pos:pos + 1]
+        pos += 1
+        if op == _COPY:
+            offset, length = _COPY_OP.unpack_from(delta, pos)
+            pos += _COPY_OP.size
+            if offset + length > len(base):
+                raise ValueError("Delta copy outside of base")
+            parts.append(base[offset:offset + length])
+        elif op == _INSERT:
+            (length,) = _INSERT_OP.unpack_from(delta, pos)
+            pos += _INSERT_OP.size
+            parts.append(delta[pos:pos + length])
+            pos += length
+        else:
+            raise ValueError("Corrupt delta")
+    return b"".join(parts)
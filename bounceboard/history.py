@@ -0,0 +1,430 @@
+import json
+import logging
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+
+from .payload import map_path
+from .search import HistorySearch, entry_text
+
+# Payload segments are rotated once they reach this size
+SEGMENT_SIZE = 64 * 1024 * 1024
+# Partially dead segments are rewritten when less than this fraction is still live
+COMPACT_LIVE_RATIO = 0.5
+COMPACT_INTERVAL = 3600
+BATCH_SIZE = 64
+# Payloads up to this size are read into memory rather than mapped; each mapping holds a descriptor
+MAP_THRESHOLD = 1024 * 1024
+
+INDEX_NAME = "index.log"
+SEARCH_NAME = "search.db"
+HEADER_FIELDS = ("time", "type", "size", "hash", "text")
+
+_SEGMENT_RE = re.compile(r"^seg-(\d+)\.bin$")
+_DAY_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+class HistoryWriter:
+    """Background thread that writes queued updates for any number of HistoryLogs.
+
+    A server with many rooms shares one writer between all their histories
+    instead of running a thread per room.
+    """
+
+    def __init__(self):
+        self._ready = queue.Queue()
+        self._logs = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, log):
+        with self._lock:
+            self._logs.add(log)
+            # Started with the first log, so an unused writer costs no thread
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+                self._thread.start()
+
+    def remove(self, log):
+        with self._lock:
+            self._logs.discard(log)
+
+    def wake(self, log):
+        """Have the writer drain log's queue."""
+        self._ready.put(log)
+
+    def close(self):
+        if self._thread and self._thread.is_alive():
+            self._ready.put(None)
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            try:
+                log = self._ready.get(timeout=COMPACT_INTERVAL)
+            except queue.Empty:
+                log = False
+            with self._lock:
+                logs = list(self._logs)
+            for each in logs:
+                each._compact_if_due()
+            if log is None:
+                return
+            if log:
+                log._drain()
+
+
+class HistoryLog:
+    """Append-only clipboard history.
+
+    Payloads are appended once per hash to numbered segment files, and every
+    update appends one JSON line (header fields plus the payload's segment,
+    offset and length) to an index log. Writes happen in batches on a
+    HistoryWriter thread so callers on the event loop never block on disk;
+    pass writer to share one between several logs.
+    """
+
+    def __init__(self, path, max_age=None, max_bytes=None, writer=None):
+        self.path = path
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Held while writing or compacting, so close() never races the writer thread
+        self._write_lock = threading.Lock()
+        self._entries = []
+        self._blobs = {}
+        # Most recent record per payload hash, for lookup()
+        self._latest = {}
+        self._next_id = 1
+        self._queue = queue.Queue()
+        self._closed = False
+        self._last_compact = 0
+        os.makedirs(path, exist_ok=True)
+
+        self._load()
+        self.search = self._open_search()
+        segments = self._segments()
+        self._segment = segments[-1] if segments else 1
+        # Opened when first written to, and closed again by release()
+        self._segment_file = None
+        self._index_file = None
+
+        if not self._entries:
+            self.import_legacy()
+        self._catch_up_search()
+
+        self._owns_writer = writer is None
+        self._writer = writer or HistoryWriter()
+        self._writer.add(self)
+
+    def _segment_path(self, segment):
+        return os.path.join(self.path, f"seg-{segment:06d}.bin")
+
+    def _segments(self):
+        found = (_SEGMENT_RE.match(name) for name in os.listdir(self.path))
+        return sorted(int(m.group(1)) for m in found if m)
+
+    def _load(self):
+        index_path = os.path.join(self.path, INDEX_NAME)
+        if not os.path.exists(index_path):
+            return
+        complete = 0
+        with open(index_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                complete += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logging.warning("Skipping corrupt history index line")
+                    continue
+                record.setdefault("id", self._next_id)
+                self._next_id = record["id"] + 1
+                self._entries.append(record)
+                self._blobs[record["hash"]] = (record["seg"], record["off"], record["len"])
+                self._latest[record["hash"]] = record
+        if complete < os.path.getsize(index_path):
+            # A torn final line from a crash; cut it off so the next append starts on a line of its own
+            logging.warning("Truncating torn history index line")
+            os.truncate(index_path, complete)
+
+    def _open_search(self):
+        try:
+            return HistorySearch(os.path.join(self.path, SEARCH_NAME))
+        except sqlite3.Error as e:
+            logging.warning(f"History search unavailable: {e}")
+            return None
+
+    def _catch_up_search(self):
+        """Index entries written while the search database was missing or behind."""
+        if not self.search:
+            return
+        last_id = self.search.last_id()
+        missing = [e for e in self._entries if e["id"] > last_id]
+        for i in range(0, len(missing), BATCH_SIZE):
+            batch = missing[i:i + BATCH_SIZE]
+            self.search.add((e, entry_text(e, self.get(e["hash"]))) for e in batch)
+        if missing:
+            logging.info("Indexed %d clipboard history entries for search", len(missing))
+
+    def append(self, header, data):
+        """Queue an update for the writer thread."""
+        self._queue.put((dict(header, time=time.time()), data))
+        self._writer.wake(self)
+
+    def flush(self):
+        """Block until every queued update is on disk."""
+        self._queue.join()
+
+    def close(self):
+        """Write everything queued, then close the log's files; blocks, so keep it off the event loop."""
+        if self._closed:
+            return
+        self.flush()
+        self._writer.remove(self)
+        if self._owns_writer:
+            self._writer.close()
+        with self._write_lock:
+            self._closed = True
+            self._close_files()
+
+    def release(self):
+        """Write everything queued, then close the log's files until it is next written or searched.
+
+        Blocks, so keep it off the event loop. For logs that may sit unused
+        for a long time, such as those of rooms without clients.
+        """
+        self.flush()
+        with self._write_lock:
+            self._close_files()
+
+    def _open_files(self):
+        if not self._segment_file:
+            self._segment_file = open(self._segment_path(self._segment), "ab")
+            self._index_file = open(os.path.join(self.path, INDEX_NAME), "a")
+
+    def _close_files(self):
+        if self._segment_file:
+            self._segment_file.close()
+            self._index_file.close()
+            self._segment_file = self._index_file = None
+        if self.search:
+            self.search.close()
+
+    def entries(self):
+        with self._lock:
+            return list(self._entries)
+
+    def lookup(self, digest):
+        """Most recent index record for a payload hash, or None."""
+        with self._lock:
+            entry = self._latest.get(digest)
+        return dict(entry) if entry else None
+
+    def latest(self):
+        """The most recent update as (header, data), or None if it isn't kept."""
+        with self._lock:
+            entry = self._entries[-1] if self._entries else None
+        if not entry:
+            return None
+        data = self.get(entry["hash"])
+        if data is None:
+            return None
+        return {field: entry[field] for field in HEADER_FIELDS if field in entry and field != "time"}, data
+
+    def get(self, digest):
+        """Return a stored payload as a bytes-like object, or None if it isn't kept."""
+        with self._lock:
+            loc = self._blobs.get(digest)
+        if not loc:
+            return None
+        try:
+            return self._read(loc)
+        except FileNotFoundError:
+            return None
+
+    def _read(self, loc):
+        segment, offset, length = loc
+        if not length:
+            return b""
+        if length <= MAP_THRESHOLD:
+            with open(self._segment_path(segment), "rb") as f:
+                f.seek(offset)
+                return f.read(length)
+        return map_path(self._segment_path(segment))[offset:offset + length]
+
+    def _compact_if_due(self):
+        if not (self.max_age or self.max_bytes) or time.time() - self._last_compact < COMPACT_INTERVAL:
+            return
+        with self._write_lock:
+            if self._closed:
+                return
+            try:
+                self.compact()
+            except Exception:
+                logging.exception("Error compacting clipboard history")
+            self._last_compact = time.time()
+
+    def _drain(self):
+        """Write every queued update, in batches; runs on the writer thread."""
+        while True:
+            batch = []
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            try:
+                with self._write_lock:
+                    if not self._closed:
+                        self._write_batch(batch)
+            except Exception:
+                logging.exception("Error saving clipboard history")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_payload(self, data):
+        self._open_files()
+        size = self._segment_file.tell()
+        if size and size + len(data) > SEGMENT_SIZE:
+            self._segment_file.close()
+            self._segment += 1
+            self._segment_file = open(self._segment_path(self._segment), "ab")
+            size = 0
+        self._segment_file.write(data)
+        return (self._segment, size, len(data))
+
+    def _write_batch(self, batch):
+        if not batch:
+            return
+        self._open_files()
+        records = []
+        texts = []
+        written = {}
+        for header, data in batch:
+            digest = header["hash"]
+            with self._lock:
+                loc = self._blobs.get(digest)
+            loc = loc or written.get(digest)
+            if not loc:
+                loc = written[digest] = self._write_payload(data)
+            record = {"id": self._next_id}
+            record.update((field, header[field]) for field in HEADER_FIELDS if field in header)
+            record["seg"], record["off"], record["len"] = loc
+            self._next_id += 1
+            records.append(record)
+            texts.append(entry_text(header, data))
+        self._segment_file.flush()
+        self._index_file.write("".join(json.dumps(r) + "\n" for r in records))
+        self._index_file.flush()
+        with self._lock:
+            self._entries.extend(records)
+            self._blobs.update(written)
+            self._latest.update((r["hash"], r) for r in records)
+        if self.search:
+            self.search.add(zip(records, texts))
+
+    def _retained(self, entries):
+        if self.max_age:
+            cutoff = time.time() - self.max_age
+            entries = [e for e in entries if e["time"] >= cutoff]
+        if self.max_bytes:
+            kept, seen, total = [], set(), 0
+            for entry in reversed(entries):
+                if entry["hash"] not in seen:
+                    if total + entry["len"] > self.max_bytes:
+                        break
+                    seen.add(entry["hash"])
+                    total += entry["len"]
+                kept.append(entry)
+            entries = kept[::-1]
+        return entries
+
+    def compact(self):
+        """Apply retention, rewrite mostly dead segments and rewrite the index.
+
+        Runs on the writer thread, so no appends interleave with it.
+        """
+        entries = self.entries()
+        keep = self._retained(entries)
+        live = {}
+        for entry in keep:
+            live[entry["hash"]] = (entry["seg"], entry["off"], entry["len"])
+
+        live_bytes = {}
+        for segment, _, length in live.values():
+            live_bytes[segment] = live_bytes.get(segment, 0) + length
+        drop = []
+        for segment in self._segments():
+            if segment == self._segment:
+                continue
+            size = os.path.getsize(self._segment_path(segment))
+            if live_bytes.get(segment, 0) < size * COMPACT_LIVE_RATIO:
+                drop.append(segment)
+        if len(keep) == len(entries) and not drop:
+            return
+
+        self._open_files()
+        moved = {}
+        for digest, loc in live.items():
+            if loc[0] in drop:
+                moved[digest] = self._write_payload(self._read(loc))
+        self._segment_file.flush()
+        live.update(moved)
+
+        keep = [dict(e, **dict(zip(("seg", "off", "len"), live[e["hash"]]))) for e in keep]
+        index_path = os.path.join(self.path, INDEX_NAME)
+        with open(index_path + ".tmp", "w") as f:
+            f.write("".join(json.dumps(r) + "\n" for r in keep))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(index_path + ".tmp", index_path)
+        self._index_file.close()
+        self._index_file = open(index_path, "a")
+
+        with self._lock:
+            self._entries = keep
+            self._blobs = live
+            self._latest = {e["hash"]: e for e in keep}
+        if self.search:
+            self.search.remove_before(keep[0]["id"] if keep else self._next_id)
+        for segment in drop:
+            os.unlink(self._segment_path(segment))
+        logging.info("Compacted clipboard history: %d of %d entries kept, %d segments removed",
+                     len(keep), len(entries), len(drop))
+
+    def import_legacy(self):
+        """Import the <day>/<hash>.json + .bin layout written by earlier versions."""
+        items = []
+        for day in sorted(os.listdir(self.path)):
+            day_dir = os.path.join(self.path, day)
+            if not _DAY_RE.match(day) or not os.path.isdir(day_dir):
+                continue
+            for name in os.listdir(day_dir):
+                if not name.endswith(".json"):
+                    continue
+                bin_path = os.path.join(day_dir, name[:-5] + ".bin")
+                if not os.path.exists(bin_path):
+                    continue
+                try:
+                    with open(os.path.join(day_dir, name)) as f:
+                        header = json.load(f)
+                except ValueError:
+                    logging.warning(f"Skipping unreadable history entry {day}/{name}")
+                    continue
+                header.setdefault("time", os.path.getmtime(bin_path))
+                items.append((header, bin_path))
+        if not items:
+            return
+        items.sort(key=lambda item: item[0]["time"])
+        for i in range(0, len(items), BATCH_SIZE):
+            batch = [(header, map_path(path)) for header, path in items[i:i + BATCH_SIZE]]
+            self._write_batch(batch)
+        logging.info("Imported %d clipboard history entries from %s", len(items), self.path)
@@ -0,0 +1,202 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; covers a fast in-memory read through a slow multi-megabyte transfer
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}, got {tuple(labels)}")
+        return tuple(labels[name] for name in self.labels)
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        """Yield (suffix, label values, extra labels, value) for rendering."""
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield "", key, (), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labels, key, extra)} {_format_number(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing total."""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, or be read from a callback at render time."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function):
+        """Read values from function() when rendering.
+
+        Without labels it returns a number; with labels, a dict mapping
+        label value tuples to numbers.
+        """
+        self._function = function
+
+    def samples(self):
+        if not self._function:
+            yield from super().samples()
+            return
+        values = self._function()
+        if not self.labels:
+            values = {(): values}
+        for key, value in values.items():
+            yield "", key, (), value
+
+    def value(self, **labels):
+        if self._function:
+            values = self._function()
+            return values if not self.labels else values.get(self._key(labels), 0)
+        return super().value(**labels)
+
+
+class Histogram(_Metric):
+    """Distribution of observations over fixed buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def value(self, **labels):
+        """Number of observations."""
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels), ([0], 0.0))
+        return sum(counts)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(counts), total)) for key, (counts, total) in self._values.items()]
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield "_bucket", key, (("le", _format_number(float(bound))),), cumulative
+            yield "_sum", key, (), total
+            yield "_count", key, (), cumulative
+
+
+class Registry:
+    """Named metrics rendered together in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        return "".join(metric.render() + "\n" for metric in self._metrics.values())
+
+
+REGISTRY = Registry()
+
+BACKEND_GET = REGISTRY.histogram(
+    "bounceboard_backend_get_seconds", "Time to read the local clipboard", ["type"]
+)
+BACKEND_SET = REGISTRY.histogram(
+    "bounceboard_backend_set_seconds", "Time to write the local clipboard", ["type"]
+)
+HASH = REGISTRY.histogram("bounceboard_hash_seconds", "Time spent hashing clipboard payloads", ["source"])
+BYTES_SENT = REGISTRY.counter("bounceboard_sent_bytes_total", "Payload bytes sent to peers")
+BYTES_RECEIVED = REGISTRY.counter("bounceboard_received_bytes_total", "Payload bytes received from peers")
+CLIENTS = REGISTRY.gauge("bounceboard_connected_clients", "Clients connected to the server")
+ROOMS = REGISTRY.gauge("bounceboard_rooms", "Open clipboard rooms on the server")
+BACKLOG = REGISTRY.gauge(
+    "bounceboard_send_backlog", "Clipboard states waiting to be sent to a peer", ["peer"]
+)
+PROPAGATION = REGISTRY.histogram(
+    "bounceboard_propagation_seconds",
+    "Time from a change being detected on one machine to it being applied on another",
+)
+CONNECT = REGISTRY.histogram(
+    "bounceboard_connect_seconds",
+    "Time from a client starting a connection attempt to its first sync with the server",
+    ["tls"],
+)
@@ -0,0 +1,59 @@
+import mmap
+import tempfile
+
+# Payloads larger than this live in a temporary file instead of the heap
+SPOOL_THRESHOLD = 4 * 1024 * 1024
+
+
+def map_file(f):
+    """Read-only memoryview over an open file's current contents, without reading it."""
+    f.flush()
+    size = f.seek(0, 2)
+    if not size:
+        return b""
+    return memoryview(mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ))
+
+
+def map_path(path):
+    """Map a file on disk; the mapping stays valid after the file is closed."""
+    with open(path, "rb") as f:
+        return map_file(f)
+
+
+class Spool:
+    """Accumulate a payload in memory, spilling to a temporary file once it grows large.
+
+    finish() returns a bytes-like object: the in-memory buffer for small
+    payloads, or a memoryview over an mmap of the spool file. Either can be
+    hashed, sliced, written or sent without copying the data again.
+    """
+
+    def __init__(self, size_hint=0, threshold=SPOOL_THRESHOLD):
+        self.threshold = threshold
+        self.size = 0
+        self._buffer = bytearray()
+        self._file = tempfile.TemporaryFile() if size_hint > threshold else None
+
+    def write(self, data):
+        self.size += len(data)
+        if self._file:
+            self._file.write(data)
+            return
+        self._buffer += data
+        if len(self._buffer) > self.threshold:
+            self._file = tempfile.TemporaryFile()
+            self._file.write(self._buffer)
+            self._buffer = bytearray()
+
+    def finish(self):
+        if not self._file:
+            return self._buffer
+        data = map_file(self._file)
+        self.close()
+        return data
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+        self._buffer = bytearray()
@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+import logging
+import time
+
+from .app import clipboard_bytes, save_clipboard_update
+
+# Rooms without connections for this long are dropped; they reopen from history on next use
+ROOM_IDLE_TIMEOUT = 600
+ROOM_SWEEP_INTERVAL = 60
+# Keys shorter than this are refused in room mode, since any key opens a room
+MIN_ROOM_KEY = 8
+# Default for --max-rooms: past this the longest-idle room is closed, or new rooms are refused
+MAX_ROOMS = 1024
+
+# Header fields that only make sense for an update delivered as it happens
+LIVE_FIELDS = ("detected", "trace")
+
+
+def room_id(key):
+    """Stable name for a room that doesn't reveal its key, for directories and logs."""
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+class Room:
+    """A group of connections sharing one clipboard.
+
+    The latest state is kept as a versioned snapshot, updated on every local
+    change and relayed update, so new connections never have to read the
+    clipboard backend. With a manager the room mirrors the local clipboard;
+    without one the room's state lives only in memory (and its history, if
+    it has one).
+    """
+
+    __slots__ = ("id", "connections", "current", "version", "blobs", "history", "manager", "last_active",
+                 "_loading")
+
+    def __init__(self, id, blobs, manager=None, history=None):
+        self.id = id
+        self.connections = set()
+        self.current = None
+        self.version = 0
+        self.blobs = blobs
+        self.history = history
+        self.manager = manager
+        self.last_active = time.monotonic()
+        self._loading = None
+        if history:
+            self.set_current(history.latest())
+
+    def set_current(self, clipboard):
+        """Make clipboard the snapshot, stamping its header with the new version as "seq".
+
+        Returns the stamped clipboard for broadcasting. The snapshot itself
+        drops the fields that measure a live update ("detected" and "trace"),
+        so a client catching up from it later isn't counted as a slow delivery.
+        """
+        if not clipboard:
+            return self.current
+        self.version += 1
+        header, data = clipboard
+        header = dict(header, seq=self.version)
+        self.current = ({k: v for k, v in header.items() if k not in LIVE_FIELDS}, data)
+        return header, data
+
+    def idle_for(self):
+        if self.connections:
+            return 0
+        return time.monotonic() - self.last_active
+
+    def add(self, conn):
+        self.connections.add(conn)
+        self.last_active = time.monotonic()
+
+    def discard(self, conn):
+        self.connections.discard(conn)
+        self.last_active = time.monotonic()
+
+    def save(self, header, data):
+        if self.history:
+            self.history.append(header, data)
+        else:
+            save_clipboard_update(header, data)
+
+    def broadcast(self, clipboard, source=None):
+        for conn in self.connections:
+            if conn is not source:
+                conn.enqueue(clipboard)
+
+    def local_change(self, clipboard):
+        """Publish a change read from the local clipboard."""
+        self.save(*clipboard)
+        self.broadcast(self.set_current(clipboard))
+
+    async def relay(self, clipboard, source=None):
+        """Apply an update received from a peer or upload, then pass it to everyone else."""
+        header, data = clipboard
+        changed = not self.current or self.current[0].get("hash") != header.get("hash")
+        if self.manager:
+            applied = await self.manager.apply_update(clipboard)
+        else:
+            applied = changed
+        if applied:
+            self.save(header, data)
+            logging.info(
+                "Received clipboard update (%s, %s)",
+                header["type"],
+                clipboard_bytes(data),
+            )
+        if changed:
+            clipboard = self.set_current(clipboard)
+        self.last_active = time.monotonic()
+        self.broadcast(clipboard, source=source)
+
+    async def get_current(self):
+        """The snapshot, read from the local clipboard only if there isn't one yet.
+
+        Concurrent callers share a single backend read.
+        """
+        if self.current or not self.manager:
+            return self.current
+        if not self._loading:
+            self._loading = asyncio.ensure_future(self.manager.get_current())
+        loading = self._loading
+        try:
+            clipboard = await asyncio.shield(loading)
+        finally:
+            if self._loading is loading and loading.done():
+                self._loading = None
+        if not self.current:
+            self.set_current(clipboard)
+        return self.current
+
+    def release(self):
+        """Close the history's files until it is next used; blocking."""
+        if self.history:
+            self.history.release()
+
+    def close(self):
+        if self.history:
+            self.history.close()
@@ -0,0 +1,116 @@
+import sqlite3
+import threading
+
+# Plain-text payloads are indexed up to this many bytes
+MAX_TEXT = 1024 * 1024
+PREVIEW_CHARS = 200
+MAX_LIMIT = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    time REAL NOT NULL,
+    type TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    preview TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_time ON entries (time);
+CREATE INDEX IF NOT EXISTS entries_type ON entries (type, id);
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5 (text);
+"""
+
+
+def entry_text(header, data):
+    """Searchable text for an update: the header's text plus plain-text payloads."""
+    parts = []
+    if header.get("text"):
+        parts.append(header["text"])
+    if header.get("type") == "text/plain" and data is not None:
+        parts.append(str(memoryview(data)[:MAX_TEXT], "utf-8", "replace"))
+    return "\n".join(parts)
+
+
+def _match_expression(query):
+    # Each word becomes a quoted FTS5 phrase, so user input can't inject query syntax
+    return " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
+
+
+class HistorySearch:
+    """SQLite index over clipboard history with full-text search on its text.
+
+    close() only drops the connection (and its page cache); the next call
+    reconnects, so an index that sits unused holds no descriptors.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        with self._lock:
+            self._db.executescript(SCHEMA)
+
+    @property
+    def _db(self):
+        # Callers hold self._lock
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def last_id(self):
+        with self._lock:
+            return self._db.execute("SELECT MAX(id) FROM entries").fetchone()[0] or 0
+
+    def add(self, items):
+        """Index (record, text) pairs, where record is a history index record."""
+        with self._lock, self._db:
+            for record, text in items:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO entries (id, time, type, size, hash, preview) VALUES (?, ?, ?, ?, ?, ?)",
+                    (record["id"], record["time"], record["type"], record["size"], record["hash"],
+                     text[:PREVIEW_CHARS] or None),
+                )
+                if text:
+                    self._db.execute("INSERT OR REPLACE INTO entries_fts (rowid, text) VALUES (?, ?)",
+                                     (record["id"], text))
+
+    def remove_before(self, entry_id):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM entries WHERE id < ?", (entry_id,))
+            self._db.execute("DELETE FROM entries_fts WHERE rowid < ?", (entry_id,))
+
+    def query(self, text=None, mime=None, since=None, until=None, min_size=None, max_size=None,
+              before=None, limit=50):
+        """Newest-first page of matching entries, plus the cursor for the next page."""
+        limit = max(1, min(limit, MAX_LIMIT))
+        clauses, params = [], []
+        if text and text.strip():
+            clauses.append("id IN (SELECT rowid FROM entries_fts WHERE entries_fts MATCH ?)")
+            params.append(_match_expression(text))
+        for clause, value in (
+            ("type = ?", mime),
+            ("time >= ?", since),
+            ("time < ?", until),
+            ("size >= ?", min_size),
+            ("size <= ?", max_size),
+            ("id < ?", before),
+        ):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        sql = f"SELECT id, time, type, size, hash, preview FROM entries{where} ORDER BY id DESC LIMIT ?"
+        with self._lock:
+            rows = self._db.execute(sql, params + [limit + 1]).fetchall()
+        entries = [
+            dict(zip(("id", "time", "type", "size", "hash", "preview"), row)) for row in rows[:limit]
+        ]
+        next_cursor = entries[-1]["id"] if len(rows) > limit else None
+        return entries, next_cursor
@@ -1,30 +1,217 @@
 import asyncio
+import hashlib
 import logging
-import ssl
+import os
+import random
 import time
+from urllib.parse import quote, unquote
 from aiohttp import web, ClientSession
 
+from .assets import load_assets
+from .blobs import BlobCache, BlobNamespace, DEFAULT_CACHE_SIZE
 from .clipboard import ClipboardManager
+from .history import HistoryLog, HistoryWriter
+from .metrics import BACKLOG, CLIENTS, CONNECT, REGISTRY, ROOMS
+from .payload import Spool
+from .rooms import MAX_ROOMS, MIN_ROOM_KEY, ROOM_IDLE_TIMEOUT, ROOM_SWEEP_INTERVAL, Room, room_id
 from .sync import ClipboardConnection
-from .app import clipboard_bytes, save_clipboard_update, generate_key, get_ip_addresses
+from .tls import ResumingContext, server_context
+from .app import clipboard_bytes, save_clipboard_update, generate_key, get_ip_addresses, get_history
 
 PING_INTERVAL = 5
+# Client reconnect delay doubles from RECONNECT_BASE up to RECONNECT_MAX seconds, with jitter
+RECONNECT_BASE = 0.5
+RECONNECT_MAX = 30
+# Bytes written per await when streaming payloads over HTTP
+STREAM_CHUNK = 256 * 1024
+HISTORY_QUERY_PARAMS = {
+    "since": float,
+    "until": float,
+    "min_size": int,
+    "max_size": int,
+    "before": int,
+    "limit": int,
+}
 clipboard_manager = ClipboardManager()
 
 
+def reconnect_delay(attempt):
+    """Seconds to wait before reconnect attempt number attempt (from 0).
+
+    Randomised over the upper half of the exponential step, so clients dropped
+    together by a server restart don't all come back at the same moment.
+    """
+    delay = min(RECONNECT_MAX, RECONNECT_BASE * 2 ** attempt)
+    return random.uniform(delay / 2, delay)
+
+
+async def stream_payload(request, header, data, cache_control):
+    """Send a payload with its hash as ETag, honouring If-None-Match and single Range requests."""
+    etag = f'"{header["hash"]}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+        "X-Clipboard-Type": header["type"],
+    }
+    if header.get("text"):
+        headers["X-Clipboard-Text"] = quote(header["text"][:1024])
+    if header["type"] == "application/x-file":
+        headers["Content-Type"] = "application/octet-stream"
+        headers["Content-Disposition"] = f"attachment; filename*=UTF-8''{quote(header.get('text') or 'file')}"
+    else:
+        headers["Content-Type"] = header["type"]
+
+    if etag in request.headers.get("If-None-Match", ""):
+        return web.Response(status=304, headers=headers)
+
+    view = memoryview(data)
+    start, stop = 0, len(view)
+    status = 200
+    if "Range" in request.headers and request.headers.get("If-Range", etag) == etag:
+        try:
+            requested = request.http_range
+        except ValueError:
+            requested = None
+        if requested is None or requested.step not in (None, 1):
+            return web.Response(status=416, headers={"Content-Range": f"bytes */{len(view)}"})
+        start, stop, _ = requested.indices(len(view))
+        if start >= stop:
+            return web.Response(status=416, headers={"Content-Range": f"bytes */{len(view)}"})
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{len(view)}"
+
+    resp = web.StreamResponse(status=status, headers=headers)
+    resp.content_length = stop - start
+    await resp.prepare(request)
+    if request.method != "HEAD":
+        for offset in range(start, stop, STREAM_CHUNK):
+            await resp.write(view[offset:min(offset + STREAM_CHUNK, stop)])
+    await resp.write_eof()
+    return resp
+
+
+def request_key(request):
+    """Access key from the key query parameter or a Bearer authorization header."""
+    auth = request.headers.get("Authorization", "")
+    if auth.startswith("Bearer "):
+        return auth[7:]
+    return request.query.get("key")
+
+
 class ClipboardServer:
-    def __init__(self, port=4444, key=None):
+    def __init__(self, port=4444, key=None, cache_size=DEFAULT_CACHE_SIZE, manager=None, rooms=False,
+                 headless=False, max_rooms=MAX_ROOMS):
         self.port = port
+        self.max_rooms = max_rooms
         self.key = key or generate_key()
-        self._connections = set()
+        # Headless servers only relay: the clipboard state lives in memory and no backend is touched
+        self.manager = None if headless or rooms else manager or clipboard_manager
+        self._blobs = BlobCache(cache_size)
+        # Room mode: every key opens its own headless room, created on first use
+        self._rooms = {} if rooms else None
+        self._room = None if rooms else Room("default", self._blobs, manager=self.manager)
+        # One writer thread serves every room's history
+        self._history_writer = HistoryWriter() if rooms else None
+        self._watcher = None
+        self._sweeper = None
+        self._runner = None
+        self._assets = load_assets()
+        CLIENTS.set_function(lambda: self.clients)
+        BACKLOG.set_function(lambda: {(conn.peer,): conn.backlog for conn in self._connections()})
+        ROOMS.set_function(lambda: len(self._rooms) if self._rooms is not None else 1)
+
+    def _all_rooms(self):
+        return list(self._rooms.values()) if self._rooms is not None else [self._room]
+
+    def _connections(self):
+        return [conn for room in self._all_rooms() for conn in room.connections]
 
-    async def _broadcast(self, clipboard):
-        for conn in set(self._connections):
-            try:
-                await conn.send(clipboard)
-            except Exception:
-                logging.exception("Error sending to client")
-                self._connections.discard(conn)
+    @property
+    def clients(self):
+        """Number of connected websocket clients."""
+        return sum(len(room.connections) for room in self._all_rooms())
+
+    def _authorized(self, request):
+        return request_key(request) == self.key
+
+    async def _get_room(self, request, create=False):
+        """The room a request's key belongs to, or None if the key opens nothing.
+
+        Raises HTTPServiceUnavailable if max_rooms are open and none is idle.
+        """
+        key = request_key(request)
+        if self._rooms is None:
+            return self._room if key == self.key else None
+        if not key or len(key) < MIN_ROOM_KEY:
+            return None
+        room = self._rooms.get(key)
+        if room:
+            return room
+        loop = asyncio.get_running_loop()
+        # Opening a history reads its index from disk
+        room = await loop.run_in_executor(None, self._open_room, key, create)
+        if not room:
+            return None
+        if key in self._rooms:
+            # Another request opened the room while this one was loading
+            await loop.run_in_executor(None, room.close)
+            return self._rooms[key]
+        evicted = None
+        if len(self._rooms) >= self.max_rooms:
+            evicted = self._idlest_room()
+            if not evicted:
+                await loop.run_in_executor(None, room.close)
+                raise web.HTTPServiceUnavailable(text="Too many rooms")
+            del self._rooms[evicted[0]]
+        self._rooms[key] = room
+        logging.info("Opened room %s", room.id)
+        if evicted:
+            await loop.run_in_executor(None, evicted[1].close)
+            logging.info("Closed room %s to make space", evicted[1].id)
+        return room
+
+    def _idlest_room(self):
+        """(key, room) of the room without connections that was used longest ago, if any."""
+        idle = [(key, room) for key, room in self._rooms.items() if not room.connections]
+        return min(idle, key=lambda item: item[1].last_active, default=None)
+
+    def _open_room(self, key, create):
+        history = self._open_room_history(room_id(key), create)
+        if not create and not history:
+            return None
+        room = Room(room_id(key), BlobNamespace(self._blobs, room_id(key)), history=history)
+        # The history reopens its files when it is first written or searched
+        room.release()
+        return room
+
+    def _open_room_history(self, name, create):
+        history = get_history()
+        if not history:
+            return None
+        path = os.path.join(history.path, "rooms", name)
+        if not create and not os.path.isdir(path):
+            return None
+        return HistoryLog(path, max_age=history.max_age, max_bytes=history.max_bytes, writer=self._history_writer)
+
+    def _room_history(self, room):
+        # In room mode only the room's own history may be read
+        return room.history if self._rooms is not None else get_history()
+
+    async def _sweep_rooms(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(ROOM_SWEEP_INTERVAL)
+            for key, room in list(self._rooms.items()):
+                if room.connections or self._rooms.get(key) is not room:
+                    continue
+                if room.idle_for() > ROOM_IDLE_TIMEOUT:
+                    del self._rooms[key]
+                    await loop.run_in_executor(None, room.close)
+                    logging.info("Closed idle room %s", room.id)
+                else:
+                    # Rooms only written to over HTTP never lose a client, so release them here
+                    await loop.run_in_executor(None, room.release)
 
     async def _watch_clipboard(self):
         async def on_change(clipboard):
@@ -34,85 +221,243 @@ class ClipboardServer:
                 header["type"],
                 clipboard_bytes(data),
             )
-            save_clipboard_update(header, data)
-            await self._broadcast(clipboard)
+            self._room.local_change(clipboard)
 
-        await clipboard_manager.watch(on_change)
+        await self.manager.watch(on_change)
 
     async def _ws_handler(self, request):
-        if request.query.get("key") != self.key:
+        room = await self._get_room(request, create=True)
+        if not room:
             return web.Response(status=403, text="Invalid key")
 
         ws = web.WebSocketResponse(heartbeat=PING_INTERVAL, receive_timeout=PING_INTERVAL * 2)
         await ws.prepare(request)
-        conn = ClipboardConnection(ws)
-        self._connections.add(conn)
+        peername = request.transport.get_extra_info("peername") if request.transport else None
+        peer = f"{peername[0]}:{peername[1]}" if peername else request.remote
+        conn = ClipboardConnection(ws, room.blobs, peer=peer)
+        await conn.start()
+        room.add(conn)
         client_ip = request.remote
         logging.info("New client connected from %s", client_ip)
 
-        current = await clipboard_manager.get_current()
-        if current:
-            await conn.send(current)
+        current = await room.get_current()
+        resume = conn.resume or {}
+        if not current or resume.get("hash") == current[0].get("hash"):
+            # The hash decides; seq only tells us how far behind the client thought it was.
+            # Confirmed, so the client knows it is in sync without waiting for an update
+            await conn.confirm_current(room.version)
+            logging.info("Client is up to date at version %d (had %s)", room.version, resume.get("seq"))
+        else:
+            partial = resume.get("partial")
+            if isinstance(partial, dict) and partial.get("hash") == current[0].get("hash"):
+                conn.resume_from(partial)
+            conn.enqueue(current)
             header, data = current
             logging.info(
-                "Sent current clipboard to new client (%s, %s)",
+                "Sending current clipboard to new client (%s, %s, version %d, client had %s)",
                 header["type"],
                 clipboard_bytes(data),
+                room.version,
+                resume.get("seq"),
             )
 
         try:
             async for clipboard in conn:
-                if await clipboard_manager.apply_update(clipboard):
-                    save_clipboard_update(*clipboard)
-                    header, data = clipboard
-                    logging.info(
-                        "Received clipboard update (%s, %s)",
-                        header["type"],
-                        clipboard_bytes(data),
-                    )
-                for other in set(self._connections):
-                    if other is not conn:
-                        try:
-                            await other.send(clipboard)
-                        except Exception:
-                            logging.exception("Error sending to client")
-                            self._connections.discard(other)
+                await room.relay(clipboard, source=conn)
         finally:
-            self._connections.discard(conn)
+            room.discard(conn)
+            await conn.close()
             logging.info("Client %s disconnected", client_ip)
+            if self._rooms is not None and not room.connections:
+                # Rooms without clients don't keep their history's files open
+                await asyncio.get_running_loop().run_in_executor(None, room.release)
 
         return ws
 
-    async def start(self):
+    async def _history_handler(self, request):
+        room = await self._get_room(request)
+        if not room:
+            return web.Response(status=403, text="Invalid key")
+        history = self._room_history(room)
+        if not history or not history.search:
+            return web.Response(status=404, text="History search is not enabled (see --save)")
+
+        try:
+            filters = {
+                name: convert(request.query[name])
+                for name, convert in HISTORY_QUERY_PARAMS.items()
+                if name in request.query
+            }
+        except ValueError as e:
+            return web.Response(status=400, text=f"Invalid query parameter: {e}")
+        filters["text"] = request.query.get("q")
+        filters["mime"] = request.query.get("type")
+
+        loop = asyncio.get_running_loop()
+        entries, next_cursor = await loop.run_in_executor(None, lambda: history.search.query(**filters))
+        return web.json_response({"entries": entries, "next": next_cursor})
+
+    async def _get_clipboard_handler(self, request):
+        room = await self._get_room(request)
+        if not room:
+            return web.Response(status=403, text="Invalid key")
+        current = await room.get_current()
+        if not current:
+            return web.Response(status=404, text="Clipboard is empty")
+        return await stream_payload(request, *current, cache_control="no-cache")
+
+    async def _get_blob_handler(self, request):
+        room = await self._get_room(request)
+        if not room:
+            return web.Response(status=403, text="Invalid key")
+        digest = request.match_info["hash"]
+        header = {"type": "application/octet-stream", "hash": digest}
+        data = None
+        if room.current and room.current[0]["hash"] == digest:
+            header, data = room.current
+        else:
+            data = room.blobs.get(digest)
+            history = self._room_history(room)
+            if history:
+                loop = asyncio.get_running_loop()
+                record, stored = await loop.run_in_executor(None, self._read_history, history, digest, data is None)
+                if record:
+                    header = record
+                    data = stored if data is None else data
+        if data is None:
+            return web.Response(status=404, text="Unknown hash")
+        # Content-addressed, so a given URL never changes
+        return await stream_payload(request, header, data, cache_control="private, max-age=31536000, immutable")
+
+    @staticmethod
+    def _read_history(history, digest, load):
+        """The history's record for digest and, if load, its payload; blocking."""
+        record = history.lookup(digest)
+        return record, history.get(digest) if record and load else None
+
+    async def _put_clipboard_handler(self, request):
+        room = await self._get_room(request, create=True)
+        if not room:
+            return web.Response(status=403, text="Invalid key")
+        spool = Spool(request.content_length or 0)
+        hasher = hashlib.sha256()
+        async for chunk in request.content.iter_chunked(STREAM_CHUNK):
+            hasher.update(chunk)
+            spool.write(chunk)
+        data = spool.finish()
+        header = {"type": request.content_type, "size": len(data), "hash": hasher.hexdigest()}
+        if "X-Clipboard-Text" in request.headers:
+            header["text"] = unquote(request.headers["X-Clipboard-Text"])
+        expected = request.headers.get("X-Clipboard-Hash")
+        if expected and expected != header["hash"]:
+            return web.Response(status=400, text="Payload does not match X-Clipboard-Hash")
+
+        await room.relay((header, data))
+        return web.json_response(header, status=201, headers={"ETag": f'"{header["hash"]}"'})
+
+    async def _index_handler(self, request):
+        # Always revalidated so upgrades are picked up; an unchanged page costs a 304
+        return self._assets["index.html"].response(request, "no-cache")
+
+    async def _static_handler(self, request):
+        asset = self._assets.get(request.match_info["name"])
+        if not asset:
+            return web.Response(status=404, text="Not found")
+        # A URL carrying the content version never changes; anything else is revalidated
+        if request.query.get("v") == asset.version:
+            return asset.response(request, "public, max-age=31536000, immutable")
+        return asset.response(request, "no-cache")
+
+    async def _metrics_handler(self, request):
+        if not self._authorized(request):
+            return web.Response(status=403, text="Invalid key")
+        return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8",
+                            headers={"Cache-Control": "no-cache"})
+
+    def create_app(self):
         app = web.Application()
+        app.router.add_get("/", self._index_handler)
+        app.router.add_get("/static/{name}", self._static_handler)
         app.router.add_get("/ws/", self._ws_handler)
+        app.router.add_get("/history", self._history_handler)
+        app.router.add_get("/metrics", self._metrics_handler)
+        app.router.add_get("/clipboard", self._get_clipboard_handler)
+        app.router.add_put("/clipboard", self._put_clipboard_handler)
+        # Only full SHA-256 hashes: the blob cache also holds derived keys such as "<hash>.<codec>"
+        app.router.add_get("/clipboard/{hash:[0-9a-f]{64}}", self._get_blob_handler)
+        return app
 
-        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-        ssl_context.load_cert_chain("cert.pem", "key.pem")
-
-        runner = web.AppRunner(app)
-        await runner.setup()
-        site = web.TCPSite(runner, "", self.port, ssl_context=ssl_context)
+    async def listen(self, host="", ssl_context=None):
+        """Serve the app and watch the local clipboard until close()."""
+        self._runner = web.AppRunner(self.create_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, self.port, ssl_context=ssl_context)
         await site.start()
+        if not self.port:
+            self.port = self._runner.addresses[0][1]
+        if self.manager:
+            self._watcher = asyncio.create_task(self._watch_clipboard())
+        if self._rooms is not None:
+            self._sweeper = asyncio.create_task(self._sweep_rooms())
+
+    async def close(self):
+        tasks = [task for task in (self._watcher, self._sweeper) if task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._runner:
+            await self._runner.cleanup()
+        if self._rooms is not None:
+            rooms = list(self._rooms.values())
+            self._rooms.clear()
+            loop = asyncio.get_running_loop()
+            for room in rooms:
+                await loop.run_in_executor(None, room.close)
+            await loop.run_in_executor(None, self._history_writer.close)
 
-        asyncio.create_task(self._watch_clipboard())
+    async def start(self):
+        await self.listen(ssl_context=server_context("cert.pem", "key.pem"))
 
         print("\n=== Clipboard Sync Server ===")
-        print("\nConnection URL(s):")
-        for ip in get_ip_addresses():
-            print(f"https://{ip}:{self.port}/?key={self.key}")
+        if self._rooms is not None:
+            print(f"\nRoom mode: any key of {MIN_ROOM_KEY} or more characters opens its own room.")
+            print(f"Metrics key: {self.key}")
+            print("\nConnection URL(s):")
+            for ip in get_ip_addresses():
+                print(f"https://{ip}:{self.port}/?key=<room key>")
+        else:
+            if not self.manager:
+                print("\nHeadless relay: the local clipboard is not used.")
+            print("\nConnection URL(s):")
+            for ip in get_ip_addresses():
+                print(f"https://{ip}:{self.port}/?key={self.key}")
         logging.info("Server started and waiting for connections...")
         while True:
             await asyncio.sleep(3600)
 
 
 class ClipboardClient:
-    def __init__(self, url: str):
+    def __init__(self, url: str, metrics_interval=None, manager=None):
         if url.startswith("https://"):
             url = "wss://" + url[8:]
             if "/?key=" in url:
                 url = url.replace("/?key=", "/ws/?key=")
         self.url = url
+        self.metrics_interval = metrics_interval
+        self.manager = manager or clipboard_manager
+        # Survives reconnects so the server can skip payloads we already hold
+        self._blobs = BlobCache()
+        # The last update we hold ({"seq", "hash"}) and any payload a dropped connection cut off,
+        # so a reconnect only transfers what we missed
+        self._last = {}
+        self._partial = None
+        # When the current connection attempt began and its TLS handshake, until the first sync
+        self._syncing = None
+
+    def _seen(self, header):
+        self._last = {"hash": header.get("hash")}
+        if "seq" in header:
+            self._last["seq"] = header["seq"]
 
     async def _watch_clipboard(self, conn):
         async def send_change(clipboard):
@@ -123,13 +468,30 @@ class ClipboardClient:
                 clipboard_bytes(data),
             )
             save_clipboard_update(header, data)
-            await conn.send(clipboard)
+            self._seen(header)
+            conn.enqueue(clipboard)
+
+        await self.manager.watch(send_change)
+
+    def _synced(self):
+        """Record the time from the connection attempt to the first sync, once per connection."""
+        if self._syncing is None:
+            return
+        (connecting, handshake), self._syncing = self._syncing, None
+        elapsed = time.perf_counter() - connecting
+        CONNECT.observe(elapsed, tls=handshake)
+        logging.info("In sync %.3fs after connecting (TLS: %s)", elapsed, handshake)
 
-        await clipboard_manager.watch(send_change)
+    async def _await_current(self, conn):
+        await conn.current.wait()
+        self._synced()
 
     async def _listener(self, conn):
         async for clipboard in conn:
-            if await clipboard_manager.apply_update(clipboard):
+            self._seen(clipboard[0])
+            applied = await self.manager.apply_update(clipboard)
+            self._synced()
+            if applied:
                 save_clipboard_update(*clipboard)
                 header, data = clipboard
                 logging.info(
@@ -138,32 +500,62 @@ class ClipboardClient:
                     clipboard_bytes(data),
                 )
 
+    async def _dump_metrics(self):
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            logging.info("Metrics:\n%s", REGISTRY.render().rstrip())
+
     async def start(self):
         logging.info("Connecting to %s...", self.url)
-        ssl_context = ssl.create_default_context()
-        ssl_context.check_hostname = False
-        ssl_context.verify_mode = ssl.CERT_NONE
+        if self.metrics_interval:
+            asyncio.create_task(self._dump_metrics())
+        # Kept across reconnects: the TLS context resumes the previous session and
+        # the session's connector keeps its DNS cache
+        ssl_context = ResumingContext()
+        tls = "full" if self.url.startswith("wss://") else "none"
 
-        while True:
-            try:
-                async with ClientSession() as session:
+        attempt = 0
+        async with ClientSession() as session:
+            while True:
+                connecting = time.perf_counter()
+                try:
                     async with session.ws_connect(
                         self.url,
                         heartbeat=PING_INTERVAL,
                         receive_timeout=PING_INTERVAL * 2,
                         ssl=ssl_context,
                     ) as ws:
-                        logging.info("Connected successfully. Watching clipboard...")
-                        conn = ClipboardConnection(ws)
+                        conn = ClipboardConnection(ws, self._blobs, partial=self._partial)
+                        self._partial = None
+                        await conn.start(resume=self._last)
+                        ssl_context.save_session()
+                        handshake = "resumed" if tls == "full" and ssl_context.session_reused else tls
+                        self._syncing = (connecting, handshake)
+                        logging.info("Connected (TLS: %s). Watching clipboard...", handshake)
+                        attempt = 0
                         watcher = asyncio.create_task(self._watch_clipboard(conn))
                         listener = asyncio.create_task(self._listener(conn))
+                        confirmed = asyncio.create_task(self._await_current(conn))
                         try:
-                            await asyncio.gather(watcher, listener)
+                            done, _ = await asyncio.wait(
+                                {watcher, listener}, return_when=asyncio.FIRST_COMPLETED
+                            )
+                            for task in done:
+                                task.result()
+                            logging.info("Disconnected from server")
                         finally:
-                            watcher.cancel()
-                            listener.cancel()
-                            await asyncio.gather(watcher, listener, return_exceptions=True)
-            except Exception as e:
-                logging.info("Connection failed, retrying in 5s: %s", e)
-                await asyncio.sleep(5)
+                            for task in (watcher, listener, confirmed):
+                                task.cancel()
+                            await asyncio.gather(watcher, listener, confirmed, return_exceptions=True)
+                            self._syncing = None
+                            await conn.close(keep_partial=True)
+                            self._partial = conn.partial
+                            ssl_context.save_session()
+                except Exception as e:
+                    delay = reconnect_delay(attempt)
+                    attempt += 1
+                    logging.info("Connection failed, retrying in %.1fs: %s", delay, e)
+                    await asyncio.sleep(delay)
+                    continue
+                await asyncio.sleep(reconnect_delay(0))
 
@@ -1,32 +1,620 @@
+import asyncio
+import collections
 import json
 import hashlib
 import logging
+import struct
+import time
+import uuid
 from aiohttp import web
 
+from . import compression, delta, tracing
+from .blobs import BlobCache
+from .metrics import BYTES_RECEIVED, BYTES_SENT
+from .payload import Spool
+
+# Payloads larger than one chunk are streamed as begin, N chunks, commit
+CHUNK_SIZE = 1024 * 1024
+# Unacknowledged chunks a sender may have in flight
+CHUNK_WINDOW = 8
+HELLO_TIMEOUT = 2
+# Clipboard states queued behind the one being sent; older ones are dropped
+OUTBOX_SIZE = 1
+# Payloads at least this large are offered by hash before their bytes are sent
+OFFER_SIZE = 64 * 1024
+# Seconds to wait for the peer to answer an offer before sending the payload anyway
+OFFER_TIMEOUT = 5
+# Text payloads at least this large are sent as a delta against the previous one
+DELTA_SIZE = 16 * 1024
+# Most bytes a single-message update may decompress to, whatever its header claims
+MAX_DECODED_SIZE = 1024 * 1024 * 1024
+
+FEATURES = {"chunked", "blobs", "delta", "frames"} | set(compression.CODECS)
+
+# With the frames feature every binary message is version, kind, header length,
+# compact JSON header, then payload bytes, so a header can't be paired with the wrong payload
+FRAME = struct.Struct(">BBI")
+FRAME_VERSION = 1
+FRAME_UPDATE = 1
+FRAME_CHUNK = 2
+
+
+def pack_frame(kind, header, payload=b""):
+    encoded = json.dumps(header, separators=(",", ":")).encode()
+    return b"".join((FRAME.pack(FRAME_VERSION, kind, len(encoded)), encoded, payload))
+
+
+def unpack_frame(data):
+    """Split a binary frame into (kind, header, payload view); ValueError if malformed."""
+    view = memoryview(data)
+    if len(view) < FRAME.size:
+        raise ValueError("Truncated frame")
+    version, kind, length = FRAME.unpack_from(view)
+    if version != FRAME_VERSION:
+        raise ValueError(f"Unsupported frame version {version}")
+    end = FRAME.size + length
+    if end > len(view):
+        raise ValueError("Truncated frame header")
+    return kind, json.loads(bytes(view[FRAME.size:end])), view[end:]
+
+
+def _encoded_key(header, encoding):
+    if header.get("delta"):
+        return f"{header['hash']}.{header['delta']}.{encoding}"
+    return f"{header['hash']}.{encoding}"
+
+
+def _decoded_limit(header):
+    """Most bytes a payload may decode to: its declared size, within MAX_DECODED_SIZE."""
+    size = header.get("size")
+    return min(size, MAX_DECODED_SIZE) if isinstance(size, int) and size >= 0 else MAX_DECODED_SIZE
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _rebuild(base, patch, digest):
+    """Apply a delta and check the result against digest, returning None if it doesn't match."""
+    try:
+        data = delta.apply(base, patch)
+    except ValueError:
+        logging.exception("Corrupt delta for %s", digest)
+        return None
+    return data if _sha256(data) == digest else None
+
+
+def _continues(partial, header, chunks):
+    """True if a peer's partial copy is a prefix of this wire payload."""
+    return (
+        partial.get("hash") == header.get("hash")
+        and partial.get("encoding") == header.get("encoding")
+        and partial.get("delta") == header.get("delta")
+        and partial.get("chunks") == chunks
+    )
+
+
+class _Transfer:
+    """Incoming chunked payload, spooled and hashed as it arrives."""
+
+    def __init__(self, message):
+        self.id = message["id"]
+        self.header = message["header"]
+        self.chunks = message["chunks"]
+        self.delta = self.header.get("delta")
+        self.received = 0
+        self.hasher = hashlib.sha256()
+        self.spool = Spool(self.header.get("size", 0))
+        self.limit = _decoded_limit(self.header)
+        self.encoding = self.header.pop("encoding", None)
+        self.decoder = None
+        self.encoded = None
+        if self.encoding:
+            self.decoder = compression.Decoder(self.encoding, self.limit)
+            # Kept so the encoded bytes can be relayed without recompressing
+            self.encoded = Spool(self.chunks * CHUNK_SIZE)
+
+    def write(self, data):
+        """Add one chunk; blocking, and ValueError once the payload outgrows its limit."""
+        if self.decoder:
+            self.encoded.write(data)
+            data = self.decoder.decompress(data)
+        elif self.spool.size + len(data) > self.limit:
+            raise ValueError(f"Payload is larger than {self.limit} bytes")
+        self.hasher.update(data)
+        self.spool.write(data)
+        self.received += 1
+
+    def finish(self):
+        if self.decoder:
+            tail = self.decoder.flush()
+            self.hasher.update(tail)
+            self.spool.write(tail)
+            return self.spool.finish(), self.encoded.finish()
+        return self.spool.finish(), None
+
+    def discard(self):
+        self.spool.close()
+        if self.encoded:
+            self.encoded.close()
+
+    @property
+    def offset(self):
+        """Wire bytes received so far; chunks are whole, so this is where a resend resumes."""
+        return self.received * CHUNK_SIZE
+
+    def describe(self):
+        """What a reconnecting peer needs to continue this payload, sent in the resume hello."""
+        return {"hash": self.header.get("hash"), "encoding": self.encoding, "delta": self.delta,
+                "chunks": self.chunks, "offset": self.offset}
+
+    def resumes(self, message):
+        """True if a begin message continues this payload where it stopped."""
+        header = message["header"]
+        return _continues(self.describe(), header, message["chunks"]) and message.get("offset") == self.offset
+
 
 class ClipboardConnection:
     """Wrap websocket to send/receive clipboard payloads."""
 
-    def __init__(self, ws: web.WebSocketResponse):
+    def __init__(self, ws: web.WebSocketResponse, blobs=None, peer=None, partial=None):
         self.ws = ws
+        self.peer = peer
+        self.blobs = BlobCache() if blobs is None else blobs
+        # A chunked payload cut off by a previous connection, continued if the peer resends it
+        self.partial = partial
+        # What the peer said it already holds when it connected, if anything
+        self.resume = None
+        # Set when the peer confirms we already hold its current clipboard
+        self.current = asyncio.Event()
+        self.features = set()
+        self.codec = None
+        self.closed = False
         self._pending_header = None
+        self._transfer = None
+        self._inbox = asyncio.Queue()
+        self._hello = asyncio.Event()
+        self._send_lock = asyncio.Lock()
+        self._credit = asyncio.Condition()
+        self._acked = {}
+        self._aborted = set()
+        self._offers = {}
+        self._base = None
+        self._tasks = set()
+        self._outbox = collections.deque(maxlen=OUTBOX_SIZE)
+        self._outbox_ready = asyncio.Event()
+        self._sending = False
+        self._writer = None
+        self._reader = None
+        self._resume_send = None
+
+    async def start(self, timeout=HELLO_TIMEOUT, resume=None):
+        """Announce our features and wait briefly for the peer's.
 
-    async def send(self, clipboard):
+        resume tells the peer the last update we hold ({"seq", "hash"}); any
+        partial payload we kept is added to it.
+        """
+        hello = {"op": "hello", "features": sorted(FEATURES)}
+        if resume or self.partial:
+            hello["resume"] = dict(resume or {})
+            if self.partial:
+                hello["resume"]["partial"] = self.partial.describe()
+        await self.ws.send_json(hello)
+        self._start_reader()
+        try:
+            await asyncio.wait_for(self._hello.wait(), timeout)
+        except asyncio.TimeoutError:
+            logging.info("Peer did not announce features, using the basic protocol")
+
+    async def close(self, keep_partial=False):
+        """Stop the connection's tasks; with keep_partial an interrupted payload stays in self.partial."""
+        tasks = set(self._tasks)
+        for task in (self._reader, self._writer):
+            if task:
+                tasks.add(task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.partial and not keep_partial:
+            self.partial.discard()
+            self.partial = None
+
+    async def confirm_current(self, seq=None):
+        """Tell the peer it already holds our current clipboard, so it knows it is in sync."""
+        await self.ws.send_json({"op": "current", "seq": seq})
+
+    def resume_from(self, partial):
+        """Continue the next chunked send from where the peer's partial copy (from its hello) stopped."""
+        self._resume_send = partial
+
+    def _start_reader(self):
+        if not self._reader:
+            self._reader = asyncio.create_task(self._read())
+
+    @property
+    def backlog(self):
+        """Clipboard states waiting for, or in, the writer."""
+        return len(self._outbox) + self._sending
+
+    def enqueue(self, clipboard):
+        """Queue a clipboard for the writer task without waiting on the network.
+
+        If the peer is slow, only the newest pending state is kept.
+        """
+        if len(self._outbox) == self._outbox.maxlen:
+            logging.debug("Peer is behind, dropping stale clipboard %s", self._outbox[0][0][0].get("hash"))
+        self._outbox.append((clipboard, time.time()))
+        self._outbox_ready.set()
+        if not self._writer:
+            self._writer = asyncio.create_task(self._write())
+
+    async def _write(self):
+        while True:
+            await self._outbox_ready.wait()
+            self._outbox_ready.clear()
+            while self._outbox:
+                (header, data), queued = self._outbox.popleft()
+                # A copy: the same header may be on its way to other peers
+                clipboard = (tracing.add_span(dict(header), "queue", queued), data)
+                self._sending = True
+                try:
+                    await self.send(clipboard)
+                except Exception:
+                    logging.exception("Error sending to peer, closing connection")
+                    self._outbox.clear()
+                    await self.ws.close()
+                    return
+                finally:
+                    self._sending = False
+
+    async def send(self, clipboard, allow_delta=True):
         header, data = clipboard
-        await self.ws.send_json(header)
-        await self.ws.send_bytes(data)
+        self.blobs.put(header.get("hash"), data)
+        async with self._send_lock:
+            if "blobs" in self.features and len(data) >= OFFER_SIZE and await self._offer(header):
+                self._set_base(header, data)
+                return
+            wire_header, wire_data = header, data
+            if allow_delta:
+                wire_header, wire_data = await self._delta(wire_header, wire_data)
+            wire_header, wire_data = await self._encode(wire_header, wire_data)
+            partial, self._resume_send = self._resume_send, None
+            if "chunked" in self.features and len(wire_data) > CHUNK_SIZE:
+                offset = 0
+                chunks = -(-len(wire_data) // CHUNK_SIZE)
+                if partial and _continues(partial, wire_header, chunks):
+                    offset = partial.get("offset") or 0
+                await self._send_chunked(wire_header, wire_data, offset)
+            elif "frames" in self.features:
+                await self.ws.send_bytes(pack_frame(FRAME_UPDATE, wire_header, wire_data))
+                BYTES_SENT.inc(len(wire_data))
+            else:
+                await self.ws.send_json(wire_header)
+                await self.ws.send_bytes(wire_data)
+                BYTES_SENT.inc(len(wire_data))
+            self._set_base(header, data)
 
-    async def __aiter__(self):
-        async for msg in self.ws:
-            if msg.type == web.WSMsgType.TEXT:
-                self._pending_header = json.loads(msg.data)
-            elif msg.type == web.WSMsgType.BINARY and self._pending_header:
-                header = self._pending_header
-                self._pending_header = None
-                if not header.get("hash"):
-                    header["hash"] = hashlib.sha256(msg.data).hexdigest()
-                yield header, msg.data
+    def _set_base(self, header, data):
+        """Remember the last text payload both peers hold, for the next delta."""
+        if header.get("hash") and header.get("type", "").startswith("text/"):
+            self._base = (header["hash"], data)
+
+    async def _delta(self, header, data):
+        base = self._base
+        digest = header.get("hash")
+        if (
+            "delta" not in self.features
+            or not base
+            or not digest
+            or base[0] == digest
+            or len(data) < DELTA_SIZE
+            or not header.get("type", "").startswith("text/")
+        ):
+            return header, data
+        key = f"{digest}.{base[0]}"
+        patch = self.blobs.get(key)
+        if patch is None:
+            loop = asyncio.get_running_loop()
+            patch = await loop.run_in_executor(None, delta.encode, base[1], data)
+            self.blobs.put(key, patch)
+        if len(patch) >= len(data):
+            return header, data
+        return dict(header, delta=base[0]), patch
+
+    async def _encode(self, header, data):
+        """Compress with the negotiated codec, reusing bytes already encoded for another peer."""
+        if not self.codec or not header.get("hash"):
+            return header, data
+        key = _encoded_key(header, self.codec)
+        encoded = self.blobs.get(key)
+        if encoded is None:
+            loop = asyncio.get_running_loop()
+            encoded = await loop.run_in_executor(None, compression.encode, self.codec, header, data)
+            if encoded is None:
+                return header, data
+            self.blobs.put(key, encoded)
+        return dict(header, encoding=self.codec), encoded
+
+    async def _offer(self, header):
+        """Announce a payload by hash, returning True if the peer already has it.
+
+        A peer that doesn't answer within OFFER_TIMEOUT is treated as not
+        having it, since the send lock is held meanwhile.
+        """
+        offer_id = uuid.uuid4().hex
+        reply = asyncio.get_running_loop().create_future()
+        self._offers[offer_id] = reply
+        try:
+            await self.ws.send_json({"op": "offer", "id": offer_id, "header": header})
+            return await asyncio.wait_for(reply, OFFER_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.warning("Peer did not answer offer for %s, sending it in full", header.get("hash"))
+            return False
+        finally:
+            del self._offers[offer_id]
+
+    async def _send_chunked(self, header, data, offset=0):
+        view = memoryview(data)
+        transfer_id = uuid.uuid4().hex
+        chunks = -(-len(view) // CHUNK_SIZE)
+        first = min(offset // CHUNK_SIZE, chunks - 1)
+        self._acked[transfer_id] = first - 1
+        try:
+            begin = {"op": "begin", "id": transfer_id, "header": header, "chunks": chunks}
+            if first:
+                begin["offset"] = first * CHUNK_SIZE
+                logging.info("Resuming transfer of %s at byte %d", header.get("hash"), begin["offset"])
+            await self.ws.send_json(begin)
+            for seq in range(first, chunks):
+                await self._wait_credit(transfer_id, seq)
+                if transfer_id in self._aborted:
+                    logging.info("Peer aborted transfer %s", transfer_id)
+                    return
+                chunk = view[seq * CHUNK_SIZE:(seq + 1) * CHUNK_SIZE]
+                if "frames" in self.features:
+                    await self.ws.send_bytes(pack_frame(FRAME_CHUNK, {"id": transfer_id, "seq": seq}, chunk))
+                else:
+                    await self.ws.send_bytes(chunk)
+                BYTES_SENT.inc(len(chunk))
+            await self.ws.send_json({"op": "commit", "id": transfer_id})
+        finally:
+            del self._acked[transfer_id]
+            self._aborted.discard(transfer_id)
+
+    async def _wait_credit(self, transfer_id, seq):
+        async with self._credit:
+            await self._credit.wait_for(
+                lambda: self.closed
+                or transfer_id in self._aborted
+                or seq - self._acked[transfer_id] <= CHUNK_WINDOW
+            )
+        if self.closed:
+            raise ConnectionResetError("Connection closed during chunked transfer")
+
+    async def _read(self):
+        try:
+            async for msg in self.ws:
+                if msg.type == web.WSMsgType.TEXT:
+                    await self._on_text(json.loads(msg.data))
+                elif msg.type == web.WSMsgType.BINARY:
+                    await self._on_binary(msg.data)
+                else:
+                    logging.debug("Unhandled websocket message: %s", msg.type)
+        except Exception as e:
+            logging.debug("Websocket read ended: %s", e)
+        finally:
+            self.closed = True
+            async with self._credit:
+                self._credit.notify_all()
+            for reply in self._offers.values():
+                if not reply.done():
+                    reply.set_exception(ConnectionResetError("Connection closed during offer"))
+            if self._transfer:
+                # Kept so a reconnect can continue it instead of starting over
+                if self._transfer.received and not self.partial:
+                    self.partial = self._transfer
+                else:
+                    self._transfer.discard()
+                self._transfer = None
+            self._inbox.put_nowait(None)
+
+    async def _on_text(self, message):
+        op = message.get("op")
+        if op is None:
+            self._pending_header = message
+        elif op == "hello":
+            self.features = FEATURES & set(message.get("features", []))
+            if isinstance(message.get("resume"), dict):
+                self.resume = message["resume"]
+            self.codec = compression.choose_codec(self.features)
+            self._hello.set()
+        elif op == "current":
+            self.current.set()
+        elif op == "ack":
+            async with self._credit:
+                if message["id"] in self._acked:
+                    self._acked[message["id"]] = message["seq"]
+                    self._credit.notify_all()
+        elif op == "abort":
+            async with self._credit:
+                if message["id"] in self._acked:
+                    self._aborted.add(message["id"])
+                    self._credit.notify_all()
+        elif op == "offer":
+            header = message["header"]
+            data = self.blobs.get(header.get("hash"))
+            await self.ws.send_json({"op": "have" if data is not None else "need", "id": message["id"]})
+            if data is not None:
+                self._set_base(header, data)
+                self._received(header)
+                await self._inbox.put((header, data))
+        elif op == "resend":
+            header = message["header"]
+            data = self.blobs.get(header.get("hash"))
+            if data is None:
+                logging.warning("Peer asked to resend unknown payload %s", header.get("hash"))
+            else:
+                task = asyncio.create_task(self.send((header, data), allow_delta=False))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        elif op in ("have", "need"):
+            reply = self._offers.get(message["id"])
+            if reply and not reply.done():
+                reply.set_result(op == "have")
+        elif op == "begin":
+            if self._transfer:
+                logging.warning("Abandoning incomplete transfer %s", self._transfer.id)
+                self._transfer.discard()
+                self._transfer = None
+            partial, self.partial = self.partial, None
+            if partial and partial.resumes(message):
+                logging.info("Resuming transfer of %s at byte %d", partial.header.get("hash"), partial.offset)
+                partial.id = message["id"]
+                self._transfer = partial
+                return
+            if partial:
+                partial.discard()
+            if message.get("offset"):
+                # The sender skipped bytes we no longer have
+                logging.info("Cannot resume transfer %s, requesting full payload", message["id"])
+                await self.ws.send_json({"op": "abort", "id": message["id"]})
+                await self.ws.send_json({"op": "resend", "header": message["header"]})
+                return
+            self._transfer = _Transfer(message)
+        elif op == "commit":
+            await self._commit(message)
+        else:
+            logging.debug("Unhandled control message: %s", op)
+
+    async def _on_binary(self, data):
+        BYTES_RECEIVED.inc(len(data))
+        if "frames" in self.features:
+            try:
+                kind, header, payload = unpack_frame(data)
+            except ValueError as e:
+                logging.warning("Dropping malformed frame: %s", e)
+                return
+            if kind == FRAME_UPDATE:
+                await self._on_update(header, bytes(payload))
+            elif kind == FRAME_CHUNK:
+                transfer = self._transfer
+                if not transfer or header.get("id") != transfer.id or header.get("seq") != transfer.received:
+                    logging.warning("Dropping chunk %s of unexpected transfer %s", header.get("seq"), header.get("id"))
+                    return
+                await self._on_chunk(payload)
             else:
-                logging.debug("Unhandled websocket message: %s", msg.type)
+                logging.debug("Unhandled frame kind: %s", kind)
+        elif self._transfer:
+            await self._on_chunk(data)
+        elif self._pending_header:
+            header = self._pending_header
+            self._pending_header = None
+            await self._on_update(header, data)
+        else:
+            logging.debug("Dropping binary message without a header")
 
+    async def _on_chunk(self, data):
+        transfer = self._transfer
+        if transfer.received >= transfer.chunks:
+            logging.warning("Unexpected chunk for transfer %s", transfer.id)
+            return
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, transfer.write, data)
+        except ValueError as e:
+            logging.warning("Aborting transfer %s: %s", transfer.id, e)
+            self._drop_transfer(transfer)
+            await self.ws.send_json({"op": "abort", "id": transfer.id})
+            return
+        await self.ws.send_json({"op": "ack", "id": transfer.id, "seq": transfer.received - 1})
 
+    def _drop_transfer(self, transfer):
+        if self._transfer is transfer:
+            self._transfer = None
+        transfer.discard()
+
+    async def _on_update(self, header, data):
+        encoding = header.pop("encoding", None)
+        if encoding:
+            loop = asyncio.get_running_loop()
+            try:
+                decoded = await loop.run_in_executor(None, compression.decode, encoding, data,
+                                                     _decoded_limit(header))
+            except ValueError as e:
+                logging.warning("Dropping update %s: %s", header.get("hash"), e)
+                return
+            encoded, data = data, decoded
+        if not header.get("delta"):
+            # Checked before anything reaches the cache, as in _commit; a delta is checked once rebuilt
+            digest = await asyncio.get_running_loop().run_in_executor(None, _sha256, data)
+            if header.get("hash", digest) != digest:
+                logging.warning("Dropping corrupt update %s (hash mismatch)", header.get("hash"))
+                return
+            header["hash"] = digest
+        if encoding:
+            self.blobs.put(_encoded_key(header, encoding), encoded)
+        await self._deliver(header, data)
+
+    async def _commit(self, message):
+        transfer = self._transfer
+        if not transfer or transfer.id != message["id"]:
+            logging.warning("Commit for unknown transfer %s", message["id"])
+            return
+        self._transfer = None
+        header = transfer.header
+        if transfer.received != transfer.chunks:
+            logging.warning("Dropping incomplete transfer %s (%d/%d chunks)",
+                            transfer.id, transfer.received, transfer.chunks)
+            transfer.discard()
+            return
+        try:
+            data, encoded = transfer.finish()
+        except ValueError as e:
+            logging.warning("Dropping transfer %s: %s", transfer.id, e)
+            transfer.discard()
+            return
+        digest = transfer.hasher.hexdigest()
+        if not header.get("delta"):
+            if header.get("hash", digest) != digest:
+                logging.warning("Dropping corrupt transfer %s (hash mismatch)", transfer.id)
+                return
+            header["hash"] = digest
+        if encoded is not None:
+            self.blobs.put(_encoded_key(header, transfer.encoding), encoded)
+        await self._deliver(header, data)
+
+    async def _deliver(self, header, data):
+        base_digest = header.pop("delta", None)
+        if base_digest:
+            data = await self._apply_delta(header, base_digest, data)
+            if data is None:
+                return
+        self.blobs.put(header["hash"], data)
+        self._set_base(header, data)
+        self._received(header)
+        await self._inbox.put((header, data))
+
+    def _received(self, header):
+        """Cover the time since the sender's last span: network, reassembly and decoding."""
+        start = tracing.last_end(header)
+        if start is not None:
+            tracing.add_span(header, "transfer", start)
+
+    async def _apply_delta(self, header, base_digest, patch):
+        """Rebuild a delta payload, asking for a full resend if the base is missing or stale."""
+        base = self.blobs.get(base_digest)
+        data = None
+        if base is not None:
+            loop = asyncio.get_running_loop()
+            data = await loop.run_in_executor(None, _rebuild, base, patch, header["hash"])
+        if data is None:
+            logging.info("Cannot apply delta for %s, requesting full payload", header["hash"])
+            await self.ws.send_json({"op": "resend", "header": header})
+        return data
+
+    async def __aiter__(self):
+        self._start_reader()
+        while True:
+            clipboard = await self._inbox.get()
+            if clipboard is None:
+                return
+            yield clipboard
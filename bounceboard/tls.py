@@ -0,0 +1,55 @@
+import ssl
+
+# Session tickets the server issues per handshake; a spare covers a reconnect racing a retry
+SESSION_TICKETS = 2
+
+
+def server_context(certfile, keyfile):
+    """Server TLS context that hands out session tickets so clients can resume."""
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(certfile, keyfile)
+    context.num_tickets = SESSION_TICKETS
+    return context
+
+
+class ResumingContext(ssl.SSLContext):
+    """Client TLS context that offers the last connection's session on the next handshake.
+
+    asyncio wraps every connection with wrap_bio(), so that is where the saved
+    session is passed in and the new connection is remembered. A resumed
+    handshake skips the certificate exchange and key agreement, which is most
+    of the reconnect time on a high-latency link.
+    """
+
+    def __new__(cls):
+        return super().__new__(cls, ssl.PROTOCOL_TLS_CLIENT)
+
+    def __init__(self):
+        super().__init__()
+        # The server's certificate is self-signed
+        self.check_hostname = False
+        self.verify_mode = ssl.CERT_NONE
+        self._session = None
+        self._sslobj = None
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        sslobj = super().wrap_bio(
+            incoming, outgoing, server_side=server_side, server_hostname=server_hostname,
+            session=session or self._session,
+        )
+        self._sslobj = sslobj
+        return sslobj
+
+    def save_session(self):
+        """Keep the current connection's session for the next one.
+
+        TLS 1.3 tickets arrive after the handshake, so call this once data has
+        been received, not as soon as the connection opens.
+        """
+        session = self._sslobj.session if self._sslobj else None
+        if session is not None:
+            self._session = session
+
+    @property
+    def session_reused(self):
+        return bool(self._sslobj and self._sslobj.session_reused)
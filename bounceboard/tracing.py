@@ -0,0 +1,112 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+
+# Identifies this process in spans recorded by every machine an update passes through
+PROCESS = f"{socket.gethostname()}/{os.getpid()}"
+
+_local = threading.local()
+_lock = threading.Lock()
+_file = None
+_pids = {}
+
+
+def add_span(header, name, start, end=None):
+    """Append a span to the header's trace, starting a trace if it has none.
+
+    The header dict is updated in place but its trace is replaced rather than
+    modified, so copies of the header already handed to other peers are unaffected.
+    """
+    trace = header.get("trace")
+    if not isinstance(trace, dict) or "id" not in trace:
+        trace = {"id": uuid.uuid4().hex, "spans": []}
+    span = [name, PROCESS, start, time.time() if end is None else end]
+    header["trace"] = {"id": trace["id"], "spans": list(trace.get("spans", [])) + [span]}
+    return header
+
+
+def last_end(header):
+    """End time of the latest span in the header's trace, or None."""
+    try:
+        return float(header["trace"]["spans"][-1][3])
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+
+@contextmanager
+def timed(name):
+    """Record a span on the current thread while collect() is running there."""
+    spans = getattr(_local, "spans", None)
+    start = time.time()
+    try:
+        yield
+    finally:
+        if spans is not None:
+            spans.append((name, start, time.time()))
+
+
+def collect(function, *args):
+    """Call function, returning its result and the timed() spans recorded meanwhile."""
+    _local.spans = []
+    try:
+        return function(*args), _local.spans
+    finally:
+        _local.spans = None
+
+
+def open_trace(path):
+    """Write traces of applied updates to path as a Chrome trace (JSON array) file."""
+    global _file
+    _file = open(path, "w")
+    # The closing bracket is optional in this format, so events can be appended as they happen
+    _file.write("[\n")
+    _file.flush()
+
+
+def close_trace():
+    global _file
+    with _lock:
+        if _file:
+            _file.close()
+            _file = None
+
+
+def _pid(process, events):
+    if process not in _pids:
+        _pids[process] = len(_pids) + 1
+        events.append({"name": "process_name", "ph": "M", "pid": _pids[process],
+                       "args": {"name": process}})
+    return _pids[process]
+
+
+def record(header):
+    """Write every span of the header's trace, if tracing is enabled."""
+    trace = header.get("trace")
+    if not _file or not isinstance(trace, dict):
+        return
+    with _lock:
+        events = []
+        tid = zlib.crc32(str(trace.get("id")).encode())
+        for span in trace.get("spans", []):
+            try:
+                name, process, start, end = span
+                start, end = float(start), float(end)
+            except (TypeError, ValueError):
+                continue  # Malformed span from a peer
+            events.append({
+                "name": name,
+                "cat": "bounceboard",
+                "ph": "X",
+                "pid": _pid(str(process), events),
+                "tid": tid,
+                "ts": round(start * 1e6),
+                "dur": max(0, round((end - start) * 1e6)),
+                "args": {"trace": trace.get("id"), "hash": header.get("hash"), "type": header.get("type")},
+            })
+        _file.write("".join(json.dumps(event) + ",\n" for event in events))
+        _file.flush()
@@ -0,0 +1,35 @@
+"""Helper for tests: serves an in-memory clipboard over the helper protocol.
+
+With --slow it never answers get requests.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bounceboard.clipboard.backends import ClipboardBackend  # noqa: E402
+from bounceboard.clipboard.helper import serve  # noqa: E402
+
+
+class MemoryBackend(ClipboardBackend):
+    def __init__(self):
+        self.clipboard = None
+        self.changes = 0
+
+    def get_content(self):
+        if '--slow' in sys.argv:
+            time.sleep(60)
+        return self.clipboard
+
+    def set_content(self, clipboard, temp_dir=None):
+        self.clipboard = clipboard
+        self.changes += 1
+        return True
+
+    def get_fingerprint(self):
+        return f'{os.getpid()}:{self.changes}'.encode()
+
+
+if __name__ == '__main__':
+    serve(MemoryBackend())
@@ -0,0 +1,10 @@
+"""Shared test fixtures."""
+import hashlib
+
+
+def make_clipboard(data, mime='text/plain', text=None):
+    """A (header, data) clipboard for data, with the size and hash bounceboard expects."""
+    header = {'type': mime, 'size': len(data), 'hash': hashlib.sha256(data).hexdigest()}
+    if text:
+        header['text'] = text
+    return header, data
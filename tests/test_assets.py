@@ -0,0 +1,29 @@
+import gzip
+import unittest
+
+from bounceboard.assets import Asset, accepted_encodings
+
+
+class AssetTests(unittest.TestCase):
+    def test_accepted_encodings(self):
+        self.assertEqual(accepted_encodings('gzip, deflate, br;q=0'), {'gzip', 'deflate'})
+        self.assertEqual(accepted_encodings('GZIP;q=0.5'), {'gzip'})
+        self.assertEqual(accepted_encodings(''), set())
+
+    def test_variants(self):
+        data = b'<p>hello</p>\n' * 100
+        asset = Asset(data, 'text/html')
+        encoding, body, etag = asset.select('gzip')
+        self.assertEqual(encoding, 'gzip')
+        self.assertEqual(gzip.decompress(body), data)
+        identity = asset.select('identity')
+        self.assertEqual(identity[:2], (None, data))
+        self.assertNotEqual(identity[2], etag)
+
+    def test_incompressible_has_no_variant(self):
+        asset = Asset(b'x', 'text/plain')
+        self.assertEqual(asset.select('gzip, br')[0], None)
+
+
+if __name__ == '__main__':
+    unittest.main()
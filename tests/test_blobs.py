@@ -0,0 +1,35 @@
+import unittest
+
+from bounceboard.blobs import BlobCache, BlobNamespace
+
+
+class BlobCacheTests(unittest.TestCase):
+    def test_lru_eviction_by_size(self):
+        cache = BlobCache(max_bytes=10)
+        cache.put('a', b'1234')
+        cache.put('b', b'1234')
+        cache.get('a')
+        cache.put('c', b'1234')
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(cache.size, 8)
+
+    def test_oversized_blob_skipped(self):
+        cache = BlobCache(max_bytes=4)
+        cache.put('a', b'12345')
+        self.assertEqual(len(cache), 0)
+
+    def test_namespaces_share_budget_not_keys(self):
+        cache = BlobCache(max_bytes=10)
+        one, two = BlobNamespace(cache, 'one'), BlobNamespace(cache, 'two')
+        one.put('a', b'1234')
+        self.assertEqual(one.get('a'), b'1234')
+        self.assertIsNone(two.get('a'))
+        self.assertNotIn('a', two)
+        two.put('b', b'12345678')
+        self.assertNotIn('a', one)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from bounceboard.clipboard import common
+
+
+class FileFingerprintTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, b'file contents')
+        os.close(fd)
+        self.addCleanup(os.unlink, self.path)
+
+    def test_hash_cached_until_file_changes(self):
+        header, ref = common.handle_clipboard_file(self.path)
+        self.assertEqual(header['hash'], common.calculate_hash(b'file contents'))
+        self.assertEqual(len(ref), header['size'])
+
+        with mock.patch('builtins.open', side_effect=AssertionError('file was re-read')):
+            self.assertEqual(common.handle_clipboard_file(self.path)[0], header)
+
+        with open(self.path, 'ab') as f:
+            f.write(b' and more')
+        os.utime(self.path, ns=(0, 1))
+        header, ref = common.handle_clipboard_file(self.path)
+        self.assertEqual(header['hash'], common.calculate_hash(b'file contents and more'))
+        self.assertEqual(ref.read(), b'file contents and more')
+
+    def test_read_copies_and_verifies(self):
+        header, ref = common.handle_clipboard_file(self.path)
+        data = ref.read()
+        with open(self.path, 'wb') as f:
+            f.write(b'FILE CONTENTS')
+        self.assertEqual(bytes(data), b'file contents')
+        with self.assertRaises(OSError):
+            ref.read()
+
+
+if __name__ == '__main__':
+    unittest.main()
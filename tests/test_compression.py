@@ -0,0 +1,44 @@
+import os
+import unittest
+
+from bounceboard import compression
+
+
+class CompressionTests(unittest.TestCase):
+    def test_round_trip(self):
+        data = b'<p>hello world</p>' * 500
+        for codec in compression.CODECS:
+            encoded = compression.encode(codec, {'type': 'text/html'}, data)
+            self.assertLess(len(encoded), len(data))
+            self.assertEqual(compression.decode(codec, encoded), data)
+
+    def test_decode_limit(self):
+        data = b'\0' * 100000
+        for codec in compression.CODECS:
+            encoded = compression.encode(codec, {'type': 'text/plain'}, data)
+            self.assertEqual(compression.decode(codec, encoded, max_length=len(data)), data)
+            with self.assertRaises(ValueError):
+                compression.decode(codec, encoded, max_length=len(data) - 1)
+            with self.assertRaises(ValueError):
+                compression.decode(codec, b'not compressed', max_length=len(data))
+
+    def test_decoder_limit_across_chunks(self):
+        encoded = compression.encode('zlib', {'type': 'text/plain'}, b'\0' * 100000)
+        decoder = compression.Decoder('zlib', max_length=1000)
+        with self.assertRaises(ValueError):
+            for i in range(0, len(encoded), 10):
+                decoder.decompress(encoded[i:i + 10])
+        self.assertLessEqual(decoder.length, 1001)
+
+    def test_skips_compressed_and_small_payloads(self):
+        self.assertIsNone(compression.encode('zlib', {'type': 'image/png'}, b'\0' * 4096))
+        self.assertIsNone(compression.encode('zlib', {'type': 'text/plain'}, b'tiny'))
+        self.assertIsNone(compression.encode('zlib', {'type': 'application/x-file'}, os.urandom(4096)))
+
+    def test_choose_codec(self):
+        self.assertEqual(compression.choose_codec({'zlib'}), 'zlib')
+        self.assertIsNone(compression.choose_codec({'chunked'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
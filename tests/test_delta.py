@@ -0,0 +1,28 @@
+import unittest
+
+from bounceboard import delta
+
+
+class DeltaTests(unittest.TestCase):
+    def test_round_trip_with_edits(self):
+        lines = [f'line {i} of a document that keeps changing\n'.encode() for i in range(500)]
+        base = b''.join(lines)
+        lines[10] = b'replaced\n'
+        lines.insert(300, b'inserted line\n')
+        del lines[400]
+        new = b''.join(lines) + b'trailing text without newline'
+        patch = delta.encode(base, new)
+        self.assertLess(len(patch), len(new) // 10)
+        self.assertEqual(delta.apply(base, patch), new)
+
+    def test_unrelated_payload(self):
+        patch = delta.encode(b'abc\n' * 100, b'xyz\n' * 100)
+        self.assertEqual(delta.apply(b'abc\n' * 100, patch), b'xyz\n' * 100)
+
+    def test_corrupt_delta(self):
+        with self.assertRaises(ValueError):
+            delta.apply(b'abc', b'C' + b'\0' * 7 + b'\1' + b'\0' * 7 + b'\xff')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+import hashlib
+import io
+import os
+import platform
+import shutil
+import sys
+import time
+import unittest
+from unittest import mock
+
+from bounceboard.clipboard import helper, proc
+from bounceboard.clipboard.helper import HelperBackend, HelperError
+
+STUB = [sys.executable, os.path.join(os.path.dirname(__file__), 'clipboard_helper_stub.py')]
+
+
+class ProtocolTests(unittest.TestCase):
+    def test_round_trip(self):
+        stream = io.BytesIO()
+        helper.write_message(stream, {'op': 'set', 'header': {'type': 'text/plain'}}, b'payload')
+        helper.write_message(stream, {'op': 'get'})
+        stream.seek(0)
+        self.assertEqual(helper.read_message(stream), ({'op': 'set', 'header': {'type': 'text/plain'}}, b'payload'))
+        self.assertEqual(helper.read_message(stream), ({'op': 'get'}, b''))
+        self.assertIsNone(helper.read_message(stream))
+
+    def test_truncated_message(self):
+        stream = io.BytesIO()
+        helper.write_message(stream, {'op': 'get'}, b'payload')
+        with self.assertRaises(EOFError):
+            helper.read_message(io.BytesIO(stream.getvalue()[:-3]))
+
+
+class HelperBackendTests(unittest.TestCase):
+    def setUp(self):
+        breaker = mock.patch.object(proc, 'BREAKER', proc.CircuitBreaker())
+        breaker.start()
+        self.addCleanup(breaker.stop)
+
+    def backend(self, *args, timeout=5):
+        backend = HelperBackend(STUB + list(args), timeout=timeout)
+        self.addCleanup(backend.close)
+        return backend
+
+    def test_set_and_get(self):
+        backend = self.backend()
+        self.assertIsNone(backend.get_content())
+        header = {'type': 'text/plain', 'size': 5, 'hash': 'abc'}
+        self.assertTrue(backend.set_content((header, memoryview(b'hello'))))
+        self.assertEqual(backend.get_content(), (header, b'hello'))
+
+    def test_one_process_for_many_requests(self):
+        backend = self.backend()
+        first = backend.get_fingerprint()
+        backend.set_content(({'type': 'text/plain'}, b'x'))
+        second = backend.get_fingerprint()
+        self.assertNotEqual(first, second)
+        self.assertEqual(first.split(b':')[0], second.split(b':')[0])
+
+    def test_restarted_after_dying(self):
+        backend = self.backend()
+        pid = backend.get_fingerprint().split(b':')[0]
+        backend._process.kill()
+        backend._process.wait()
+        self.assertNotEqual(backend.get_fingerprint().split(b':')[0], pid)
+
+    def test_deadline_kills_helper(self):
+        backend = self.backend('--slow', timeout=0.3)
+        started = time.monotonic()
+        with self.assertRaises(proc.Timeout):
+            backend.get_content()
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(proc.BREAKER.failures, 1)
+
+    def test_unknown_op(self):
+        with self.assertRaises(HelperError):
+            self.backend().request({'op': 'paste'})
+
+    def test_hash_filled_in(self):
+        backend = self.backend()
+        backend.set_content(({'type': 'text/plain'}, b'hello'))
+        header, data = backend.get_content()
+        self.assertEqual(header['size'], 5)
+        self.assertEqual(header['hash'], hashlib.sha256(b'hello').hexdigest())
+
+    def test_failing_helper_falls_back(self):
+        fallback = mock.Mock()
+        fallback.get_content.return_value = 'native'
+        backend = HelperBackend([sys.executable, '-c', 'pass'], fallback=fallback)
+        self.addCleanup(backend.close)
+        self.assertEqual(backend.get_content(), 'native')
+        # Not retried until RETRY_AFTER has passed
+        with mock.patch.object(backend, 'request') as request:
+            backend.get_fingerprint()
+            request.assert_not_called()
+        fallback.get_fingerprint.assert_called_once_with()
+
+    def test_failing_helper_without_fallback_raises(self):
+        backend = HelperBackend([sys.executable, '-c', 'pass'])
+        self.addCleanup(backend.close)
+        with self.assertRaises(HelperError):
+            backend.get_content()
+
+    def test_notifier_from_platform_backend(self):
+        notifier = object()
+        with mock.patch.object(helper, 'get_backend') as get_backend:
+            get_backend.return_value.create_notifier.return_value = notifier
+            self.assertIs(HelperBackend(STUB).create_notifier(), notifier)
+
+
+class CommandTests(unittest.TestCase):
+    def test_powershell_runs_bundled_script(self):
+        command = helper.helper_command('powershell')
+        self.assertEqual(command[0], 'powershell')
+        self.assertEqual(command[-2:], ['-File', helper.POWERSHELL_SCRIPT])
+        self.assertTrue(os.path.exists(helper.POWERSHELL_SCRIPT))
+
+    def test_osascript_runs_bundled_script(self):
+        self.assertEqual(helper.helper_command('osascript'), ['osascript', '-l', 'JavaScript', helper.JXA_SCRIPT])
+        self.assertTrue(os.path.exists(helper.JXA_SCRIPT))
+
+    def test_other_commands_are_split(self):
+        self.assertEqual(helper.helper_command('python -m helper --fast'), ['python', '-m', 'helper', '--fast'])
+
+
+class SelectionTests(unittest.TestCase):
+    def setUp(self):
+        get_backend = mock.patch.object(helper, 'get_backend')
+        self.get_backend = get_backend.start()
+        self.addCleanup(get_backend.stop)
+
+    def test_resident_helper_by_default(self):
+        for system, script in [('Windows', helper.POWERSHELL_SCRIPT), ('Darwin', helper.JXA_SCRIPT)]:
+            backend = helper.create_backend(system)
+            self.assertIsInstance(backend, HelperBackend)
+            self.assertIn(script, backend.command)
+            self.assertIs(backend.fallback, self.get_backend.return_value)
+
+    def test_linux_uses_native_backend(self):
+        self.assertIs(helper.create_backend('Linux'), self.get_backend.return_value)
+
+    def test_helper_turned_off(self):
+        self.assertIs(helper.create_backend('Darwin', 'none'), self.get_backend.return_value)
+
+    def test_helper_chosen_by_command(self):
+        backend = helper.create_backend('Linux', 'my-helper --serve')
+        self.assertEqual(backend.command, ['my-helper', '--serve'])
+        self.assertIsNone(backend.fallback)
+
+
+class ResidentHelperTests(unittest.TestCase):
+    """Runs the bundled helper against the real clipboard, replacing its content."""
+
+    def setUp(self):
+        value = helper.RESIDENT_HELPERS.get(platform.system())
+        if not value or not shutil.which(value):
+            self.skipTest('no resident helper for this platform')
+        self.backend = HelperBackend(helper.helper_command(value))
+        self.addCleanup(self.backend.close)
+
+    def test_set_get_and_fingerprint(self):
+        before = self.backend.get_fingerprint()
+        text = 'bounceboard \u2713'.encode('utf-8')
+        header = {'type': 'text/plain', 'size': len(text), 'hash': hashlib.sha256(text).hexdigest()}
+        self.assertTrue(self.backend.set_content((header, text)))
+        self.assertNotEqual(self.backend.get_fingerprint(), before)
+        self.assertEqual(self.backend.get_content(), (header, text))
+
+    def test_one_process_for_many_requests(self):
+        self.backend.get_fingerprint()
+        process = self.backend._process
+        for _ in range(3):
+            self.backend.get_content()
+        self.assertIs(self.backend._process, process)
+
+
+if __name__ == '__main__':
+    unittest.main()
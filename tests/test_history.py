@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from bounceboard import history as history_module
+from bounceboard.history import HistoryLog
+
+
+def header(data, mime='text/plain'):
+    return {'type': mime, 'size': len(data), 'hash': hashlib.sha256(data).hexdigest()}
+
+
+class HistoryTests(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def open(self, **kwargs):
+        log = HistoryLog(self.path, **kwargs)
+        self.addCleanup(log.close)
+        return log
+
+    def test_append_dedups_and_persists(self):
+        log = self.open()
+        log.append(header(b'one'), b'one')
+        log.append(header(b'two'), b'two')
+        log.append(header(b'one'), b'one')
+        log.flush()
+        self.assertEqual(len(log.entries()), 3)
+        self.assertEqual(log.get(header(b'one')['hash']), b'one')
+        log.close()
+        self.assertEqual(os.path.getsize(os.path.join(self.path, 'seg-000001.bin')), 6)
+
+        reopened = self.open()
+        self.assertEqual([e['hash'] for e in reopened.entries()],
+                         [header(b)['hash'] for b in (b'one', b'two', b'one')])
+        self.assertEqual(reopened.get(header(b'two')['hash']), b'two')
+
+    def test_append_after_torn_index_line(self):
+        log = self.open()
+        log.append(header(b'one'), b'one')
+        log.append(header(b'two'), b'two')
+        log.close()
+        with open(os.path.join(self.path, history_module.INDEX_NAME), 'a') as f:
+            f.write('{"id": 3, "ti')
+
+        log = self.open()
+        self.assertEqual(len(log.entries()), 2)
+        log.append(header(b'three'), b'three')
+        log.close()
+        reopened = self.open()
+        self.assertEqual([e['id'] for e in reopened.entries()], [1, 2, 3])
+        self.assertEqual(reopened.get(header(b'three')['hash']), b'three')
+
+    def test_release_closes_files_until_next_write(self):
+        log = self.open()
+        log.append(header(b'one'), b'one')
+        log.release()
+        self.assertIsNone(log._segment_file)
+        self.assertEqual(log.get(header(b'one')['hash']), b'one')
+        log.append(header(b'two'), b'two')
+        log.flush()
+        self.assertEqual(len(log.entries()), 2)
+        self.assertEqual([e['preview'] for e in log.search.query(text='two')[0]], ['two'])
+        log.close()
+        self.assertEqual(len(self.open().entries()), 2)
+
+    def test_lookup_returns_latest_record(self):
+        log = self.open()
+        log.append(header(b'one'), b'one')
+        log.append(header(b'two'), b'two')
+        log.append(header(b'one'), b'one')
+        log.flush()
+        self.assertEqual(log.lookup(header(b'one')['hash'])['id'], 3)
+        self.assertIsNone(log.lookup(header(b'three')['hash']))
+        log.close()
+        self.assertEqual(self.open().lookup(header(b'two')['hash'])['id'], 2)
+
+    def test_compaction_by_size(self):
+        with mock.patch.object(history_module, 'SEGMENT_SIZE', 8):
+            log = self.open(max_bytes=10)
+            for data in (b'aaaaaaaa', b'bbbbbbbb', b'cccccccc'):
+                log.append(header(data), data)
+            log.flush()
+            log.compact()
+        self.assertEqual([e['hash'] for e in log.entries()], [header(b'cccccccc')['hash']])
+        self.assertIsNone(log.get(header(b'aaaaaaaa')['hash']))
+        self.assertIsNone(log.lookup(header(b'aaaaaaaa')['hash']))
+        self.assertEqual(log.get(header(b'cccccccc')['hash']), b'cccccccc')
+        self.assertEqual([n for n in os.listdir(self.path) if n.startswith('seg-')], ['seg-000003.bin'])
+        self.assertEqual([e['hash'] for e in log.search.query()[0]], [header(b'cccccccc')['hash']])
+
+    def test_compaction_by_age(self):
+        log = self.open(max_age=60)
+        log.append(header(b'old'), b'old')
+        log.append(header(b'new'), b'new')
+        log.flush()
+        log._entries[0]['time'] = time.time() - 120
+        log.compact()
+        self.assertEqual([e['hash'] for e in log.entries()], [header(b'new')['hash']])
+
+    def test_import_legacy_layout(self):
+        day = os.path.join(self.path, '2025-01-18')
+        os.makedirs(day)
+        h = dict(header(b'legacy'), time=1737232722.8)
+        with open(os.path.join(day, h['hash'] + '.json'), 'w') as f:
+            json.dump(h, f)
+        with open(os.path.join(day, h['hash'] + '.bin'), 'wb') as f:
+            f.write(b'legacy')
+        log = self.open()
+        self.assertEqual(log.entries()[0]['time'], 1737232722.8)
+        self.assertEqual(log.get(h['hash']), b'legacy')
+
+    def test_search(self):
+        log = self.open()
+        log.append(header(b'the quick brown fox'), b'the quick brown fox')
+        log.append(dict(header(b'<b>x</b>', 'text/html'), text='lazy dog'), b'<b>x</b>')
+        for i in range(5):
+            log.append(header(b'note %d' % i), b'note %d' % i)
+        log.flush()
+        search = log.search
+
+        found, _ = search.query('brown fox')
+        self.assertEqual([e['preview'] for e in found], ['the quick brown fox'])
+        self.assertEqual(search.query('dog')[0][0]['type'], 'text/html')
+        self.assertEqual(search.query('"unbalanced')[0], [])
+
+        page, cursor = search.query('note', limit=3)
+        self.assertEqual([e['preview'] for e in page], ['note 4', 'note 3', 'note 2'])
+        page, cursor = search.query('note', limit=3, before=cursor)
+        self.assertEqual([e['preview'] for e in page], ['note 1', 'note 0'])
+        self.assertIsNone(cursor)
+        self.assertEqual(len(search.query(mime='text/html')[0]), 1)
+
+    def test_search_rebuilt_when_missing(self):
+        log = self.open()
+        log.append(header(b'remember me'), b'remember me')
+        log.close()
+        os.unlink(os.path.join(self.path, 'search.db'))
+        reopened = self.open()
+        self.assertEqual(len(reopened.search.query('remember')[0]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
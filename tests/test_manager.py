@@ -1,7 +1,11 @@
 import unittest
 import asyncio
 
+from bounceboard.clipboard import get_fingerprint
+from bounceboard.clipboard.common import ClipboardFile
 from bounceboard.clipboard.manager import ClipboardManager
+from bounceboard.clipboard.notify import ChangeNotifier
+from bounceboard.metrics import PROPAGATION
 
 class DummyBackend:
     def __init__(self):
@@ -28,5 +32,74 @@ class ManagerTests(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(backend.content, new_clip)
         self.assertIsNone(await mgr.get_updated_clipboard())
 
+    def test_fingerprint_only_for_os_getter(self):
+        backend = DummyBackend()
+        self.assertIsNone(ClipboardManager(backend.get_content, backend.set_content)._fingerprint)
+        self.assertIs(ClipboardManager()._fingerprint, get_fingerprint)
+        self.assertIs(ClipboardManager(backend.get_content, fingerprint=len)._fingerprint, len)
+
+    async def test_detected_time_measures_propagation(self):
+        source, target = DummyBackend(), DummyBackend()
+        sender = ClipboardManager(source.get_content, source.set_content, fingerprint=None)
+        receiver = ClipboardManager(target.get_content, target.set_content, fingerprint=None)
+        source.content = ({'type': 'text/plain', 'size': 1, 'hash': '2'}, b'b')
+
+        clipboard = await sender.get_updated_clipboard()
+        self.assertIn('detected', clipboard[0])
+        before = PROPAGATION.value()
+        self.assertTrue(await receiver.apply_update(clipboard))
+        self.assertEqual(PROPAGATION.value(), before + 1)
+
+    async def test_fingerprint_skips_fetch(self):
+        backend = DummyBackend()
+        reads = []
+        fingerprint = [b'1']
+
+        def getter():
+            reads.append(1)
+            return backend.get_content()
+
+        mgr = ClipboardManager(getter, backend.set_content, fingerprint=lambda: fingerprint[0])
+        self.assertEqual(await mgr.get_updated_clipboard(), backend.content)
+        self.assertIsNone(await mgr.get_updated_clipboard())
+        self.assertEqual(len(reads), 1)
+
+        fingerprint[0] = b'2'
+        backend.content = ({'type': 'text/plain', 'size': 1, 'hash': '1'}, b'a')
+        self.assertEqual(await mgr.get_updated_clipboard(), backend.content)
+        self.assertEqual(len(reads), 2)
+
+    async def test_file_read_only_when_changed(self):
+        header = {'type': 'application/x-file', 'size': 3, 'hash': 'f', 'text': 'a.txt'}
+        ref = ClipboardFile('/nonexistent', 3)
+        reads = []
+        ref.read = lambda: reads.append(1) or b'abc'
+        mgr = ClipboardManager(lambda: (header, ref), None, fingerprint=None)
+
+        self.assertEqual(await mgr.get_updated_clipboard(), (header, b'abc'))
+        self.assertIsNone(await mgr.get_updated_clipboard())
+        self.assertEqual(len(reads), 1)
+
+    async def test_watch_wakes_on_notification(self):
+        backend = DummyBackend()
+        notifier = ChangeNotifier()
+        mgr = ClipboardManager(backend.get_content, backend.set_content, lambda: notifier)
+        changes = asyncio.Queue()
+
+        async def on_change(clipboard):
+            await changes.put(clipboard)
+
+        task = asyncio.create_task(mgr.watch(on_change, interval=60))
+        try:
+            self.assertEqual(await asyncio.wait_for(changes.get(), 1), backend.content)
+            backend.content = ({'type': 'text/plain', 'size': 1, 'hash': '1'}, b'a')
+            notifier._changed.set()
+            self.assertEqual(await asyncio.wait_for(changes.get(), 1), backend.content)
+        finally:
+            task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertFalse(notifier.alive)
+
 if __name__ == '__main__':
     unittest.main()
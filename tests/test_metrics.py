@@ -0,0 +1,38 @@
+import unittest
+
+from bounceboard.metrics import Registry
+
+
+class MetricsTests(unittest.TestCase):
+    def test_render(self):
+        registry = Registry()
+        sent = registry.counter('sent_bytes_total', 'Bytes sent')
+        backlog = registry.gauge('backlog', 'Pending sends', ['peer'])
+        latency = registry.histogram('get_seconds', 'Read time', ['type'], buckets=(0.1, 1))
+
+        sent.inc(10)
+        sent.inc(5)
+        backlog.set_function(lambda: {('a"b',): 2})
+        latency.observe(0.05, type='text/plain')
+        latency.observe(3, type='text/plain')
+
+        text = registry.render()
+        self.assertIn('# TYPE sent_bytes_total counter\nsent_bytes_total 15\n', text)
+        self.assertIn('backlog{peer="a\\"b"} 2\n', text)
+        self.assertIn('get_seconds_bucket{type="text/plain",le="0.1"} 1\n', text)
+        self.assertIn('get_seconds_bucket{type="text/plain",le="1"} 1\n', text)
+        self.assertIn('get_seconds_bucket{type="text/plain",le="+Inf"} 2\n', text)
+        self.assertIn('get_seconds_count{type="text/plain"} 2\n', text)
+        self.assertEqual(latency.value(type='text/plain'), 2)
+
+    def test_labels_checked(self):
+        registry = Registry()
+        latency = registry.histogram('get_seconds', 'Read time', ['type'])
+        with self.assertRaises(ValueError):
+            latency.observe(1)
+        with self.assertRaises(ValueError):
+            registry.counter('get_seconds', 'Duplicate')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import os
+import tempfile
+import unittest
+
+from bounceboard.payload import Spool, map_path
+
+
+class PayloadTests(unittest.TestCase):
+    def test_small_payload_stays_in_memory(self):
+        spool = Spool(threshold=16)
+        spool.write(b'hello ')
+        spool.write(b'world')
+        data = spool.finish()
+        self.assertIsInstance(data, bytearray)
+        self.assertEqual(data, b'hello world')
+
+    def test_large_payload_spills_to_mapped_file(self):
+        spool = Spool(threshold=16)
+        for _ in range(4):
+            spool.write(b'0123456789')
+        data = spool.finish()
+        self.assertIsInstance(data, memoryview)
+        self.assertEqual(data, b'0123456789' * 4)
+        self.assertEqual(bytes(data[10:14]), b'0123')
+
+    def test_map_path(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, path)
+        self.assertEqual(map_path(path), b'')
+        with open(path, 'wb') as f:
+            f.write(b'abc')
+        self.assertEqual(map_path(path), b'abc')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+import asyncio
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+import bounceboard.clipboard as clipboard
+from bounceboard.clipboard import proc
+
+SLEEP = [sys.executable, '-c', 'import time; time.sleep(30)']
+
+
+class ProcTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        breaker = mock.patch.object(proc, 'BREAKER', proc.CircuitBreaker())
+        breaker.start()
+        self.addCleanup(breaker.stop)
+
+    async def test_run_captures_output(self):
+        result = await proc.run([sys.executable, '-c', 'import sys; sys.stdout.write(sys.stdin.read().upper())'],
+                                input=b'abc')
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(result.stdout, b'ABC')
+
+    async def test_deadline_kills_helper(self):
+        started = time.monotonic()
+        with self.assertRaises(proc.Timeout):
+            await proc.run(SLEEP, timeout=0.2)
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(proc.BREAKER.failures, 1)
+
+    async def test_call_runs_helpers_on_loop(self):
+        result = await proc.call(proc.run_sync, [sys.executable, '-c', 'print("hi")'], None, 5, True, True)
+        self.assertEqual(result.stdout.strip(), 'hi')
+
+    async def test_cancel_kills_helpers(self):
+        finished = threading.Event()
+
+        def backend():
+            try:
+                proc.run_sync(SLEEP)
+            except Exception:
+                pass
+            finally:
+                finished.set()
+
+        task = asyncio.create_task(proc.call(backend))
+        await asyncio.sleep(0.3)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertTrue(await asyncio.get_running_loop().run_in_executor(None, finished.wait, 5))
+        self.assertEqual(proc.BREAKER.failures, 0)
+
+    async def test_cancel_is_not_swallowed_by_backends(self):
+        raised = []
+
+        def backend():
+            try:
+                proc.run_sync(SLEEP)
+            except Exception as e:
+                raised.append(e)
+            except BaseException as e:
+                raised.append(e)
+                raise
+
+        task = asyncio.create_task(proc.call(backend))
+        await asyncio.sleep(0.3)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        while not raised:
+            await asyncio.sleep(0.01)
+        self.assertIsInstance(raised[0], asyncio.CancelledError)
+
+
+class BlockingTests(unittest.TestCase):
+    def test_run_sync_outside_loop(self):
+        with mock.patch.object(proc, 'BREAKER', proc.CircuitBreaker()):
+            result = proc.run_sync([sys.executable, '-c', 'print("hi")'], text=True)
+            self.assertEqual(result.stdout.strip(), 'hi')
+            with self.assertRaises(proc.Timeout):
+                proc.run_sync(SLEEP, timeout=0.2)
+
+    def test_bounded_call(self):
+        bounded = proc.Bounded(timeout=0.2)
+        self.assertEqual(bounded(str.upper, 'abc'), 'ABC')
+        with self.assertRaises(ValueError):
+            bounded(int, 'x')
+        release = threading.Event()
+        self.addCleanup(release.set)
+        with self.assertRaises(proc.Timeout):
+            bounded(release.wait)
+        started = time.monotonic()
+        with self.assertRaises(proc.Timeout):
+            bounded(str.upper, 'abc')
+        self.assertLess(time.monotonic() - started, 0.1)
+        release.set()
+        time.sleep(0.1)
+        self.assertEqual(bounded(str.upper, 'abc'), 'ABC')
+
+
+class BreakerTests(unittest.TestCase):
+    def test_trips_and_recovers(self):
+        breaker = proc.CircuitBreaker(threshold=2, cooldown=60)
+        breaker.failure()
+        self.assertTrue(breaker.allow())
+        breaker.failure()
+        self.assertFalse(breaker.allow())
+        breaker.opened -= 60
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.success()
+        self.assertTrue(breaker.allow())
+
+    def test_tripped_breaker_uses_fallback(self):
+        native, fallback = mock.Mock(), mock.Mock()
+        fallback.get_content.return_value = 'fallback'
+        breaker = proc.CircuitBreaker(threshold=1)
+        breaker.failure()
+        with mock.patch.object(clipboard, '_backend', native), \
+             mock.patch.object(clipboard, '_fallback', fallback), \
+             mock.patch.object(proc, 'BREAKER', breaker):
+            self.assertEqual(clipboard.get_content(), 'fallback')
+            self.assertIsNone(clipboard.get_fingerprint())
+        native.get_content.assert_not_called()
+
+    def test_timeout_skips_fallback(self):
+        native, fallback = mock.Mock(), mock.Mock()
+        native.get_content.side_effect = proc.Timeout('xclip did not finish')
+        native.set_content.side_effect = proc.Timeout('xclip did not finish')
+        with mock.patch.object(clipboard, '_backend', native), \
+             mock.patch.object(clipboard, '_fallback', fallback), \
+             mock.patch.object(proc, 'BREAKER', proc.CircuitBreaker()):
+            self.assertIsNone(clipboard.get_content())
+            self.assertFalse(clipboard.set_content(({'type': 'text/plain'}, b'')))
+        fallback.get_content.assert_not_called()
+        fallback.set_content.assert_not_called()
+
+    def test_linux_target_raises_timeout(self):
+        from bounceboard.clipboard import linux
+        with mock.patch.object(proc, 'run_sync', side_effect=proc.Timeout('xclip did not finish')):
+            with self.assertRaises(proc.Timeout):
+                linux.get_content()
+
+
+if __name__ == '__main__':
+    unittest.main()
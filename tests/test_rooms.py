@@ -0,0 +1,67 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from bounceboard.blobs import BlobCache
+from bounceboard.rooms import Room
+
+from helpers import make_clipboard
+
+
+class RoomTests(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_connects_share_one_backend_read(self):
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def slow_read():
+            started.set()
+            await release.wait()
+            return make_clipboard(b'local')
+
+        manager = mock.Mock()
+        manager.get_current = mock.AsyncMock(side_effect=slow_read)
+        room = Room('default', BlobCache(), manager=manager)
+
+        readers = [asyncio.create_task(room.get_current()) for _ in range(20)]
+        await started.wait()
+        release.set()
+        results = await asyncio.gather(*readers)
+        self.assertEqual({bytes(data) for _, data in results}, {b'local'})
+        manager.get_current.assert_awaited_once()
+        self.assertEqual(room.version, 1)
+
+        # Later connections are answered from the snapshot
+        await room.get_current()
+        manager.get_current.assert_awaited_once()
+
+    async def test_snapshot_follows_changes(self):
+        manager = mock.Mock()
+        manager.apply_update = mock.AsyncMock(return_value=True)
+        manager.get_current = mock.AsyncMock()
+        room = Room('default', BlobCache(), manager=manager)
+
+        room.local_change(make_clipboard(b'one'))
+        await room.relay(make_clipboard(b'two'))
+        await room.relay(make_clipboard(b'two'))
+        self.assertEqual(room.version, 2)
+        self.assertEqual((await room.get_current())[1], b'two')
+        manager.get_current.assert_not_awaited()
+
+    async def test_snapshot_drops_live_fields(self):
+        room = Room('default', BlobCache())
+        live = mock.Mock()
+        room.add(live)
+        header, data = make_clipboard(b'live')
+        header.update(detected=1.0, trace={'id': 'x', 'spans': []})
+        room.local_change((header, data))
+
+        sent = live.enqueue.call_args[0][0][0]
+        self.assertEqual((sent['detected'], sent['seq']), (1.0, 1))
+        snapshot = (await room.get_current())[0]
+        self.assertNotIn('detected', snapshot)
+        self.assertNotIn('trace', snapshot)
+        self.assertEqual(snapshot['seq'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,386 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from aiohttp.test_utils import TestServer, TestClient
+
+from bounceboard import service
+from bounceboard.clipboard.manager import ClipboardManager
+from bounceboard.history import HistoryLog
+from bounceboard.sync import ClipboardConnection
+
+from helpers import make_clipboard
+
+
+class ServerTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        manager = mock.patch.object(service, 'clipboard_manager')
+        self.manager = manager.start()
+        self.addCleanup(manager.stop)
+        self.manager.apply_update = mock.AsyncMock(return_value=True)
+        self.manager.get_current = mock.AsyncMock(return_value=None)
+        self.server = service.ClipboardServer(key='secret')
+        self.client = TestClient(TestServer(self.server.create_app()))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    def use_history(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        history = HistoryLog(path)
+        self.addCleanup(history.close)
+        patcher = mock.patch.object(service, 'get_history', return_value=history)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return history
+
+    async def test_index_served_compressed(self):
+        resp = await self.client.get('/', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(resp.headers['Vary'], 'Accept-Encoding')
+        self.assertIn(b'WebSocket', await resp.read())
+
+        resp = await self.client.get('/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': resp.headers['ETag']})
+        self.assertEqual(resp.status, 304)
+
+        version = self.server._assets['index.html'].version
+        resp = await self.client.get('/static/index.html', params={'v': version})
+        self.assertIn('immutable', resp.headers['Cache-Control'])
+        resp = await self.client.get('/static/missing.js')
+        self.assertEqual(resp.status, 404)
+
+    async def test_metrics(self):
+        resp = await self.client.get('/metrics')
+        self.assertEqual(resp.status, 403)
+        resp = await self.client.get('/metrics', params={'key': 'secret'})
+        self.assertEqual(resp.status, 200)
+        text = await resp.text()
+        self.assertIn('bounceboard_connected_clients 0\n', text)
+        self.assertIn('# TYPE bounceboard_propagation_seconds histogram', text)
+
+    async def test_history_requires_key(self):
+        self.use_history()
+        resp = await self.client.get('/history')
+        self.assertEqual(resp.status, 403)
+
+    async def test_history_search(self):
+        history = self.use_history()
+        for text in (b'alpha one', b'beta two', b'alpha three'):
+            history.append(*make_clipboard(text))
+        history.flush()
+
+        resp = await self.client.get('/history', params={'q': 'alpha', 'limit': '1'},
+                                     headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(resp.status, 200)
+        body = await resp.json()
+        self.assertEqual([e['preview'] for e in body['entries']], ['alpha three'])
+
+        resp = await self.client.get('/history', params={'key': 'secret', 'q': 'alpha', 'before': body['next']})
+        body = await resp.json()
+        self.assertEqual([e['preview'] for e in body['entries']], ['alpha one'])
+        self.assertIsNone(body['next'])
+
+        resp = await self.client.get('/history', params={'key': 'secret', 'limit': 'x'})
+        self.assertEqual(resp.status, 400)
+
+    async def test_clipboard_put_and_get(self):
+        auth = {'Authorization': 'Bearer secret'}
+        resp = await self.client.get('/clipboard', headers=auth)
+        self.assertEqual(resp.status, 404)
+
+        data = bytes(range(256)) * 64
+        resp = await self.client.put('/clipboard', data=data, headers=dict(auth, **{
+            'Content-Type': 'image/png', 'X-Clipboard-Text': 'caf%C3%A9'}))
+        self.assertEqual(resp.status, 201)
+        header = await resp.json()
+        self.assertEqual(header, make_clipboard(data, 'image/png')[0] | {'text': 'café'})
+        self.manager.apply_update.assert_awaited_once()
+
+        resp = await self.client.get('/clipboard', headers=auth)
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(resp.content_type, 'image/png')
+        self.assertEqual(resp.headers['Cache-Control'], 'no-cache')
+        self.assertEqual(await resp.read(), data)
+        etag = resp.headers['ETag']
+
+        resp = await self.client.get(f"/clipboard/{header['hash']}",
+                                     headers=dict(auth, Range='bytes=100-'))
+        self.assertEqual(resp.status, 206)
+        self.assertEqual(resp.headers['Content-Range'], f'bytes 100-{len(data) - 1}/{len(data)}')
+        self.assertEqual(await resp.read(), data[100:])
+
+        resp = await self.client.get('/clipboard', headers=dict(auth, **{'If-None-Match': etag}))
+        self.assertEqual(resp.status, 304)
+        resp = await self.client.get('/clipboard', headers=dict(auth, Range=f'bytes={len(data)}-'))
+        self.assertEqual(resp.status, 416)
+        resp = await self.client.get('/clipboard')
+        self.assertEqual(resp.status, 403)
+
+    async def test_clipboard_put_rejects_bad_hash(self):
+        resp = await self.client.put('/clipboard?key=secret', data=b'abc',
+                                     headers={'X-Clipboard-Hash': '00'})
+        self.assertEqual(resp.status, 400)
+        self.manager.apply_update.assert_not_awaited()
+
+    async def test_blob_from_history(self):
+        history = self.use_history()
+        header, data = make_clipboard(b'saved earlier')
+        history.append(header, data)
+        history.flush()
+        resp = await self.client.get(f"/clipboard/{header['hash']}", params={'key': 'secret'})
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(resp.content_type, 'text/plain')
+        self.assertIn('immutable', resp.headers['Cache-Control'])
+        self.assertEqual(await resp.read(), b'saved earlier')
+        resp = await self.client.get('/clipboard/' + '0' * 64, params={'key': 'secret'})
+        self.assertEqual(resp.status, 404)
+        # Derived cache keys aren't addressable
+        resp = await self.client.get(f"/clipboard/{header['hash']}.zlib", params={'key': 'secret'})
+        self.assertEqual(resp.status, 404)
+
+
+class RoomTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = service.ClipboardServer(key='adminkey', rooms=True)
+        self.client = TestClient(TestServer(self.server.create_app()))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.server.close()
+
+    async def put(self, key, data):
+        return await self.client.put('/clipboard', data=data, headers={
+            'Authorization': f'Bearer {key}', 'Content-Type': 'text/plain'})
+
+    async def test_rooms_are_isolated(self):
+        resp = await self.put('room-one', b'first room')
+        self.assertEqual(resp.status, 201)
+        digest = (await resp.json())['hash']
+        self.assertEqual((await self.put('room-two', b'second room')).status, 201)
+
+        resp = await self.client.get('/clipboard', params={'key': 'room-one'})
+        self.assertEqual(await resp.read(), b'first room')
+        resp = await self.client.get('/clipboard', params={'key': 'room-two'})
+        self.assertEqual(await resp.read(), b'second room')
+        resp = await self.client.get(f'/clipboard/{digest}', params={'key': 'room-two'})
+        self.assertEqual(resp.status, 404)
+
+        self.assertEqual((await self.put('short', b'x')).status, 403)
+        resp = await self.client.get('/clipboard', params={'key': 'never-used'})
+        self.assertEqual(resp.status, 403)
+        resp = await self.client.get('/metrics', params={'key': 'adminkey'})
+        self.assertIn('bounceboard_rooms 2\n', await resp.text())
+
+    async def test_evicted_room_reopens_from_history(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        history = HistoryLog(path)
+        self.addCleanup(history.close)
+        with mock.patch.object(service, 'get_history', return_value=history):
+            await self.put('persistent', b'kept')
+            room = self.server._rooms['persistent']
+            room.history.flush()
+            with mock.patch.object(service, 'ROOM_IDLE_TIMEOUT', -1), \
+                    mock.patch.object(service, 'ROOM_SWEEP_INTERVAL', 0):
+                sweeper = asyncio.create_task(self.server._sweep_rooms())
+                while self.server._rooms:
+                    await asyncio.sleep(0.01)
+                sweeper.cancel()
+
+            resp = await self.client.get('/clipboard', params={'key': 'persistent'})
+            self.assertEqual(await resp.read(), b'kept')
+            self.assertEqual(os.listdir(os.path.join(path, 'rooms')), [room.id])
+
+    async def test_room_limit(self):
+        self.server.max_rooms = 2
+        await self.put('room-one', b'1')
+        await self.put('room-two', b'2')
+        await self.put('room-three', b'3')
+        self.assertEqual(set(self.server._rooms), {'room-two', 'room-three'})
+
+        for room in self.server._rooms.values():
+            room.add(mock.Mock())
+        resp = await self.put('room-four', b'4')
+        self.assertEqual(resp.status, 503)
+        self.assertEqual(set(self.server._rooms), {'room-two', 'room-three'})
+
+    async def test_rooms_without_clients_release_history(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        history = HistoryLog(path)
+        self.addCleanup(history.close)
+        with mock.patch.object(service, 'get_history', return_value=history):
+            await self.put('released', b'first')
+            room = self.server._rooms['released']
+            with mock.patch.object(service, 'ROOM_SWEEP_INTERVAL', 0):
+                sweeper = asyncio.create_task(self.server._sweep_rooms())
+                room.history.flush()
+                while room.history._segment_file:
+                    await asyncio.sleep(0.01)
+                sweeper.cancel()
+            self.assertIsNone(room.history.search._conn)
+
+            await self.put('released', b'second')
+            room.history.flush()
+            resp = await self.client.get('/history', params={'key': 'released'})
+            self.assertEqual(len((await resp.json())['entries']), 2)
+
+    async def test_rooms_share_history_writer(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        history = HistoryLog(path)
+        self.addCleanup(history.close)
+        with mock.patch.object(service, 'get_history', return_value=history):
+            for key in ('room-one', 'room-two', 'room-three'):
+                await self.put(key, key.encode())
+            writers = [thread for thread in threading.enumerate() if thread.name == 'history-writer']
+            # The test's own history and the one shared by the rooms
+            self.assertEqual(len(writers), 2)
+            for room in self.server._rooms.values():
+                room.history.flush()
+                self.assertEqual(bytes(room.history.latest()[1]), bytes(room.current[1]))
+
+
+class HeadlessTests(unittest.IsolatedAsyncioTestCase):
+    async def test_relay_without_backend(self):
+        manager = mock.Mock()
+        server = service.ClipboardServer(key='secret', headless=True, manager=manager)
+        client = TestClient(TestServer(server.create_app()))
+        await client.start_server()
+        self.addAsyncCleanup(client.close)
+
+        resp = await client.put('/clipboard?key=secret', data=b'relayed', headers={'Content-Type': 'text/plain'})
+        self.assertEqual(resp.status, 201)
+        conn = ClipboardConnection(await client.ws_connect('/ws/?key=secret'))
+        await conn.start(timeout=1)
+        self.addAsyncCleanup(conn.close)
+        async for header, data in conn:
+            self.assertEqual(bytes(data), b'relayed')
+            break
+        self.assertEqual(manager.mock_calls, [])
+
+
+class ResumeTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = service.ClipboardServer(key='secret', headless=True)
+        self.client = TestClient(TestServer(self.server.create_app()))
+        await self.client.start_server()
+        resp = await self.client.put('/clipboard?key=secret', data=b'current', headers={'Content-Type': 'text/plain'})
+        self.assertEqual(resp.status, 201)
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    async def connect(self, resume=None):
+        conn = ClipboardConnection(await self.client.ws_connect('/ws/?key=secret'))
+        await conn.start(timeout=1, resume=resume)
+        self.addAsyncCleanup(conn.close)
+        return conn
+
+    async def test_current_carries_seq(self):
+        conn = await self.connect()
+        async for header, data in conn:
+            self.assertEqual(header['seq'], 1)
+            self.assertEqual(bytes(data), b'current')
+            break
+
+    async def test_up_to_date_client_not_resent(self):
+        digest = hashlib.sha256(b'current').hexdigest()
+        conn = await self.connect(resume={'seq': 1, 'hash': digest})
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(conn.__aiter__().__anext__(), 0.3)
+
+    async def test_up_to_date_client_confirmed(self):
+        digest = hashlib.sha256(b'current').hexdigest()
+        conn = await self.connect(resume={'seq': 1, 'hash': digest})
+        await asyncio.wait_for(conn.current.wait(), 1)
+
+    async def test_stale_client_gets_current(self):
+        conn = await self.connect(resume={'seq': 0, 'hash': '0' * 64})
+        async for header, data in conn:
+            self.assertEqual(bytes(data), b'current')
+            break
+        self.assertFalse(conn.current.is_set())
+
+
+class BackoffTests(unittest.TestCase):
+    def test_reconnect_delay(self):
+        for attempt in range(20):
+            delay = service.reconnect_delay(attempt)
+            step = min(service.RECONNECT_MAX, service.RECONNECT_BASE * 2 ** attempt)
+            self.assertGreaterEqual(delay, step / 2)
+            self.assertLessEqual(delay, step)
+        self.assertGreater(service.reconnect_delay(20), service.RECONNECT_MAX / 2)
+
+
+class EndToEndTests(unittest.IsolatedAsyncioTestCase):
+    async def test_client_update_reaches_server(self):
+        server_clip, client_clip = [None], [make_clipboard(b'from client')]
+        server_manager = ClipboardManager(lambda: server_clip[0], lambda c, t=None: server_clip.__setitem__(0, c),
+                                          notifier=None, fingerprint=None)
+        client_manager = ClipboardManager(lambda: client_clip[0], None, notifier=None, fingerprint=None)
+        server = service.ClipboardServer(port=0, key='secret', manager=server_manager)
+        await server.listen(host='127.0.0.1')
+        self.addAsyncCleanup(server.close)
+        client = service.ClipboardClient(f'ws://127.0.0.1:{server.port}/ws/?key=secret', manager=client_manager)
+        task = asyncio.create_task(client.start())
+        try:
+            for _ in range(200):
+                if server_clip[0]:
+                    break
+                await asyncio.sleep(0.02)
+            self.assertEqual(server_clip[0][1], b'from client')
+            self.assertEqual(server.clients, 1)
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def test_connect_time_ends_at_first_sync(self):
+        server_manager = ClipboardManager(lambda: make_clipboard(b'on server'), None, notifier=None, fingerprint=None)
+        server = service.ClipboardServer(port=0, key='secret', manager=server_manager)
+        await server.listen(host='127.0.0.1')
+        self.addAsyncCleanup(server.close)
+        client_manager = ClipboardManager(lambda: None, None, notifier=None, fingerprint=None)
+        release = asyncio.Event()
+        applied = []
+
+        async def apply_update(clipboard):
+            await release.wait()
+            applied.append(clipboard)
+            return True
+
+        client_manager.apply_update = apply_update
+        client = service.ClipboardClient(f'ws://127.0.0.1:{server.port}/ws/?key=secret', manager=client_manager)
+        observed = service.CONNECT.value(tls='none')
+        task = asyncio.create_task(client.start())
+        try:
+            for _ in range(200):
+                if server.clients:
+                    break
+                await asyncio.sleep(0.02)
+            await asyncio.sleep(0.1)
+            # Connected, but not in sync until the server's clipboard is applied
+            self.assertEqual(service.CONNECT.value(tls='none'), observed)
+            release.set()
+            for _ in range(200):
+                if service.CONNECT.value(tls='none') > observed:
+                    break
+                await asyncio.sleep(0.02)
+            self.assertEqual(service.CONNECT.value(tls='none'), observed + 1)
+            self.assertEqual(applied[0][1], b'on server')
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,280 @@
+import unittest
+import asyncio
+import hashlib
+import os
+from unittest import mock
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer, TestClient
+
+from bounceboard import sync, compression, tracing
+from bounceboard.blobs import BlobCache
+from bounceboard.sync import ClipboardConnection
+
+from helpers import make_clipboard
+
+
+class SyncTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.received = asyncio.Queue()
+        self.blobs = BlobCache()
+        self.partial = None
+
+        async def handler(request):
+            ws = web.WebSocketResponse()
+            await ws.prepare(request)
+            conn = ClipboardConnection(ws, self.blobs, partial=self.partial)
+            await conn.start(timeout=0.2)
+            try:
+                async for clipboard in conn:
+                    await self.received.put(clipboard)
+            finally:
+                await conn.close()
+            return ws
+
+        app = web.Application()
+        app.router.add_get('/ws/', handler)
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    async def connect(self):
+        conn = ClipboardConnection(await self.client.ws_connect('/ws/'))
+        await conn.start(timeout=1)
+        self.addAsyncCleanup(conn.close)
+        return conn
+
+    async def test_chunked_transfer(self):
+        conn = await self.connect()
+        self.assertIn('chunked', conn.features)
+        clipboard = make_clipboard(os.urandom(10 * 1024 + 7), 'application/octet-stream')
+        with mock.patch.object(sync, 'CHUNK_SIZE', 1024), mock.patch.object(sync, 'CHUNK_WINDOW', 2):
+            await conn.send(clipboard)
+            header, data = await asyncio.wait_for(self.received.get(), 2)
+        self.assertEqual(header['hash'], clipboard[0]['hash'])
+        self.assertEqual(bytes(data), clipboard[1])
+
+    async def test_interrupted_transfer_resumes(self):
+        clipboard = make_clipboard(os.urandom(10 * 1024 + 7), 'application/octet-stream')
+        with mock.patch.object(sync, 'CHUNK_SIZE', 1024):
+            # What a dropped connection left behind: the first 4 chunks
+            self.partial = sync._Transfer({'id': 'old', 'header': dict(clipboard[0]), 'chunks': 11})
+            for seq in range(4):
+                self.partial.write(clipboard[1][seq * 1024:(seq + 1) * 1024])
+            conn = await self.connect()
+            conn.codec = None
+            conn.resume_from(self.partial.describe())
+            with mock.patch.object(conn.ws, 'send_bytes', wraps=conn.ws.send_bytes) as send_bytes:
+                await conn.send(clipboard)
+                header, data = await asyncio.wait_for(self.received.get(), 2)
+        self.assertEqual(send_bytes.call_count, 7)
+        self.assertEqual(header['hash'], clipboard[0]['hash'])
+        self.assertEqual(bytes(data), clipboard[1])
+
+    async def test_unresumable_transfer_resent(self):
+        clipboard = make_clipboard(os.urandom(10 * 1024 + 7), 'application/octet-stream')
+        with mock.patch.object(sync, 'CHUNK_SIZE', 1024), mock.patch.object(sync, 'CHUNK_WINDOW', 2):
+            conn = await self.connect()
+            conn.codec = None
+            # The peer claims a partial copy it doesn't have
+            conn.resume_from({'hash': clipboard[0]['hash'], 'encoding': None, 'delta': None,
+                              'chunks': 11, 'offset': 4 * 1024})
+            await conn.send(clipboard)
+            header, data = await asyncio.wait_for(self.received.get(), 2)
+        self.assertEqual(bytes(data), clipboard[1])
+
+    async def test_small_payload_single_message(self):
+        conn = await self.connect()
+        clipboard = make_clipboard(b'hello', 'text/plain')
+        await conn.send(clipboard)
+        self.assertEqual(await asyncio.wait_for(self.received.get(), 2), clipboard)
+
+    async def test_trace_gains_transfer_span(self):
+        conn = await self.connect()
+        header, data = make_clipboard(b'traced', 'text/plain')
+        conn.enqueue((tracing.add_span(header, 'backend.get', 1.0, 2.0), data))
+        received, _ = await asyncio.wait_for(self.received.get(), 2)
+        spans = received['trace']['spans']
+        self.assertEqual([s[0] for s in spans], ['backend.get', 'queue', 'transfer'])
+        self.assertEqual(spans[-1][2], spans[-2][3])
+
+    async def test_known_blob_not_resent(self):
+        clipboard = make_clipboard(os.urandom(sync.OFFER_SIZE), 'application/octet-stream')
+        first = await self.connect()
+        await first.send(clipboard)
+        await asyncio.wait_for(self.received.get(), 2)
+
+        second = await self.connect()
+        with mock.patch.object(second.ws, 'send_bytes') as send_bytes:
+            await second.send(clipboard)
+            header, data = await asyncio.wait_for(self.received.get(), 2)
+        send_bytes.assert_not_called()
+        self.assertEqual(header['hash'], clipboard[0]['hash'])
+        self.assertEqual(data, clipboard[1])
+
+    async def test_unanswered_offer_sends_payload(self):
+        clipboard = make_clipboard(os.urandom(sync.OFFER_SIZE), 'application/octet-stream')
+        conn = await self.connect()
+        send_json = conn.ws.send_json
+
+        async def drop_offers(message):
+            if message.get('op') != 'offer':
+                await send_json(message)
+
+        with mock.patch.object(conn.ws, 'send_json', side_effect=drop_offers), \
+                mock.patch.object(sync, 'OFFER_TIMEOUT', 0.1):
+            await conn.send(clipboard)
+            header, data = await asyncio.wait_for(self.received.get(), 2)
+        self.assertEqual(bytes(data), clipboard[1])
+
+    async def test_compressed_transfer(self):
+        conn = await self.connect()
+        self.assertEqual(conn.codec, compression.CODECS[0])
+        text = b'the quick brown fox jumps over the lazy dog\n' * 2000
+        clipboard = make_clipboard(text, 'text/plain')
+        with mock.patch.object(sync, 'CHUNK_SIZE', 1024):
+            await conn.send(clipboard)
+            header, data = await asyncio.wait_for(self.received.get(), 2)
+        self.assertNotIn('encoding', header)
+        self.assertEqual(bytes(data), text)
+        encoded = self.blobs.get(f"{header['hash']}.{conn.codec}")
+        self.assertLess(len(encoded), len(text))
+
+    async def test_delta_transfer(self):
+        conn = await self.connect()
+        lines = [f'{i:08d} log line with some repeated text\n'.encode() for i in range(2000)]
+        first = make_clipboard(b''.join(lines), 'text/plain')
+        await conn.send(first)
+        await asyncio.wait_for(self.received.get(), 2)
+
+        lines[1000] = b'an edited line\n'
+        second = make_clipboard(b''.join(lines), 'text/plain')
+        with mock.patch.object(conn.ws, 'send_bytes', wraps=conn.ws.send_bytes) as send_bytes, \
+                mock.patch.object(sync, '_rebuild', wraps=sync._rebuild) as rebuild:
+            await conn.send(second)
+            header, data = await asyncio.wait_for(self.received.get(), 2)
+        self.assertEqual(bytes(data), second[1])
+        self.assertNotIn('delta', header)
+        self.assertEqual(rebuild.call_count, 1)
+        self.assertLess(len(send_bytes.call_args[0][0]), 1024)
+
+    async def test_delta_without_base_is_resent(self):
+        conn = await self.connect()
+        text = b'some text that the server has never seen\n' * 1000
+        conn._base = ('0' * 64, text)
+        conn.blobs.put('0' * 64, text)
+        clipboard = make_clipboard(text + b'one more line\n', 'text/plain')
+        await conn.send(clipboard)
+        header, data = await asyncio.wait_for(self.received.get(), 2)
+        self.assertEqual(header['hash'], clipboard[0]['hash'])
+        self.assertEqual(bytes(data), clipboard[1])
+
+    async def test_update_is_one_frame(self):
+        conn = await self.connect()
+        self.assertIn('frames', conn.features)
+        clipboard = make_clipboard(b'framed', 'text/plain')
+        with mock.patch.object(conn.ws, 'send_json', wraps=conn.ws.send_json) as send_json, \
+                mock.patch.object(conn.ws, 'send_bytes', wraps=conn.ws.send_bytes) as send_bytes:
+            await conn.send(clipboard)
+            self.assertEqual(await asyncio.wait_for(self.received.get(), 2), clipboard)
+        send_json.assert_not_called()
+        kind, header, payload = sync.unpack_frame(send_bytes.call_args[0][0])
+        self.assertEqual((kind, header, bytes(payload)), (sync.FRAME_UPDATE, clipboard[0], b'framed'))
+
+    async def test_malformed_frame_dropped(self):
+        conn = await self.connect()
+        await conn.ws.send_bytes(b'\x09\x01\x00\x00\x00\x00')
+        await conn.ws.send_bytes(sync.pack_frame(sync.FRAME_UPDATE, {'type': 'text/plain'}, b'ok'))
+        header, data = await asyncio.wait_for(self.received.get(), 2)
+        self.assertEqual(data, b'ok')
+        with self.assertRaises(ValueError):
+            sync.unpack_frame(sync.pack_frame(sync.FRAME_UPDATE, {'a': 1})[:-1])
+
+    async def test_oversized_update_dropped(self):
+        conn = await self.connect()
+        bomb = compression.encode('zlib', {'type': 'text/plain'}, b'\0' * 100000)
+        await conn.ws.send_bytes(sync.pack_frame(
+            sync.FRAME_UPDATE, {'type': 'text/plain', 'size': 10, 'encoding': 'zlib'}, bomb))
+        await conn.ws.send_bytes(sync.pack_frame(sync.FRAME_UPDATE, {'type': 'text/plain', 'size': 2}, b'ok'))
+        header, data = await asyncio.wait_for(self.received.get(), 2)
+        self.assertEqual(data, b'ok')
+
+    async def test_corrupt_update_dropped(self):
+        conn = await self.connect()
+        header, data = make_clipboard(b'claimed', 'text/plain')
+        await conn.ws.send_bytes(sync.pack_frame(sync.FRAME_UPDATE, header, b'actual'))
+        await conn.ws.send_bytes(sync.pack_frame(sync.FRAME_UPDATE, *make_clipboard(b'ok', 'text/plain')))
+        received, data = await asyncio.wait_for(self.received.get(), 2)
+        self.assertEqual(data, b'ok')
+        self.assertIsNone(self.blobs.get(header['hash']))
+
+    async def test_chunked_bomb_aborted(self):
+        ws = await self.client.ws_connect('/ws/')
+        self.assertEqual((await ws.receive_json())['op'], 'hello')
+        await ws.send_json({'op': 'hello', 'features': ['chunked', 'zlib']})
+        bomb = compression.encode('zlib', {'type': 'text/plain'}, b'\0' * (4 * 1024 * 1024))
+        half = len(bomb) // 2
+        await ws.send_json({'op': 'begin', 'id': 'bomb', 'chunks': 2,
+                            'header': {'type': 'text/plain', 'size': 10, 'encoding': 'zlib'}})
+        await ws.send_bytes(bomb[:half])
+        self.assertEqual(await asyncio.wait_for(ws.receive_json(), 2), {'op': 'abort', 'id': 'bomb'})
+        await ws.send_bytes(bomb[half:])
+        await ws.send_json({'op': 'commit', 'id': 'bomb'})
+        await ws.send_json({'type': 'text/plain', 'size': 2})
+        await ws.send_bytes(b'ok')
+        header, data = await asyncio.wait_for(self.received.get(), 2)
+        self.assertEqual(data, b'ok')
+        await ws.close()
+
+    async def test_peer_without_frames(self):
+        ws = await self.client.ws_connect('/ws/')
+        self.assertEqual((await ws.receive_json())['op'], 'hello')
+        await ws.send_json({'op': 'hello', 'features': ['chunked']})
+        await ws.send_json({'type': 'text/plain', 'size': 2})
+        await ws.send_bytes(b'hi')
+        header, data = await asyncio.wait_for(self.received.get(), 2)
+        self.assertEqual(data, b'hi')
+        await ws.close()
+
+    async def test_basic_peer(self):
+        ws = await self.client.ws_connect('/ws/')
+        self.assertEqual((await ws.receive_json())['op'], 'hello')
+        await ws.send_json({'type': 'text/plain', 'size': 2})
+        await ws.send_bytes(b'hi')
+        header, data = await asyncio.wait_for(self.received.get(), 2)
+        self.assertEqual(data, b'hi')
+        self.assertEqual(header['hash'], hashlib.sha256(b'hi').hexdigest())
+        await ws.close()
+
+
+
+class OutboxTests(unittest.IsolatedAsyncioTestCase):
+    async def test_slow_peer_gets_latest_state(self):
+        conn = ClipboardConnection(mock.Mock())
+        release = asyncio.Event()
+        sent = []
+
+        async def slow_send(clipboard):
+            sent.append(clipboard)
+            await release.wait()
+
+        clips = [make_clipboard(bytes([i]), 'application/octet-stream') for i in range(4)]
+        with mock.patch.object(conn, 'send', side_effect=slow_send):
+            for clipboard in clips:
+                conn.enqueue(clipboard)
+                await asyncio.sleep(0)
+            self.assertEqual(conn.backlog, 2)
+            release.set()
+            while conn.backlog:
+                await asyncio.sleep(0)
+        await conn.close()
+        self.assertEqual([header['hash'] for header, _ in sent], [clips[0][0]['hash'], clips[3][0]['hash']])
+        # The queued header is a traced copy; the caller's header is left alone
+        self.assertEqual(sent[1][0]['trace']['spans'][-1][0], 'queue')
+        self.assertNotIn('trace', clips[3][0])
+
+
+if __name__ == '__main__':
+    unittest.main()
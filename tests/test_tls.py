@@ -0,0 +1,50 @@
+import asyncio
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from bounceboard import service
+from bounceboard.clipboard.manager import ClipboardManager
+from bounceboard.metrics import CONNECT
+from bounceboard.tls import server_context
+
+
+@unittest.skipUnless(shutil.which('openssl'), 'openssl is needed to make a test certificate')
+class ResumptionTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.cert, self.key = os.path.join(self.dir, 'cert.pem'), os.path.join(self.dir, 'key.pem')
+        subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                        '-subj', '/CN=localhost', '-keyout', self.key, '-out', self.cert],
+                       check=True, capture_output=True)
+
+    async def wait_for(self, condition):
+        for _ in range(200):
+            if condition():
+                return
+            await asyncio.sleep(0.02)
+        self.fail('timed out')
+
+    async def test_reconnect_resumes_session(self):
+        server = service.ClipboardServer(port=0, key='secret', headless=True)
+        await server.listen(host='127.0.0.1', ssl_context=server_context(self.cert, self.key))
+        self.addAsyncCleanup(server.close)
+        manager = ClipboardManager(lambda: None, None, notifier=None, fingerprint=None)
+        client = service.ClipboardClient(f'https://127.0.0.1:{server.port}/?key=secret', manager=manager)
+        resumed = CONNECT.value(tls='resumed')
+        task = asyncio.create_task(client.start())
+        try:
+            await self.wait_for(lambda: server.clients == 1)
+            for conn in server._connections():
+                await conn.ws.close()
+            await self.wait_for(lambda: CONNECT.value(tls='resumed') > resumed)
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
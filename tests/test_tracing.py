@@ -0,0 +1,52 @@
+import json
+import os
+import tempfile
+import unittest
+
+from bounceboard import tracing
+
+
+class TracingTests(unittest.TestCase):
+    def test_add_span_replaces_trace(self):
+        header = {'hash': 'a'}
+        tracing.add_span(header, 'backend.get', 1.0, 2.0)
+        shared = dict(header)
+        tracing.add_span(header, 'queue', 2.0, 3.0)
+        self.assertEqual(header['trace']['id'], shared['trace']['id'])
+        self.assertEqual([s[0] for s in header['trace']['spans']], ['backend.get', 'queue'])
+        self.assertEqual(len(shared['trace']['spans']), 1)
+        self.assertEqual(tracing.last_end(header), 3.0)
+        self.assertIsNone(tracing.last_end({'trace': 'bogus'}))
+
+    def test_collect_timed_spans(self):
+        def work():
+            with tracing.timed('hash'):
+                return 42
+
+        result, spans = tracing.collect(work)
+        self.assertEqual(result, 42)
+        self.assertEqual([s[0] for s in spans], ['hash'])
+
+    def test_record_writes_chrome_events(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, path)
+        header = {'hash': 'a', 'type': 'text/plain'}
+        tracing.add_span(header, 'backend.get', 1.0, 1.5)
+        header['trace']['spans'].append(['bad'])
+
+        tracing.open_trace(path)
+        try:
+            tracing.record(header)
+        finally:
+            tracing.close_trace()
+        with open(path) as f:
+            events = json.loads(f.read().rstrip().rstrip(',') + ']')
+        spans = [e for e in events if e['ph'] == 'X']
+        self.assertEqual(len(spans), 1)
+        self.assertEqual(spans[0]['name'], 'backend.get')
+        self.assertEqual((spans[0]['ts'], spans[0]['dur']), (1000000, 500000))
+
+
+if __name__ == '__main__':
+    unittest.main()
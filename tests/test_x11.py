@@ -0,0 +1,77 @@
+import os
+import shutil
+import subprocess
+import unittest
+from unittest import mock
+
+from bounceboard.clipboard import x11
+
+from helpers import make_clipboard
+
+
+class TargetTests(unittest.TestCase):
+    def test_text_offered_as_every_text_target(self):
+        targets = x11.selection_targets(*make_clipboard('héllo'.encode()))
+        self.assertEqual(set(targets), set(x11.TEXT_TARGETS))
+        self.assertEqual(targets['UTF8_STRING'], 'héllo'.encode())
+        self.assertEqual(targets['STRING'], 'héllo'.encode('latin-1'))
+
+    def test_alternate_text(self):
+        targets = x11.selection_targets(*make_clipboard(b'<b>hi</b>', 'text/html', text='hi'))
+        self.assertEqual(targets['text/html'], b'<b>hi</b>')
+        self.assertEqual(targets['UTF8_STRING'], b'hi')
+
+
+@unittest.skipUnless(shutil.which('Xvfb'), 'Xvfb is not installed')
+class SelectionTests(unittest.TestCase):
+    def setUp(self):
+        read, write = os.pipe()
+        self.xvfb = subprocess.Popen(['Xvfb', '-displayfd', str(write), '-nolisten', 'tcp'],
+                                     pass_fds=[write], stderr=subprocess.DEVNULL)
+        os.close(write)
+        with os.fdopen(read) as f:
+            display = f.readline().strip()
+        self.addCleanup(self.xvfb.wait)
+        self.addCleanup(self.xvfb.terminate)
+        env = mock.patch.dict(os.environ, {'DISPLAY': f':{display}'})
+        env.start()
+        self.addCleanup(env.stop)
+        self.owner = self.connect()
+        self.reader = self.connect()
+
+    def connect(self):
+        clipboard = x11.X11Clipboard()
+        self.addCleanup(clipboard.close)
+        return clipboard
+
+    def test_text_round_trip(self):
+        clipboard = make_clipboard(b'hello from bounceboard')
+        self.assertTrue(self.owner.set_content(clipboard))
+        self.assertEqual(self.reader.get_content(), clipboard)
+
+    def test_alternate_text_target(self):
+        clipboard = make_clipboard(b'<i>rich</i>', 'text/html', text='rich')
+        self.owner.set_content(clipboard)
+        header, data = self.reader.get_content()
+        self.assertEqual((header['type'], data, header['text']), ('text/html', b'<i>rich</i>', 'rich'))
+        with self.reader._reader_lock:
+            self.assertIn('UTF8_STRING', self.reader._targets_offered())
+
+    def test_large_payload_uses_incr(self):
+        data = os.urandom(x11.INCR_CHUNK * 3 + 5)
+        self.owner.set_content(make_clipboard(data, 'image/png'))
+        header, received = self.reader.get_content()
+        self.assertEqual(header['type'], 'image/png')
+        self.assertEqual(received, data)
+
+    def test_losing_ownership(self):
+        self.owner.set_content(make_clipboard(b'first'))
+        before = self.owner.get_fingerprint()
+        second = make_clipboard(b'second')
+        self.reader.set_content(second)
+        self.assertEqual(self.owner.get_content(), second)
+        self.assertNotEqual(self.owner.get_fingerprint(), before)
+
+
+if __name__ == '__main__':
+    unittest.main()